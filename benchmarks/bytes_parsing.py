@@ -0,0 +1,61 @@
+"""
+Benchmarks the peak memory and time taken to parse XML bytes of increasing size: decoded to a string first, as
+string_to_element did, and as bytes, which the parser decodes in the encoding they declare.
+Peak memory is measured with tracemalloc in a second run, above the memory taken by the XML bytes.
+
+Run from the repository root with: python -m benchmarks.bytes_parsing
+"""
+
+import gc
+import time
+import tracemalloc
+
+from parserutils.elements import string_to_element
+
+
+SIZES = (10000, 100000, 250000)
+
+
+def build_records(size):
+    records = ''.join(f'<record id="{i}"><name>récord {i}</name><value>{i}</value></record>' for i in range(size))
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<records>{records}</records>'.encode('UTF-8')
+
+
+def measure(parse, content):
+    """ :return: the least seconds taken to parse the content in three runs, and the peak bytes allocated """
+
+    elapsed = None
+
+    for _ in range(3):
+        gc.collect()
+
+        started = time.perf_counter()
+        parse(content)
+        elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()  # Traced in a second run, since tracing slows allocation down
+
+    parse(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    for size in SIZES:
+        content = build_records(size)
+        print(f'{size:,} records, {len(content) / 1024 / 1024:.1f} MB')
+
+        functions = (
+            ('decoded', lambda xml: string_to_element(xml.decode('UTF-8'))),
+            ('bytes', lambda xml: string_to_element(xml)),
+        )
+        for name, function in functions:
+            elapsed, peak = measure(function, content)
+            print(f'  {name:<8} {elapsed:8.3f} s {peak / 1024 / 1024:10.2f} MB peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Benchmarks reading three values from a large parsed element: from the element itself,
+from the lazy element_to_mapping view, and from the eager element_to_dict conversion.
+
+Run from the repository root with: python -m benchmarks.element_mapping
+"""
+
+import timeit
+
+from parserutils.elements import element_to_dict, element_to_mapping, get_element
+
+
+SIZES = (1000, 10000, 100000)
+
+
+def build_records(size):
+    records = ''.join(f'<record id="{i}"><name>record {i}</name><value>{i}</value></record>' for i in range(size))
+    return f'<records><title>Records</title>{records}</records>'
+
+
+def read_element(element):
+    return element.tag, element[0].text, element[1].attrib['id']
+
+
+def read_converted(convert, element):
+    converted = convert(element)
+    children = converted['children']
+    return converted['name'], children[0]['text'], children[1]['attributes']['id']
+
+
+def main():
+    for size in SIZES:
+        element = get_element(build_records(size))
+        print(f'{size:,} records')
+
+        functions = (
+            ('element', lambda: read_element(element)),
+            ('element_to_mapping', lambda: read_converted(element_to_mapping, element)),
+            ('element_to_dict', lambda: read_converted(element_to_dict, element)),
+        )
+        for name, function in functions:
+            elapsed = min(timeit.repeat(function, number=10, repeat=3)) / 10
+            print(f'  {name:<20} {elapsed * 1000000:12.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmarks the memory taken by element_to_node against element_to_dict, for trees of increasing size.
+Memory is measured with tracemalloc once the parsed tree has been freed, so only what each form keeps is counted.
+
+Run from the repository root with: python -m benchmarks.element_nodes
+"""
+
+import gc
+import tracemalloc
+
+from parserutils.elements import element_to_dict, element_to_node, get_element
+
+
+SIZES = (1000, 10000, 100000)
+
+
+def build_records(size):
+    """ A flat document of records, each with a few leaf children and attributes on some of them """
+
+    records = ''.join(
+        f'<record id="{i}"><name>record {i}</name><value type="int">{i}</value><empty/></record>'
+        for i in range(size // 4)
+    )
+    return f'<records>{records}</records>'
+
+
+def measure(convert, xml_content):
+    """ :return: the number of nodes converted, and the bytes retained by their converted form """
+
+    element = get_element(xml_content)
+    node_count = sum(1 for _ in element.iter())
+
+    gc.collect()
+    tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    converted = convert(element)
+
+    del element
+    gc.collect()
+
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    del converted
+    return node_count, retained
+
+
+def main():
+    for size in SIZES:
+        xml_content = build_records(size)
+        print(f'{len(xml_content):,} chars')
+
+        results = {}
+        for convert in (element_to_dict, element_to_node):
+            node_count, retained = measure(convert, xml_content)
+            results[convert.__name__] = retained
+            print(f'  {convert.__name__:<16} {node_count:>8,} nodes: {retained / node_count:8.1f} bytes per node')
+
+        ratio = results['element_to_dict'] / results['element_to_node']
+        print(f'  element_to_dict takes {ratio:.2f}x the memory of element_to_node')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Benchmarks finding elements at several hundred distinct paths, more than ElementPath caches before emptying its
+cache, with Element.findall and with get_elements, which keeps its own cache of compiled paths.
+
+Run from the repository root with: python -m benchmarks.element_paths
+"""
+
+import timeit
+
+from parserutils.elements import get_elements, get_element, get_path_cache_info, set_path_cache_size
+
+
+PATH_COUNTS = (50, 100, 200, 400)
+
+
+def build_document(path_count, field_count=20):
+    """ A small document of fields, and distinct paths to find them, so that most of the time is in compiling """
+
+    fields = ''.join(f'<field type="t{i}"><value>{i}</value></field>' for i in range(field_count))
+    element_paths = [
+        f'fields/field[@type="t{i % field_count}"]/value[{i // field_count + 1}]' for i in range(path_count)
+    ]
+
+    return get_element(f'<root><fields>{fields}</fields></root>'), element_paths
+
+
+def main():
+    set_path_cache_size()
+
+    for path_count in PATH_COUNTS:
+        element, element_paths = build_document(path_count)
+        print(f'{path_count} paths')
+
+        functions = (
+            ('Element.findall', lambda: [element.findall(path) for path in element_paths]),
+            ('get_elements', lambda: [get_elements(element, path) for path in element_paths]),
+        )
+        for name, function in functions:
+            elapsed = min(timeit.repeat(function, number=10, repeat=3)) / 10
+            print(f'  {name:<16} {elapsed * 1000000 / path_count:8.2f} us per path')
+
+        print(f'  {get_path_cache_info()}')
+
+
+if __name__ == '__main__':
+    main()
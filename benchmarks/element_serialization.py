@@ -0,0 +1,60 @@
+"""
+Benchmarks the peak memory and time taken to serialize trees of increasing size: to a string with
+element_to_string, to bytes with element_to_bytes, and in chunks written to a file with write_element.
+Peak memory is measured with tracemalloc in a second run, above the memory taken by the parsed tree.
+
+Run from the repository root with: python -m benchmarks.element_serialization
+"""
+
+import gc
+import os
+import time
+import tracemalloc
+
+from parserutils.elements import element_to_bytes, element_to_string, get_element, write_element
+
+
+SIZES = (10000, 100000, 250000)
+
+
+def build_records(size):
+    records = ''.join(f'<record id="{i}"><name>record {i}</name><value>{i}</value></record>' for i in range(size))
+    return f'<records>{records}</records>'
+
+
+def measure(serialize, element):
+    """ :return: the seconds taken to serialize the element, and the peak bytes allocated doing it """
+
+    gc.collect()
+
+    started = time.perf_counter()
+    serialize(element)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()  # Traced in a second run, since tracing slows allocation down
+
+    serialize(element)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    with open(os.devnull, 'wb') as devnull:
+        for size in SIZES:
+            element = get_element(build_records(size))
+            print(f'{size:,} records')
+
+            functions = (
+                ('element_to_string', lambda elem: element_to_string(elem, include_declaration=False)),
+                ('element_to_bytes', lambda elem: element_to_bytes(elem, include_declaration=False)),
+                ('write_element', lambda elem: write_element(elem, devnull)),
+            )
+            for name, function in functions:
+                elapsed, peak = measure(function, element)
+                print(f'  {name:<18} {elapsed:8.3f} s {peak / 1024 / 1024:10.2f} MB peak')
+
+
+if __name__ == '__main__':
+    main()
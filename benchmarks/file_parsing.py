@@ -0,0 +1,68 @@
+"""
+Benchmarks the peak memory and time taken to parse local files of increasing size: by reading all of the file
+and parsing its content, as get_remote_element did, and by passing a Path to get_element, which feeds the parser
+from a memory map of the file. Each is run in its own process, so its peak resident memory can be compared.
+
+Run from the repository root with: python -m benchmarks.file_parsing
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+
+SIZES = (10000, 100000, 500000)
+
+PARSE_SCRIPT = '''
+import pathlib, resource, sys, time
+from parserutils.elements import get_element
+
+method, file_path = sys.argv[1:]
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+
+if method == 'read_all':
+    with open(file_path, 'rb') as xml:
+        element = get_element(xml.read())
+else:
+    element = get_element(pathlib.Path(file_path))
+
+elapsed = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+print(elapsed, peak * (1 if sys.platform == 'darwin' else 1024))
+'''
+
+
+def build_records(size):
+    records = ''.join(f'<record id="{i}"><name>record {i}</name><value>{i}</value></record>' for i in range(size))
+    return f'<records>{records}</records>'.encode()
+
+
+def measure(method, file_path):
+    """ :return: the seconds taken to parse the file, and the growth in peak resident memory parsing it """
+
+    result = subprocess.run(
+        (sys.executable, '-c', PARSE_SCRIPT, method, file_path), capture_output=True, check=True, text=True
+    )
+    elapsed, peak = result.stdout.split()
+    return float(elapsed), int(peak)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, 'records.xml')
+
+        for size in SIZES:
+            with open(file_path, 'wb') as xml:
+                xml.write(build_records(size))
+
+            print(f'{size:,} records, {os.path.getsize(file_path) / 1024 / 1024:.1f} MB')
+
+            for method in ('read_all', 'mmap'):
+                elapsed, peak = measure(method, file_path)
+                print(f'  {method:<10} {elapsed:8.3f} s {peak / 1024 / 1024:10.2f} MB peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmarks strip_namespaces against the regex implementation it replaced, using adversarial inputs.
+Each input is scaled up by doubling, so linear time shows up as a ratio of about 2 between sizes.
+
+Run from the repository root with: python -m benchmarks.strip_namespaces
+"""
+
+import re
+import timeit
+
+from parserutils.elements import strip_namespaces
+
+
+_NAMESPACES_FROM_DEC_REGEX = re.compile(r"""(<[^>]*)\sxmlns[^"'>]+["'][^"'>]+["']""")
+_NAMESPACES_FROM_TAG_REGEX = re.compile(r'(</?)[\w\-.]+:')
+_NAMESPACES_FROM_ATTR_REGEX = re.compile(r'(\s+)([\w\-.]+:)([\w\-.]+\s*=)')
+
+SIZES = (250, 500, 1000, 2000)
+
+
+def legacy_strip_namespaces(xml_content):
+    """ The multi-pass regex implementation, kept for comparison """
+
+    while _NAMESPACES_FROM_DEC_REGEX.search(xml_content) is not None:
+        xml_content = _NAMESPACES_FROM_DEC_REGEX.sub(r'\1', xml_content)
+
+    xml_content = _NAMESPACES_FROM_TAG_REGEX.sub(r'\1', xml_content)
+    xml_content = _NAMESPACES_FROM_ATTR_REGEX.sub(r'\1\3', xml_content)
+
+    return xml_content
+
+
+def declarations_in_one_tag(size):
+    """ A root tag with size namespace declarations: the legacy loop rescans once per declaration """
+
+    declarations = ' '.join(f'xmlns:ns{i}="http://example.com/ns{i}"' for i in range(size))
+    return f'<ns0:root {declarations}><ns0:child ns1:attr="value">text</ns0:child></ns0:root>'
+
+
+def declarations_in_every_tag(size):
+    """ A flat document where every record redeclares its own namespaces """
+
+    declarations = ' '.join(f'xmlns:ns{i}="http://example.com/ns{i}"' for i in range(20))
+    records = ''.join(f'<ns1:record {declarations} ns2:id="{i}">{i}</ns1:record>' for i in range(size))
+    return f'<root>{records}</root>'
+
+
+def unterminated_markup(size):
+    """ Many tags and attribute values left open, which must not be rescanned from each one """
+
+    return '<root>' + '<a:b c:d="' * size + '<!-- ' + 'x:y ' * size
+
+
+def prefixed_text(size):
+    """ Text full of tag-like and attribute-like content that is not markup """
+
+    return '<root xmlns:a="urn:a">' + 'a:b c:d=e &lt;f:g ' * size * 10 + '</root>'
+
+
+def processing_instructions(size):
+    """ Many processing instructions before the only prefixed tag, each of which stops a skip ahead """
+
+    return '<root>' + '<?pi data?>' * size * 10 + '<a:b xmlns:a="urn:a"/></root>'
+
+
+def late_comment(size):
+    """ Many plain tags, with a single comment just before the only prefixed tag """
+
+    return '<root>' + '<record id="1">value</record>' * size * 10 + '<!-- c --><a:b xmlns:a="urn:a"/></root>'
+
+
+def run_benchmark(name, builder, strip_function, number=3):
+    print(f'  {strip_function.__name__}')
+
+    last_time = None
+    for size in SIZES:
+        xml_content = builder(size)
+        elapsed = min(timeit.repeat(lambda: strip_function(xml_content), number=number, repeat=3)) / number
+
+        ratio = f'{elapsed / last_time:5.2f}x' if last_time else '     -'
+        print(f'    {len(xml_content):>10,} chars: {elapsed * 1000:10.3f} ms  {ratio}')
+
+        last_time = elapsed
+
+
+def main():
+    benchmarks = (
+        ('declarations in one tag', declarations_in_one_tag),
+        ('declarations in every tag', declarations_in_every_tag),
+        ('unterminated markup', unterminated_markup),
+        ('prefixed text', prefixed_text),
+        ('processing instructions', processing_instructions),
+        ('late comment', late_comment),
+    )
+
+    for name, builder in benchmarks:
+        print(name)
+        run_benchmark(name, builder, strip_namespaces)
+        run_benchmark(name, builder, legacy_strip_namespaces)
+
+
+if __name__ == '__main__':
+    main()
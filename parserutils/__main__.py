@@ -0,0 +1,44 @@
+"""
+Command line access to batch operations on XML files:
+    python -m parserutils strip input.xml output.xml
+"""
+
+import argparse
+import sys
+
+from .elements import _DEFAULT_CHUNK_SIZE, write_stripped_xml
+
+
+def strip(args):
+    """ Streams the input file to the output file, without namespaces or the XML declaration """
+
+    in_file = sys.stdin.buffer if args.input == '-' else args.input
+    out_file = sys.stdout.buffer if args.output == '-' else args.output
+
+    write_stripped_xml(
+        in_file, out_file,
+        include_namespaces=args.keep_namespaces,
+        include_declaration=not args.strip_declaration,
+        chunk_size=args.chunk_size
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m parserutils', description='Batch operations on XML files')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    strip_parser = commands.add_parser('strip', help='stream a file without namespaces or the XML declaration')
+    strip_parser.add_argument('input', help='the XML file to strip, or - for stdin')
+    strip_parser.add_argument('output', nargs='?', default='-', help='the file to write, or - for stdout')
+    strip_parser.add_argument('--keep-namespaces', action='store_true', help='do not strip namespaces')
+    strip_parser.add_argument('--strip-declaration', action='store_true', help='strip the XML declaration')
+    strip_parser.add_argument('--chunk-size', type=int, default=_DEFAULT_CHUNK_SIZE, help='bytes to read at a time')
+    strip_parser.set_defaults(run=strip)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,47 @@ Encapsulates all implementation specific functionality for XML parsing
 Contains an API defining all operations executable against an XML tree
 """
 
+import bz2
+import codecs
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
 import re
+import shutil
 import string
-
+import sys
+import threading
+import weakref
+import zipfile
+import zlib
+
+from collections import deque, namedtuple, OrderedDict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager, ExitStack
+from copy import deepcopy
 from defusedxml.cElementTree import fromstring, tostring
-from defusedxml.cElementTree import iterparse
+from defusedxml.cElementTree import iterparse, ParseError, XMLParser
+from defusedxml.common import EntitiesForbidden
+from functools import lru_cache, partial, wraps
+from itertools import islice
 from urllib.request import urlopen
+from xml.etree import ElementPath
 from xml.etree.cElementTree import ElementTree, Element
-from xml.etree.cElementTree import iselement
+from xml.etree.cElementTree import iselement, TreeBuilder
+from xml.etree.cElementTree import Comment, ProcessingInstruction, QName
+from xml.etree.ElementTree import _escape_attrib, _escape_cdata, _namespaces
+from xml.parsers.expat import errors as expat_errors
+from xml.parsers.expat import ExpatError, ParserCreate
 
 from .strings import DEFAULT_ENCODING, STRING_TYPES
 
 ElementType = type(Element(None))  # Element module doesn't have a type
+DocumentResult = namedtuple('DocumentResult', ('source', 'result', 'error'))
+ParseCacheInfo = namedtuple('ParseCacheInfo', ('hits', 'misses', 'entries', 'size', 'max_entries', 'max_size'))
 
 
 XPATH_DELIM = '/'
@@ -24,10 +53,29 @@ _ABS_FILE_REGEX = {
     'win': r'([A-Za-z]{1}:[\/\\]{1})|([\\]{2})'
 }
 _FILE_LOCATION_REGEX = re.compile(r'^({win})|({lin})'.format(**_ABS_FILE_REGEX))
-_NAMESPACES_FROM_DEC_REGEX = re.compile(r"""(<[^>]*)\sxmlns[^"'>]+["'][^"'>]+["']""")
-_NAMESPACES_FROM_TAG_REGEX = re.compile(r'(</?)[\w\-.]+:')
-_NAMESPACES_FROM_ATTR_REGEX = re.compile(r'(\s+)([\w\-.]+:)([\w\-.]+\s*=)')
-_XML_DECLARATION_REGEX = re.compile(r'^\s*<\?xml[\w\s{punc}]*\?>\s*'.format(punc=string.punctuation))
+_XML_DECLARATION_REGEX = re.compile(r'^\s*<\?xml[\w\s{punc}]*?\?>\s*'.format(punc=string.punctuation))
+_XML_MISPLACED_DECLARATION = expat_errors.codes[expat_errors.XML_ERROR_MISPLACED_XML_PI]
+_XML_NO_ELEMENTS = expat_errors.codes[expat_errors.XML_ERROR_NO_ELEMENTS]
+_XML_UNBOUND_PREFIX = expat_errors.codes[expat_errors.XML_ERROR_UNBOUND_PREFIX]
+_XML_BYTES_TYPES = (bytes, bytearray, memoryview)
+
+_SORTED_ATTRIBUTES = sys.version_info < (3, 8)  # ElementTree serializes attributes in lexical order until 3.8
+
+_DEFAULT_CHUNK_SIZE = 1024 * 1024
+_DEFAULT_SHARD_SIZE = 32 * _DEFAULT_CHUNK_SIZE
+_DEFAULT_CACHE_ENTRIES = 128
+_DEFAULT_PATH_CACHE_SIZE = 1024
+_DEFAULT_CACHE_SIZE = 64 * _DEFAULT_CHUNK_SIZE
+
+_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+_COMPRESSION_TYPES = {'gzip', 'bz2', 'xz'}
+_DECOMPRESSION_EXTENSIONS = dict(_COMPRESSION_EXTENSIONS, **{'.zip': 'zip'})
+_DECOMPRESSION_MAGIC = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz'), (b'PK\x03\x04', 'zip'))
+
+_STREAM_PATH_PREDICATE_REGEX = re.compile(r'''\[@([^\]=]+)(=(?:"([^"]*)"|'([^']*)'))?\]''')
+_STREAM_PATH_STEP_REGEX = re.compile(
+    r'''(//?)?((?:\{[^}]*\})?[^/\[\]{}]+)((?:\[@[^\]=]+(?:=(?:"[^"]*"|'[^']*'))?\])*)'''
+)
 
 _ELEM_NAME = 'name'
 _ELEM_TEXT = 'text'
@@ -35,11 +83,65 @@ _ELEM_TAIL = 'tail'
 _ELEM_ATTRIBS = 'attributes'
 _ELEM_CHILDREN = 'children'
 
+# A compact, immutable alternative to the dict produced by element_to_dict: children are a tuple of nodes,
+# and empty attributes are None, so a leaf node takes a fraction of the memory of its dict
+ElementNode = namedtuple('ElementNode', (_ELEM_NAME, _ELEM_TEXT, _ELEM_TAIL, _ELEM_ATTRIBS, _ELEM_CHILDREN))
+
+_ELEMENT_PATH_CHARS_REGEX = re.compile(r'[/*\[@.{]')  # Paths without these are single tags
+_SIMPLE_PATH_REGEX = re.compile(r'^(?:\./)?((?:\{[^}]*\})?[^/\[\]{}*@]+(?:/(?:\{[^}]*\})?[^/\[\]{}*@]+)*)$')
+# Steps matching only on tags and attributes: elements removed by earlier paths can not change what these find
+_REMOVABLE_STEP_REGEX = re.compile(r'''^(?:\*|[^/\[\]{}*@]+)(?:\[@[^/\[\]='"]+(?:=(?:"[^"/]*"|'[^'/]*'))?\])*$''')
+_ELEMENT_INDEXES = weakref.WeakValueDictionary()  # Each ElementIndex in use, by the id of its root
+_INDEXED_ELEMENTS = {}  # A weak reference to the ElementIndex of each indexed element, or a tuple for several
+
+_QUERY_ELEMENT = 'element'
+_QUERY_PROPS = {_ELEM_TEXT, _ELEM_TAIL, _ELEM_ATTRIBS, _QUERY_ELEMENT}
+
 _OBJ_TYPE = 'type'
 _OBJ_VALUE = 'value'
 _OBJ_CHILDREN = 'children'
 _OBJ_PROPERTIES = {_OBJ_TYPE, _OBJ_VALUE, _OBJ_CHILDREN}
 
+# Markup tokens for scanning str or bytes XML content in a single pass: names and quoted values
+# exclude their own delimiters, so no pattern can backtrack beyond the tag it is matching
+
+_XML_NAME_PATTERN = r'''[^\s/>=<"']+'''
+_XML_VALUE_PATTERN = r'''\s*=\s*(?:"[^"]*"|'[^']*')'''
+_XML_ATTR_PATTERN = r'(\s+)({name})({value})'.format(name=_XML_NAME_PATTERN, value=_XML_VALUE_PATTERN)
+_XML_TAG_PATTERN = r'<(/?)({name})((?:\s+{name}{value})*)(\s*/?>)'.format(
+    name=_XML_NAME_PATTERN, value=_XML_VALUE_PATTERN
+)
+_XML_SECTIONS = (('<!--', '-->'), ('<![CDATA[', ']]>'), ('<?', '?>'))
+
+
+def _compile_xml_tokens(to_type):
+    """ :return: the tokens used to scan XML markup, encoded for str or bytes content """
+
+    encode = (lambda s: s) if to_type is str else (lambda s: s.encode('ascii'))
+
+    return {
+        'attr': re.compile(encode(_XML_ATTR_PATTERN)),
+        'tag': re.compile(encode(_XML_TAG_PATTERN)),
+        'sections': tuple((encode(start), encode(end)) for start, end in _XML_SECTIONS),
+        'empty': encode(''),
+        'lt': encode('<'),
+        'gt': encode('>'),
+        'bang': encode('!'),
+        'question': encode('?'),
+        'special': re.compile(encode(r'<[!?]')),
+        'brackets': (encode('['), encode(']')),
+        'colon': encode(':'),
+        'xmlns': encode('xmlns'),
+        'xmlns_prefix': encode('xmlns:'),
+        'declaration': re.compile(encode(_XML_DECLARATION_REGEX.pattern)),
+        'whitespace': re.compile(encode(r'\s*')),
+        'declaration_start': encode('<?xml'),
+        'declaration_end': encode('?>'),
+    }
+
+
+_XML_TOKENS = {str: _compile_xml_tokens(str), bytes: _compile_xml_tokens(bytes)}
+
 
 def create_element_tree(elem_or_name=None, text=None, **attribute_kwargs):
     """
@@ -80,6 +182,7 @@ def clear_children(parent_to_parse, element_path=None):
         elem_atr = element.attrib
 
         element.clear()
+        _invalidate_indexes(element)
 
         element.text = elem_txt
         element.attrib = elem_atr
@@ -99,6 +202,7 @@ def clear_element(parent_to_parse, element_path=None):
         return parent_to_parse
     else:
         element.clear()
+        _invalidate_indexes(element)
 
     return element
 
@@ -123,22 +227,70 @@ def copy_element(from_element, to_element=None, path_to_copy=None):
         else:
             dest_element = insert_element(Element(from_element.tag), 0, path_to_copy)
 
+    _invalidate_indexes(dest_element, dest_element.tag != from_element.tag)
+
     dest_element.tag = from_element.tag
     dest_element.text = from_element.text
     dest_element.tail = from_element.tail
-    dest_element.attrib = from_element.attrib
+    dest_element.attrib = dict(from_element.attrib)
+
+    dest_element[0:0] = [deepcopy(elem) for elem in from_element]
+
+    return dest_element
 
-    copied_children = []
 
-    for elem in from_element:
-        copied_children.append(copy_element(elem))
+def copy_elements(from_element, to_element=None, paths_to_copy=None):
+    """
+    Copies the elements at each source path in from_element to the destination path in to_element,
+    replacing the content of the element at each position of the destination path, and returns to_element.
+    :param paths_to_copy: (source path, destination path) pairs, or a dict of them, where a single path is
+        copied to the same location, and destination paths may end in @name to copy text to an attribute
+    Missing destination elements are inserted as by apply_updates, with the tag in the destination path.
+    If to_element is not provided, a new element named after from_element is created.
+    :see: apply_updates(parent_to_parse, element_updates)
+    """
+
+    from_element = get_element(from_element)
+
+    if from_element is None:
+        return None
+
+    dest_element = Element(from_element.tag) if to_element is None else get_element(to_element)
+
+    if not paths_to_copy:
+        return dest_element
 
-    for idx, child in enumerate(copied_children):
-        dest_element.insert(idx, child)
+    if isinstance(paths_to_copy, Mapping):
+        paths_to_copy = paths_to_copy.items()
+
+    path_values = []
+    for path_to_copy in paths_to_copy:
+        from_path, to_path = (path_to_copy, path_to_copy) if isinstance(path_to_copy, str) else path_to_copy
+        from_elements = _find_elements(from_element, from_path) if from_path else [from_element]
+
+        path_values.append((path_to_copy, to_path or '.', from_elements))
+
+    _update_paths(dest_element, path_values, _copy_element_content)
 
     return dest_element
 
 
+def _copy_element_content(element, attrib_name, from_element):
+    """ Replaces the content of element with a deep copy of from_element's, or assigns its text to attrib_name """
+
+    if attrib_name:
+        element.set(attrib_name, from_element.text or u'')
+        return
+
+    element.text = from_element.text
+    element.tail = from_element.tail
+    element.attrib = dict(from_element.attrib)
+
+    element[:] = [deepcopy(elem) for elem in from_element]
+
+    _invalidate_indexes(element)
+
+
 def get_element_tree(parent_to_parse):
     """
     :return: an ElementTree initialized with the parsed element.
@@ -153,10 +305,111 @@ def get_element_tree(parent_to_parse):
     return ElementTree() if element is None else ElementTree(element)
 
 
+def _parse_xml_path(file_path, include_namespaces=False):
+    """
+    :return: an element parsed from the file at file_path, fed to the parser in chunks from a memory map of
+    the file, or as it is decompressed, so that its content is never held in memory all at once
+    """
+
+    parser = XMLParser(target=TreeBuilder())
+
+    with open(file_path, 'rb') as xml_file:
+        try:
+            if _get_file_compression(xml_file) or not os.fstat(xml_file.fileno()).st_size:
+                with _open_xml_file(xml_file) as decompressed:
+                    for chunk in iter(partial(decompressed.read, _DEFAULT_CHUNK_SIZE), b''):
+                        parser.feed(chunk)
+            else:
+                with mmap.mmap(xml_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    for idx in range(0, len(view), _DEFAULT_CHUNK_SIZE):
+                        with view[idx:idx + _DEFAULT_CHUNK_SIZE] as chunk:
+                            parser.feed(chunk)
+
+            element = parser.close()
+
+        except ParseError as ex:
+            if ex.code not in (_XML_MISPLACED_DECLARATION, _XML_NO_ELEMENTS, _XML_UNBOUND_PREFIX):
+                raise
+
+            # Blank files, leading whitespace and undeclared prefixes are handled by parsing the whole content
+            xml_file.seek(0)
+            with _open_xml_file(xml_file) as decompressed:
+                return string_to_element(decompressed.read(), include_namespaces)
+
+    return element if include_namespaces else _strip_element_namespaces(element)
+
+
+@contextmanager
+def _open_xml_file(file_or_path):
+    """
+    Opens the path, or uses the file, to read XML that is decompressed as it is read if it is compressed
+    with gzip, bz2, xz or zip, as detected from its first bytes or from the extension of the path.
+    Only files opened here are closed afterwards.
+    """
+
+    with ExitStack() as stack:
+        if hasattr(file_or_path, 'read'):
+            xml_file = file_or_path
+            file_path = getattr(file_or_path, 'name', None)
+        else:
+            xml_file = stack.enter_context(open(file_or_path, 'rb'))
+            file_path = os.fspath(file_or_path)
+
+        compression = _get_file_compression(xml_file, file_path)
+        if compression:
+            xml_file = _open_decompressed(xml_file, compression, stack)
+
+        yield xml_file
+
+
+def _get_file_compression(xml_file, file_path=None):
+    """ :return: the compression of the binary file, from its first bytes, or from file_path if they can't be read """
+
+    if hasattr(xml_file, 'peek'):
+        first_bytes = xml_file.peek(8)[:8]
+    elif hasattr(xml_file, 'seekable') and xml_file.seekable():
+        position = xml_file.tell()
+        first_bytes = xml_file.read(8)
+        xml_file.seek(position)
+    else:
+        first_bytes = None
+
+    if isinstance(first_bytes, bytes):
+        return next((compression for magic, compression in _DECOMPRESSION_MAGIC if first_bytes.startswith(magic)), None)
+    elif first_bytes is None and isinstance(file_path, str):
+        return _DECOMPRESSION_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+
+    return None  # Text files are never compressed
+
+
+def _open_decompressed(in_file, compression, stack):
+    """ :return: a binary file that decompresses in_file as it is read, closed along with the exit stack """
+
+    if compression == 'gzip':
+        return stack.enter_context(gzip.GzipFile(fileobj=in_file, mode='rb'))
+    elif compression == 'bz2':
+        return stack.enter_context(bz2.BZ2File(in_file, 'rb'))
+    elif compression == 'xz':
+        return stack.enter_context(lzma.LZMAFile(in_file, 'rb'))
+
+    # Archives are read from the first file in them, and need to be read out of order
+
+    if not in_file.seekable():
+        in_file = io.BytesIO(in_file.read())
+
+    archive = stack.enter_context(zipfile.ZipFile(in_file))
+    archived = next((info for info in archive.infolist() if not info.is_dir()), None)
+
+    if archived is None:
+        raise ParseError('No XML file found in zip archive')
+
+    return stack.enter_context(archive.open(archived))
+
+
 def get_element(parent_to_parse, element_path=None):
     """
-    :return: an element from the parent or parsed from a Dictionary, XML string
-    or file. If element_path is not provided the root element is returned.
+    :return: an element from the parent or parsed from a Dictionary, XML string or bytes,
+    file or path object. If element_path is not provided the root element is returned.
     """
 
     if parent_to_parse is None:
@@ -166,12 +419,16 @@ def get_element(parent_to_parse, element_path=None):
         parent_to_parse = parent_to_parse.getroot()
 
     elif hasattr(parent_to_parse, 'read'):
-        parent_to_parse = string_to_element(parent_to_parse.read())
+        with _open_xml_file(parent_to_parse) as xml_file:
+            parent_to_parse = string_to_element(xml_file.read())
 
-    elif isinstance(parent_to_parse, STRING_TYPES):
+    elif isinstance(parent_to_parse, os.PathLike):
+        parent_to_parse = _parse_xml_path(parent_to_parse)
+
+    elif isinstance(parent_to_parse, (str, *_XML_BYTES_TYPES)):
         parent_to_parse = string_to_element(parent_to_parse)
 
-    elif isinstance(parent_to_parse, dict):
+    elif isinstance(parent_to_parse, (Mapping, ElementNode)):
         parent_to_parse = dict_to_element(parent_to_parse)
 
     if parent_to_parse is None:
@@ -180,7 +437,11 @@ def get_element(parent_to_parse, element_path=None):
         element_type = type(parent_to_parse).__name__
         raise TypeError(f'Invalid element type: {element_type}')
 
-    return parent_to_parse.find(element_path) if element_path else parent_to_parse
+    if not element_path:
+        return parent_to_parse
+
+    index = _get_element_index(parent_to_parse)
+    return _find_element(parent_to_parse, element_path) if index is None else index.get_element(element_path)
 
 
 def get_remote_element(url, element_path=None):
@@ -189,18 +450,15 @@ def get_remote_element(url, element_path=None):
     :see: get_element(parent_to_parse, element_path)
     """
 
-    content = None
-
     if url is None:
-        return content
+        return None
     elif _FILE_LOCATION_REGEX.match(url):
-        with open(url, 'rb') as xml:
-            content = xml.read()
+        return get_element(_parse_xml_path(url), element_path)
     else:
-        with urlopen(url) as remote:
-            content = remote.read()
+        with urlopen(url) as remote, _open_xml_file(remote) as xml:
+            content = xml.read()
 
-    return get_element(strip_namespaces(content), element_path)
+    return get_element(content, element_path)
 
 
 def element_exists(elem_to_parse, element_path=None):
@@ -223,18 +481,16 @@ def elements_exist(elem_to_parse, element_paths=None, all_exist=False):
     if not element_paths or isinstance(element_paths, str):
         return element_exists(element, element_paths)
 
-    exists = False
+    if all_exist:
+        # Every path must be found, so all of them are found together in a single traversal
+        found = query_many(element, {idx: (path, _QUERY_ELEMENT) for idx, path in enumerate(element_paths)})
+        return all(found.values())
 
     for element_path in element_paths:
-        exists = element_exists(element, element_path)
-
-        if all_exist and not exists:
-            return False
-
-        if exists and not all_exist:
+        if element_exists(element, element_path):
             return True
 
-    return exists
+    return False
 
 
 def element_is_empty(elem_to_parse, element_path=None):
@@ -314,6 +570,7 @@ def insert_element(elem_to_parse, elem_idx, elem_path, elem_txt=u'', **attrib_kw
     subelem.text = elem_txt
 
     element.insert(elem_idx, subelem)
+    _invalidate_indexes(element)
 
     return subelem
 
@@ -328,27 +585,11 @@ def remove_element(parent_to_parse, element_path, clear_empty=False):
     """
 
     element = get_element(parent_to_parse)
-    removed = []
 
     if element is None or not element_path:
         return None
 
-    if element_exists(element, element_path):
-        if XPATH_DELIM not in element_path:
-            for subelem in get_elements(element, element_path):
-                removed.append(subelem)
-                element.remove(subelem)
-        else:
-            xpath_segments = element_path.split(XPATH_DELIM)
-            parent_segment = XPATH_DELIM.join(xpath_segments[:-1])
-            last_segment = xpath_segments[-1]
-
-            for parent in get_elements(element, parent_segment):
-                rem = remove_element(parent, last_segment)
-                removed.extend(rem if isinstance(rem, list) else [rem])
-
-            if clear_empty:
-                removed.extend(remove_empty_element(element, parent_segment))
+    removed = _remove_elements(element, [element_path], clear_empty)
 
     return removed[0] if len(removed) == 1 else (removed or None)
 
@@ -357,26 +598,168 @@ def remove_elements(parent_to_parse, element_paths, clear_empty=False):
     """
     Removes all elements named after each elements_or_paths. If clear_empty is True,
     for each XPATH, empty parents are removed if all their children are removed.
+    Elements for all the paths are found in one walk, and removed as if each path were removed in turn.
     :see: remove_element(parent_to_parse, element_path)
     """
 
     element = get_element(parent_to_parse)
-    removed = []
 
     if element is None or not element_paths:
-        return removed
+        return []
 
     if isinstance(element_paths, str):
-        rem = remove_element(element, element_paths, clear_empty)
-        removed.extend(rem if isinstance(rem, list) else [rem])
-    else:
-        for xpath in element_paths:
-            rem = remove_element(element, xpath, clear_empty)
+        element_paths = [element_paths]
+
+    return _remove_elements(element, element_paths, clear_empty)
+
+
+def _remove_elements(element, element_paths, clear_empty):
+    """
+    Removes elements at consecutive paths of child steps in bulk, and any other paths one at a time
+    :return: the removed elements, with None for each path or parent where nothing was removed
+    """
+
+    removed = []
+    bulk_paths = []
+
+    for xpath in element_paths:
+        if xpath and all(_is_removable_step(step) for step in xpath.split(XPATH_DELIM)):
+            bulk_paths.append(xpath)
+            continue
+
+        if bulk_paths:
+            removed.extend(_remove_elements_in_bulk(element, bulk_paths, clear_empty))
+            bulk_paths = []
+
+        if xpath:
+            rem = _remove_element(element, xpath, clear_empty)
             removed.extend(rem if isinstance(rem, list) else [rem])
+        else:
+            removed.append(None)
+
+    if bulk_paths:
+        removed.extend(_remove_elements_in_bulk(element, bulk_paths, clear_empty))
+
+    return removed
+
+
+def _is_removable_step(step):
+    """ :return: True if matches for the step depend only on tags and attributes, which removal does not change """
+    return step not in ('.', '..') and _REMOVABLE_STEP_REGEX.match(step) is not None
+
+
+def _remove_elements_in_bulk(element, element_paths, clear_empty):
+    """
+    Finds the elements at every path, and at every path leading to them, in one walk from element,
+    then removes them path by path, skipping any inside elements already removed
+    :return: the removed elements in the order _remove_element would have removed them
+    """
+
+    # Steps shared by several paths are found once: each node holds the steps below it and the (element, parent)
+    # pairs found there, in document order
+
+    root = ({}, [(element, None)])
+    for xpath in element_paths:
+        node = root
+        for step in xpath.split(XPATH_DELIM):
+            node = node[0].setdefault(step, ({}, []))
+
+    parents = {}
+    to_walk = [root]
+
+    while to_walk:
+        steps, found = to_walk.pop()
+        for step, node in steps.items():
+            for parent, _ in found:
+                for child in _find_elements(parent, step):
+                    node[1].append((child, parent))
+                    parents[child] = parent
+
+            to_walk.append(node)
+
+    removed = []
+    removed_set = set()
+
+    def is_removed(elem):
+        while elem is not None:
+            if elem in removed_set:
+                return True
+            elem = parents.get(elem)
+        return False
+
+    def remove_from(parent, children):
+        for child in children:
+            parent.remove(child)
+            removed_set.add(child)
+
+        _invalidate_indexes(parent)
+
+    for xpath in element_paths:
+        levels = [root]
+        for step in xpath.split(XPATH_DELIM):
+            levels.append(levels[-1][0][step])
+
+        matches = [(elem, parent) for elem, parent in levels[-1][1] if not is_removed(elem)]
+        if not matches:
+            removed.append(None)
+            continue
+
+        by_parent = OrderedDict()
+        for elem, parent in matches:
+            by_parent.setdefault(parent, []).append(elem)
+
+        if len(levels) == 2:
+            children = by_parent[element]
+            remove_from(element, children)
+            removed.extend(children)
+            continue
+
+        for parent, _ in levels[-2][1]:
+            if is_removed(parent):
+                continue
+            elif parent not in by_parent:
+                removed.append(None)
+            else:
+                remove_from(parent, by_parent[parent])
+                removed.extend(by_parent[parent])
+
+        if clear_empty:
+            # Empty parents are removed as remove_element does, each right after it is emptied
+            emptied = remove_empty_element(element, xpath.rpartition(XPATH_DELIM)[0])
+
+            removed_set.update(emptied)
+            removed.extend(emptied)
 
     return removed
 
 
+def _remove_element(element, element_path, clear_empty=False):
+    """ Removes the elements at element_path one parent at a time, for paths that can not be removed in bulk """
+
+    removed = []
+
+    if element_exists(element, element_path):
+        if XPATH_DELIM not in element_path:
+            for subelem in get_elements(element, element_path):
+                removed.append(subelem)
+                element.remove(subelem)
+
+            _invalidate_indexes(element)
+        else:
+            xpath_segments = element_path.split(XPATH_DELIM)
+            parent_segment = XPATH_DELIM.join(xpath_segments[:-1])
+            last_segment = xpath_segments[-1]
+
+            for parent in get_elements(element, parent_segment):
+                rem = _remove_element(parent, last_segment)
+                removed.extend(rem if isinstance(rem, list) else [rem])
+
+            if clear_empty:
+                removed.extend(remove_empty_element(element, parent_segment))
+
+    return removed[0] if len(removed) == 1 else (removed or None)
+
+
 def remove_empty_element(parent_to_parse, element_path, target_element=None):
     """
     Searches for all empty sub-elements named after element_name in the parsed element,
@@ -403,6 +786,8 @@ def remove_empty_element(parent_to_parse, element_path, target_element=None):
             if element_is_empty(subelem):
                 removed.append(subelem)
                 element.remove(subelem)
+
+        _invalidate_indexes(element)
     else:
         # Parse target element from last node in element path
         xpath_segments = element_path.split(XPATH_DELIM)
@@ -416,6 +801,8 @@ def remove_empty_element(parent_to_parse, element_path, target_element=None):
                     removed.append(child)
                     parent.remove(child)
 
+            _invalidate_indexes(parent)
+
             # Parent may be empty now: recursively remove empty elements in XPATH
             if element_is_empty(parent):
                 if len(xpath_segments) == 2:
@@ -429,576 +816,2509 @@ def remove_empty_element(parent_to_parse, element_path, target_element=None):
     return removed
 
 
-def get_elements(parent_to_parse, element_path):
+def prune_empty(parent_to_parse, element_paths=None):
     """
-    :return: all elements by name from the parsed parent element.
-    :see: get_element(parent_to_parse, element_path)
+    Removes every empty element below the parsed element, or at and below each of element_paths,
+    where elements left with no children once their empty children are removed are also empty.
+    Each element is visited once, after its children, with the same definition as element_is_empty.
+    :return: the removed elements, each listed after any removed from inside it
+    :see: element_is_empty(elem_to_parse, element_path=None)
     """
 
     element = get_element(parent_to_parse)
+    return _prune_empty(element, element_paths, lambda rebuild: _get_parents(element))
 
-    if element is None or not element_path:
-        return []
-
-    return element.findall(element_path)
 
-
-def get_element_attribute(elem_to_parse, attrib_name, default_value=u''):
+def _prune_empty(element, element_paths, get_parents):
     """
-    :return: an attribute from the parsed element if it has the attribute, otherwise the default value
+    Prunes empty elements as prune_empty does, finding the parents of targets through get_parents(rebuild),
+    which returns a map of each element below element to its parent, that is current if rebuild is True
     """
 
-    element = get_element(elem_to_parse)
+    removed = []
 
     if element is None:
-        return default_value
+        return removed
 
-    return element.attrib.get(attrib_name, default_value)
+    is_empty = {}  # Whether each element visited is empty, once its children have been pruned
 
+    if element_paths is None:
+        _prune_empty_element(element, is_empty, removed)
+        return removed
 
-def get_element_attributes(parent_to_parse, element_path=None):
-    """
-    :return: all the attributes for the parsed element if it has any, or an empty dict
-    """
+    if isinstance(element_paths, str):
+        element_paths = [element_paths]
 
-    element = get_element(parent_to_parse, element_path)
+    targets = [target for xpath in element_paths if xpath for target in get_elements(element, xpath)]
+    parents = get_parents(False) if targets else None
 
-    return {} if element is None else element.attrib
+    for target in targets:
+        if target in is_empty:
+            continue  # Already pruned, along with everything below it
 
+        if not _prune_empty_element(target, is_empty, removed) or target is element:
+            continue
 
-def set_element_attributes(elem_to_parse, **attrib_kwargs):
-    """
-    Adds the specified key/value pairs to the element's attributes, and
-    returns the updated set of attributes.
+        parent = parents.get(target)
+        if parent is not None:
+            try:
+                parent.remove(target)
+            except ValueError:
+                parent = None  # Moved since the map was built
 
-    If the element already contains any of the attributes specified in
-    attrib_kwargs, they are updated accordingly.
-    """
+        if parent is None:
+            # Targets added or moved since the map was built are only found once it is rebuilt
+            parents = get_parents(True)
+            parent = parents[target]
+            parent.remove(target)
 
-    element = get_element(elem_to_parse)
+        removed.append(target)
 
-    if element is None:
-        return element
+        _invalidate_indexes(parent)
 
-    if len(attrib_kwargs):
-        element.attrib.update(attrib_kwargs)
+    return removed
 
-    return element.attrib
 
+def _get_parents(element):
+    """ :return: a map of each element below element to its parent """
+    return {child: parent for parent in element.iter() for child in parent}
 
-def remove_element_attributes(elem_to_parse, *args):
+
+def _prune_empty_element(element, is_empty, removed):
     """
-    Removes the specified keys from the element's attributes, and
-    returns a dict containing the attributes that have been removed.
+    Removes the empty elements below element in one post-order walk, recording each one visited in is_empty
+    :return: True if element is empty once the empty elements below it are removed
     """
 
-    element = get_element(elem_to_parse)
+    to_visit = [(element, False)]
 
-    if element is None:
-        return element
+    while to_visit:
+        elem, children_visited = to_visit.pop()
 
-    if len(args):
-        attribs = element.attrib
-        return {key: attribs.pop(key) for key in args if key in attribs}
+        if not children_visited:
+            to_visit.append((elem, True))
+            to_visit.extend((child, False) for child in reversed(elem) if child not in is_empty)
+            continue
 
-    return {}
+        children = list(elem)
+        kept = [child for child in children if not is_empty[child]]
 
+        if len(kept) < len(children):
+            removed.extend(child for child in children if is_empty[child])
+            elem[:] = kept
 
-def get_element_name(parent_to_parse):
+            _invalidate_indexes(elem)
+
+        is_empty[elem] = (
+            not kept and
+            not elem.attrib and
+            (elem.text is None or not elem.text.strip()) and
+            (elem.tail is None or not elem.tail.strip())
+        )
+
+    return is_empty[element]
+
+
+def get_elements(parent_to_parse, element_path):
     """
-    :return: the name of the parsed element.
+    :return: all elements by name from the parsed parent element.
     :see: get_element(parent_to_parse, element_path)
     """
 
     element = get_element(parent_to_parse)
 
-    return None if element is None else element.tag
+    if element is None or not element_path:
+        return []
 
+    index = _get_element_index(element)
+    return _find_elements(element, element_path) if index is None else index.get_elements(element_path)
 
-def get_element_tail(parent_to_parse, element_path=None, default_value=u''):
+
+def set_path_cache_size(max_size=_DEFAULT_PATH_CACHE_SIZE):
     """
-    :return: text following the parsed parent element if it exists, otherwise the default value
-    :see: get_element(parent_to_parse, element_path)
+    Sets the number of compiled element paths kept for finding elements, replacing the cache with an empty one.
+    Unlike the cache in ElementPath, which is emptied once it holds 100 paths, the least recently used are
+    discarded one at a time, so it can be sized for the number of paths in use: None for no limit.
+    :see: get_path_cache_info()
     """
 
-    parent_element = get_element(parent_to_parse, element_path)
+    global _compiled_element_path
+    _compiled_element_path = lru_cache(max_size)(_compile_element_path)
 
-    if parent_element is None:
-        return default_value
 
-    if parent_element.tail:
-        return parent_element.tail.strip() or default_value
+def clear_path_cache():
+    """ Discards all compiled element paths, and resets the statistics of the cache """
+    _compiled_element_path.cache_clear()
 
-    return default_value
 
+def get_path_cache_info():
+    """ :return: a named tuple of hits, misses, maxsize and currsize for the cache of compiled element paths """
+    return _compiled_element_path.cache_info()
 
-def get_element_text(parent_to_parse, element_path=None, default_value=u''):
-    """
-    :return: text from the parsed parent element if it has a text value, otherwise the default value
-    :see: get_element(parent_to_parse, element_path)
-    """
 
-    parent_element = get_element(parent_to_parse, element_path)
+def _find_element(element, element_path):
+    """ :return: the first element at element_path, as element.find would, with the path compiled once """
 
-    if parent_element is None:
-        return default_value
+    if not _ELEMENT_PATH_CHARS_REGEX.search(element_path):
+        return element.find(element_path)  # Single tags are found without compiling a path
 
-    if parent_element.text:
-        return parent_element.text.strip() or default_value
+    return next(_iterfind_elements(element, element_path), None)
 
-    return default_value
 
+def _find_elements(element, element_path):
+    """ :return: all the elements at element_path, as element.findall would, with the path compiled once """
 
-def get_elements_attributes(parent_to_parse, element_path=None, attrib_name=None):
-    """
-    :return: list of text representing an attribute of parent or each element at element path,
-             or a list of dicts representing all the attributes parsed from each element
-    """
+    if not _ELEMENT_PATH_CHARS_REGEX.search(element_path):
+        return element.findall(element_path)
 
-    attrs = _get_elements_property(parent_to_parse, element_path, 'attrib')
+    return list(_iterfind_elements(element, element_path))
 
-    if not attrib_name:
-        return attrs
 
-    return [attr[attrib_name] for attr in attrs if attrib_name in attr]
+def _iterfind_elements(element, element_path):
+    """ Applies the compiled element path as ElementPath.iterfind does, after looking it up in the cache """
 
+    if element_path[-1:] == XPATH_DELIM:
+        element_path += '*'
 
-def get_elements_tail(parent_to_parse, element_path=None):
-    """
-    :return: list of text following parent element or each element at element_path
-    """
+    result = [element]
+    context = ElementPath._SelectorContext(element)
 
-    return _get_elements_property(parent_to_parse, element_path, 'tail')
+    for select in _compiled_element_path(element_path):
+        result = select(context, result)
 
+    return iter(result)
 
-def get_elements_text(parent_to_parse, element_path=None):
-    """
-    :return: list of text extracted from parent element or each element at element_path
-    """
 
-    return _get_elements_property(parent_to_parse, element_path, 'text')
+def _compile_element_path(element_path):
+    """ :return: a tuple of selectors for the element path, compiled as ElementPath.iterfind compiles it """
 
+    if element_path[:1] == XPATH_DELIM:
+        raise SyntaxError('cannot use absolute path on element')
 
-def _get_elements_property(parent_to_parse, element_path, prop_name):
-    """ A helper to construct a list of values from """
+    next_token = iter(ElementPath.xpath_tokenizer(element_path)).__next__
+    selector = []
 
-    parent_element = get_element(parent_to_parse)
+    try:
+        token = next_token()
+    except StopIteration:
+        return ()
 
-    if parent_element is None:
-        return []
+    while True:
+        try:
+            selector.append(ElementPath.ops[token[0]](next_token, token))
+        except StopIteration:
+            raise SyntaxError('invalid path') from None
 
-    if element_path and not element_exists(parent_element, element_path):
-        return []
+        try:
+            token = next_token()
+            if token[0] == XPATH_DELIM:
+                token = next_token()
+        except StopIteration:
+            break
 
-    if not element_path:
-        texts = getattr(parent_element, prop_name)
-        texts = texts.strip() if isinstance(texts, str) else texts
-        texts = [texts] if texts else []
-    else:
-        texts = [t for t in (
-            prop.strip() if isinstance(prop, str) else prop
-            for prop in (getattr(node, prop_name) for node in parent_element.findall(element_path)) if prop
-        ) if t]
+    return tuple(selector)
 
-    return texts
 
+_compiled_element_path = lru_cache(_DEFAULT_PATH_CACHE_SIZE)(_compile_element_path)
 
-def set_element_tail(parent_to_parse, element_path=None, element_tail=u''):
+
+class ElementIndex(object):
     """
-    Assigns the text following the parsed parent element and then returns it.
-    If element_path is provided and doesn't exist, it is inserted with element_tail.
+    An index of the elements in a parsed tree by their path from the root, which get_element, get_elements and
+    the functions getting their text, tail and attributes use instead of searching the tree for simple paths
+    (tags and namespaces only) from its root:
+        index = ElementIndex(tree)
+        get_element_text(index.root, 'idinfo/citation/citeinfo/title')
+
+    The index is kept up to date by the functions in this module that add or remove elements, by re-indexing
+    only below the changed elements, and only once a path below them is looked up. Changes made by any other
+    means must be reported with invalidate. Once the index is no longer referenced, it is no longer used.
+    """
+
+    def __init__(self, parent_to_parse):
+        self.root = get_element(parent_to_parse)
+
+        self._elements = {}  # Elements by path, in document order
+        self._paths = {}  # Paths by element
+        self._invalid = set()  # Paths below which the index must be rebuilt
+
+        self._ref = weakref.ref(self)
+        weakref.finalize(self, _remove_indexed_elements, self._paths, self._ref)
+
+        if self.root is not None:
+            self._elements[''] = [self.root]
+            self._paths[self.root] = ''
+            _add_indexed_element(self.root, self._ref)
+            self._index_below('')
+
+            _ELEMENT_INDEXES[id(self.root)] = self
+
+    def get_element(self, element_path=None):
+        """ :return: the first element at element_path from the root, or the root without element_path """
+
+        if not element_path or self.root is None:
+            return self.root
+
+        elements = self._get_indexed(element_path)
+        if elements is None:
+            return _find_element(self.root, element_path)
+
+        return elements[0] if elements else None
+
+    def get_elements(self, element_path):
+        """ :return: all the elements at element_path from the root """
+
+        if not element_path or self.root is None:
+            return []
+
+        elements = self._get_indexed(element_path)
+        return _find_elements(self.root, element_path) if elements is None else list(elements)
+
+    def invalidate(self, element=None, include_self=False):
+        """
+        Marks the elements below element as changed, or the whole tree if element is None.
+        If include_self is True, element itself has changed, for instance if its tag has been renamed.
+        """
+
+        if element is None:
+            self._invalid.add('')
+            return
+
+        path = self._paths.get(element)
+
+        if path is not None:
+            self._invalid.add(path.rpartition(XPATH_DELIM)[0] if include_self else path)
+
+    def _get_indexed(self, element_path):
+        """ :return: the indexed elements at a simple element_path, or None if the path is not a simple one """
+
+        simple_path = _SIMPLE_PATH_REGEX.match(element_path)
+        if simple_path is None:
+            return None
+
+        path = simple_path.group(1)
+        if any(step in ('.', '..') for step in path.split(XPATH_DELIM)):
+            return None
+
+        for invalid in sorted(self._invalid, key=len):
+            if invalid in self._invalid and (not invalid or path.startswith(invalid + XPATH_DELIM)):
+                self._index_below(invalid)
+
+        return self._elements.get(path, ())
+
+    def _index_below(self, path):
+        """ Rebuilds the index for everything below the elements at path """
+
+        prefix = path + XPATH_DELIM if path else ''
+
+        for indexed in [indexed for indexed in self._elements if indexed != path and indexed.startswith(prefix)]:
+            for element in self._elements.pop(indexed):
+                if self._paths.pop(element, None) is not None:
+                    _remove_indexed_element(element, self._ref)
+
+        self._invalid = {invalid for invalid in self._invalid if invalid != path and not invalid.startswith(prefix)}
+
+        # Elements are indexed in document order by visiting them before their children.
+        # Comments and processing instructions, whose tags are functions, are not at any path.
+
+        stack = [
+            (child, prefix + child.tag)
+            for parent in reversed(self._elements.get(path, ())) for child in reversed(parent)
+            if isinstance(child.tag, str)
+        ]
+
+        while stack:
+            element, element_path = stack.pop()
+
+            self._elements.setdefault(element_path, []).append(element)
+            self._paths[element] = element_path
+            _add_indexed_element(element, self._ref)
+
+            stack.extend(
+                (child, element_path + XPATH_DELIM + child.tag) for child in reversed(element)
+                if isinstance(child.tag, str)
+            )
+
+
+def _get_element_index(element):
+    """ :return: the ElementIndex in use for the element as a root, if there is one """
+
+    index = _ELEMENT_INDEXES.get(id(element)) if _ELEMENT_INDEXES else None
+    return index if index is not None and index.root is element else None
+
+
+def _invalidate_indexes(element, include_self=False):
+    """ Marks the elements below element as changed in any ElementIndex that includes it """
+
+    index_refs = _INDEXED_ELEMENTS.get(id(element)) if _INDEXED_ELEMENTS else None
+
+    if index_refs is not None:
+        for index_ref in (index_refs if isinstance(index_refs, tuple) else (index_refs,)):
+            index = index_ref()
+            if index is not None:
+                index.invalidate(element, include_self)
+
+
+def _add_indexed_element(element, index_ref):
+    """ Records that the element is in the index, so that only the indexes including an element are invalidated """
+
+    element_id = id(element)  # Unique while indexed, since the index keeps a reference to the element
+    index_refs = _INDEXED_ELEMENTS.setdefault(element_id, index_ref)
+
+    if index_refs is not index_ref:
+        index_refs = index_refs if isinstance(index_refs, tuple) else (index_refs,)
+        if index_ref not in index_refs:
+            _INDEXED_ELEMENTS[element_id] = index_refs + (index_ref,)
+
+
+def _remove_indexed_element(element, index_ref):
+    """ Records that the element is no longer in the index """
+
+    element_id = id(element)
+    index_refs = _INDEXED_ELEMENTS.get(element_id)
+
+    if index_refs is index_ref:
+        del _INDEXED_ELEMENTS[element_id]
+    elif isinstance(index_refs, tuple):
+        index_refs = tuple(ref for ref in index_refs if ref is not index_ref)
+
+        if len(index_refs) > 1:
+            _INDEXED_ELEMENTS[element_id] = index_refs
+        elif index_refs:
+            _INDEXED_ELEMENTS[element_id] = index_refs[0]
+        else:
+            del _INDEXED_ELEMENTS[element_id]
+
+
+def _remove_indexed_elements(paths, index_ref):
+    """ Records that none of the elements in an index that is no longer referenced are in it """
+
+    for element in paths:
+        _remove_indexed_element(element, index_ref)
+
+
+def get_element_attribute(elem_to_parse, attrib_name, default_value=u''):
+    """
+    :return: an attribute from the parsed element if it has the attribute, otherwise the default value
+    """
+
+    element = get_element(elem_to_parse)
+
+    if element is None:
+        return default_value
+
+    return element.attrib.get(attrib_name, default_value)
+
+
+def get_element_attributes(parent_to_parse, element_path=None):
+    """
+    :return: all the attributes for the parsed element if it has any, or an empty dict
+    """
+
+    element = get_element(parent_to_parse, element_path)
+
+    return {} if element is None else element.attrib
+
+
+def set_element_attributes(elem_to_parse, **attrib_kwargs):
+    """
+    Adds the specified key/value pairs to the element's attributes, and
+    returns the updated set of attributes.
+
+    If the element already contains any of the attributes specified in
+    attrib_kwargs, they are updated accordingly.
+    """
+
+    element = get_element(elem_to_parse)
+
+    if element is None:
+        return element
+
+    if len(attrib_kwargs):
+        element.attrib.update(attrib_kwargs)
+
+    return element.attrib
+
+
+def remove_element_attributes(elem_to_parse, *args):
+    """
+    Removes the specified keys from the element's attributes, and
+    returns a dict containing the attributes that have been removed.
+    """
+
+    element = get_element(elem_to_parse)
+
+    if element is None:
+        return element
+
+    if len(args):
+        attribs = element.attrib
+        return {key: attribs.pop(key) for key in args if key in attribs}
+
+    return {}
+
+
+def get_element_name(parent_to_parse):
+    """
+    :return: the name of the parsed element.
     :see: get_element(parent_to_parse, element_path)
     """
 
-    return _set_element_property(parent_to_parse, element_path, _ELEM_TAIL, element_tail)
+    element = get_element(parent_to_parse)
+
+    return None if element is None else element.tag
 
 
-def set_element_text(parent_to_parse, element_path=None, element_text=u''):
+def get_element_tail(parent_to_parse, element_path=None, default_value=u''):
     """
-    Assigns a string value to the parsed parent element and then returns it.
-    If element_path is provided and doesn't exist, it is inserted with element_text.
+    :return: text following the parsed parent element if it exists, otherwise the default value
     :see: get_element(parent_to_parse, element_path)
     """
 
-    return _set_element_property(parent_to_parse, element_path, _ELEM_TEXT, element_text)
+    parent_element = get_element(parent_to_parse, element_path)
 
+    if parent_element is None:
+        return default_value
 
-def _set_element_property(parent_to_parse, element_path, prop_name, value):
-    """ Assigns the value to the parsed parent element and then returns it """
+    if parent_element.tail:
+        return parent_element.tail.strip() or default_value
+
+    return default_value
+
+
+def get_element_text(parent_to_parse, element_path=None, default_value=u''):
+    """
+    :return: text from the parsed parent element if it has a text value, otherwise the default value
+    :see: get_element(parent_to_parse, element_path)
+    """
+
+    parent_element = get_element(parent_to_parse, element_path)
+
+    if parent_element is None:
+        return default_value
+
+    if parent_element.text:
+        return parent_element.text.strip() or default_value
+
+    return default_value
+
+
+def get_elements_attributes(parent_to_parse, element_path=None, attrib_name=None):
+    """
+    :return: list of text representing an attribute of parent or each element at element path,
+             or a list of dicts representing all the attributes parsed from each element
+    """
+
+    return list(iter_elements_attributes(parent_to_parse, element_path, attrib_name))
+
+
+def get_elements_tail(parent_to_parse, element_path=None):
+    """
+    :return: list of text following parent element or each element at element_path
+    """
+
+    return list(iter_elements_tail(parent_to_parse, element_path))
+
+
+def get_elements_text(parent_to_parse, element_path=None):
+    """
+    :return: list of text extracted from parent element or each element at element_path
+    """
+
+    return list(iter_elements_text(parent_to_parse, element_path))
+
+
+def iter_elements_attributes(parent_to_parse, element_path=None, attrib_name=None, limit=None):
+    """
+    :return: a generator of the values get_elements_attributes would return, finding elements only
+             as they are needed, and stopping after limit values if limit is provided
+    """
+
+    attrs = _iter_elements_property(parent_to_parse, element_path, 'attrib')
+
+    if attrib_name:
+        attrs = (attr[attrib_name] for attr in attrs if attrib_name in attr)
+
+    return attrs if limit is None else islice(attrs, limit)
+
+
+def iter_elements_tail(parent_to_parse, element_path=None, limit=None):
+    """
+    :return: a generator of the values get_elements_tail would return, finding elements only
+             as they are needed, and stopping after limit values if limit is provided
+    """
+
+    tails = _iter_elements_property(parent_to_parse, element_path, 'tail')
+    return tails if limit is None else islice(tails, limit)
+
+
+def iter_elements_text(parent_to_parse, element_path=None, limit=None):
+    """
+    :return: a generator of the values get_elements_text would return, finding elements only
+             as they are needed, and stopping after limit values if limit is provided
+    """
+
+    texts = _iter_elements_property(parent_to_parse, element_path, 'text')
+    return texts if limit is None else islice(texts, limit)
+
+
+def _iter_elements_property(parent_to_parse, element_path, prop_name):
+    """ A helper to generate values from the elements at element_path, as they are found """
+
+    parent_element = get_element(parent_to_parse)
+
+    if parent_element is None:
+        return iter(())
+
+    if not element_path:
+        elements = (parent_element,)
+    else:
+        index = _get_element_index(parent_element)
+
+        if index is None:
+            elements = _iterfind_elements(parent_element, element_path)
+        else:
+            elements = index.get_elements(element_path)
+
+    return _iter_property_values(elements, prop_name)
+
+
+def _get_property_values(elements, prop_name):
+    """ :return: the stripped values of prop_name for each of the elements, without any empty values """
+    return list(_iter_property_values(elements, prop_name))
 
+
+def _iter_property_values(elements, prop_name):
+    """ :return: a generator of the stripped values of prop_name for each of the elements, skipping empty values """
+
+    return (t for t in (
+        prop.strip() if isinstance(prop, str) else prop
+        for prop in (getattr(node, prop_name) for node in elements) if prop
+    ) if t)
+
+
+def query_many(parent_to_parse, element_paths):
+    """
+    Evaluates many element paths at once, in a single traversal of the parsed parent element:
+    paths are compiled into a tree of their steps, so that steps shared by several paths are found once.
+
+    :param element_paths: a dict of keys to the element path to query for each, which may be:
+        - a path, for a list of the text of each element, as get_elements_text returns
+        - a path ending in "@name", for a list of each element's "name" attribute
+        - a tuple of (path, prop), where prop is "text", "tail", "attributes" or "@name", as for
+          get_elements_text, get_elements_tail and get_elements_attributes, or "element" for the elements
+    :return: a dict of the same keys, to the list of values queried for each
+    """
+
+    queries = {}
+
+    for key, element_path in (element_paths or {}).items():
+        if isinstance(element_path, tuple):
+            element_path, prop = element_path
+        elif element_path and element_path.rpartition(XPATH_DELIM)[-1].startswith('@'):
+            element_path, _, prop = element_path.rpartition(XPATH_DELIM)
+        else:
+            prop = _ELEM_TEXT
+
+        if prop not in _QUERY_PROPS and not (prop.startswith('@') and len(prop) > 1):
+            raise ValueError(f'Invalid query property for {key}: {prop}')
+
+        queries[key] = (element_path, prop)
+
+    results = {key: [] for key in queries}
     element = get_element(parent_to_parse)
 
-    if element is None:
-        return None
+    if element is None or not queries:
+        return results
+
+    # Build a tree of path steps, each node with the keys of paths ending there, and the nodes for next steps
+
+    path_tree = ({}, [])
+
+    for key, (element_path, prop) in queries.items():
+        steps = _split_element_path(element_path) if element_path else []
+
+        if steps is None:
+            # Paths that can not be evaluated a step at a time, such as those with parent steps
+            results[key] = _get_query_values(_find_elements(element, element_path), prop)
+            continue
+
+        node = path_tree
+        for step in steps:
+            node = node[0].setdefault(step, ({}, []))
+        node[1].append(key)
+
+    stack = [(path_tree, (element,))]
+
+    while stack:
+        (next_steps, keys), elements = stack.pop()
+
+        for key in keys:
+            results[key] = _get_query_values(elements, queries[key][1])
+
+        for step, node in next_steps.items():
+            found = [child for elem in elements for child in _find_elements(elem, step)]
+            if found:
+                stack.append((node, found))
+
+    return results
+
+
+def _get_query_values(elements, prop):
+    """ :return: the values of prop for the elements, as the get_elements functions would return them """
+
+    if prop == _QUERY_ELEMENT:
+        return list(elements)
+    elif prop == _ELEM_ATTRIBS:
+        return _get_property_values(elements, 'attrib')
+    elif prop.startswith('@'):
+        attrib_name = prop[1:]
+        return [attr[attrib_name] for attr in _get_property_values(elements, 'attrib') if attrib_name in attr]
+    else:
+        return _get_property_values(elements, prop)
+
+
+def _split_element_path(element_path):
+    """
+    :return: a list of element paths, one for each step in element_path, which find the same elements
+    when each is applied to the elements found by the last, or None if element_path can not be split
+    """
+
+    steps = []
+    step_start = 0
+    brackets = 0
+    quote = None
+
+    for idx, char in enumerate(f'{element_path}{XPATH_DELIM}'):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in ('"', "'"):
+            quote = char
+        elif char in ('[', '{'):
+            brackets += 1
+        elif char in (']', '}'):
+            brackets -= 1
+        elif char == XPATH_DELIM and not brackets:
+            steps.append(element_path[step_start:idx])
+            step_start = idx + 1
+
+    if quote or brackets or not steps[0] or not steps[-1]:
+        return None  # Invalid or absolute paths are left to ElementPath to report
+
+    split_steps = []
+    is_descendant = False
+
+    for step in steps:
+        if not step:
+            if is_descendant:
+                return None
+            is_descendant = True
+        elif step == '..':
+            return None
+        elif step != '.':
+            split_steps.append(f'.//{step}' if is_descendant else step)
+            is_descendant = False
+        elif is_descendant:
+            return None
+
+    return split_steps
+
+
+def set_element_tail(parent_to_parse, element_path=None, element_tail=u''):
+    """
+    Assigns the text following the parsed parent element and then returns it.
+    If element_path is provided and doesn't exist, it is inserted with element_tail.
+    :see: get_element(parent_to_parse, element_path)
+    """
+
+    return _set_element_property(parent_to_parse, element_path, _ELEM_TAIL, element_tail)
+
+
+def set_element_text(parent_to_parse, element_path=None, element_text=u''):
+    """
+    Assigns a string value to the parsed parent element and then returns it.
+    If element_path is provided and doesn't exist, it is inserted with element_text.
+    :see: get_element(parent_to_parse, element_path)
+    """
+
+    return _set_element_property(parent_to_parse, element_path, _ELEM_TEXT, element_text)
+
+
+def _set_element_property(parent_to_parse, element_path, prop_name, value):
+    """ Assigns the value to the parsed parent element and then returns it """
+
+    element = get_element(parent_to_parse)
+
+    if element is None:
+        return None
+
+    if element_path and not element_exists(element, element_path):
+        element = insert_element(element, 0, element_path)
+
+    if not isinstance(value, str):
+        value = u''
+
+    setattr(element, prop_name, value)
+
+    return element
+
+
+def set_elements_tail(parent_to_parse, element_path=None, tail_values=None):
+    """
+    Assigns an array of tail values to each of the elements parsed from the parent. The
+    tail values are assigned in the same order they are provided.
+    If there are less values then elements, the remaining elements are skipped; but if
+    there are more, new elements will be inserted for each with the remaining tail values.
+    """
+
+    if tail_values is None:
+        tail_values = []
+
+    return _set_elements_property(parent_to_parse, element_path, _ELEM_TAIL, tail_values)
+
+
+def set_elements_text(parent_to_parse, element_path=None, text_values=None):
+    """
+    Assigns an array of text values to each of the elements parsed from the parent. The
+    text values are assigned in the same order they are provided.
+    If there are less values then elements, the remaining elements are skipped; but if
+    there are more, new elements will be inserted for each with the remaining text values.
+    """
+
+    if text_values is None:
+        text_values = []
+
+    return _set_elements_property(parent_to_parse, element_path, _ELEM_TEXT, text_values)
+
+
+def _set_elements_property(parent_to_parse, element_path, prop_name, values):
+    """
+    Assigns an array of string values to each of the elements parsed from the parent.
+    The values must be strings, and they are assigned in the same order they are provided.
+    The operation stops when values run out; extra values will be inserted as new elements.
+    :see: get_element(parent_to_parse, element_path)
+    """
+
+    element = get_element(parent_to_parse)
+
+    if element is None or not values:
+        return []
+
+    if isinstance(values, str):
+        values = [values]
+
+    if not element_path:
+        return [_set_element_property(element, None, prop_name, values[0])]
+
+    elements = get_elements(element, element_path)
+    affected = []
+
+    for idx, val in enumerate(values):
+        if idx < len(elements):
+            next_elem = elements[idx]
+        else:
+            next_elem = insert_element(element, idx, element_path)
+
+        affected.append(
+            _set_element_property(next_elem, None, prop_name, val)
+        )
+
+    return affected
+
+
+def apply_updates(parent_to_parse, element_updates):
+    """
+    Assigns text, tail and attributes to the elements at many paths, inserting any that are missing.
+    Each path may end in @name to assign an attribute, and is mapped to a value assigned as follows:
+        a string: the text of the element, or the value of the attribute
+        a dict: any of text, tail and attributes, as in element_to_dict, with attributes added to the element's
+        a list of either: assigned in turn to each element at the path, inserting elements for any extra values
+    Updates are applied in order, to the same elements as set_elements_text, which inserts elements for extra
+    values in the same places, though paths with predicates are not inserted. Elements at leading steps shared
+    by consecutive paths are found once.
+    :return: a dict of the elements assigned for each path
+    :see: set_elements_text(parent_to_parse, element_path=None, text_values=None)
+    """
+
+    element = get_element(parent_to_parse)
+
+    if element is None or not element_updates:
+        return {}
+
+    if isinstance(element_updates, Mapping):
+        element_updates = element_updates.items()
+
+    path_values = (
+        (xpath, xpath, value if isinstance(value, (list, tuple)) else [value]) for xpath, value in element_updates
+    )
+    return _update_paths(element, path_values, _apply_element_update)
+
+
+def _apply_element_update(element, attrib_name, value):
+    """ Assigns a value from apply_updates to the element, or to its attribute named attrib_name """
+
+    if attrib_name:
+        element.set(attrib_name, value if isinstance(value, str) else u'')
+    elif isinstance(value, Mapping):
+        for prop in (_ELEM_TEXT, _ELEM_TAIL):
+            if prop in value:
+                setattr(element, prop, value[prop] if isinstance(value[prop], str) else u'')
+        if value.get(_ELEM_ATTRIBS):
+            element.attrib.update(value[_ELEM_ATTRIBS])
+    else:
+        element.text = value if isinstance(value, str) else u''
+
+
+def _update_paths(element, path_values, update_element):
+    """
+    Finds the elements at each path as set_elements_text does, inserting any missing for extra values where it
+    would insert them, and calls update_element(element, attrib_name, value) with the element in each position.
+    Elements at leading steps shared by consecutive paths are found once, while updates can not have changed them.
+    :param path_values: a sequence of (key, element path, list of values), keyed to return the elements updated
+    :return: a dict of the elements updated for each key
+    """
+
+    found = {(): [element]}  # The elements found at each sequence of leading steps
+    updated = {}
+
+    for key, xpath, values in path_values:
+        updated[key] = []
+
+        steps = _split_element_path(xpath) if xpath else None
+        if steps is None:
+            continue
+
+        attrib_name = steps.pop()[1:] if steps and steps[-1].startswith('@') else None
+        steps = tuple(steps)
+
+        for depth in range(1, len(steps) + 1):
+            if steps[:depth] not in found:
+                found[steps[:depth]] = [
+                    child for parent in found[steps[:depth - 1]] for child in _find_elements(parent, steps[depth - 1])
+                ]
+
+        elements = list(found[steps])
+        element_path = XPATH_DELIM.join(steps)
+
+        if len(elements) < len(values) and steps and _SIMPLE_PATH_REGEX.match(element_path):
+            elements.extend(insert_element(element, idx, element_path) for idx in range(len(elements), len(values)))
+            found = {(): [element]}
+
+        for elem, value in zip(elements, values):
+            update_element(elem, attrib_name, value)
+            updated[key].append(elem)
+
+        # Only the elements leading to those updated, at steps matching tags alone, are sure not to have changed
+
+        plain_depth = next(
+            (depth for depth, step in enumerate(steps) if not _SIMPLE_PATH_REGEX.match(step)), len(steps)
+        )
+        found = {steps[:depth]: found[steps[:depth]] for depth in range(plain_depth + 1) if steps[:depth] in found}
+
+    return updated
+
+
+def dict_to_element(element_as_dict):
+    """
+    Converts a Dictionary object to an element. The Dictionary can
+    include any of the following tags, only name is required:
+        - name (required): the name of the element tag
+        - text: the text contained by element
+        - tail: text immediately following the element
+        - attributes: a Dictionary containing element attributes
+        - children: a List of converted child elements
+
+    An ElementNode, as returned by element_to_node, is also converted to an element,
+    as is any other Mapping with the same keys, such as an ElementMapping.
+    """
+
+    if element_as_dict is None:
+        return None
+    elif isinstance(element_as_dict, ElementTree):
+        return element_as_dict.getroot()
+    elif isinstance(element_as_dict, ElementType):
+        return element_as_dict
+    elif isinstance(element_as_dict, ElementNode):
+        return _node_to_element(element_as_dict)
+    elif not isinstance(element_as_dict, Mapping):
+        raise TypeError(f'Invalid element dict: {element_as_dict}')
+
+    if len(element_as_dict) == 0:
+        return None
+
+    try:
+        converted = Element(
+            element_as_dict[_ELEM_NAME],
+            element_as_dict.get(_ELEM_ATTRIBS, {})
+        )
+
+        converted.tail = element_as_dict.get(_ELEM_TAIL, u'')
+        converted.text = element_as_dict.get(_ELEM_TEXT, u'')
+
+        for child in element_as_dict.get(_ELEM_CHILDREN, []):
+            converted.append(dict_to_element(child))
+
+    except KeyError:
+        raise SyntaxError(f'Invalid element dict: {element_as_dict}')
+
+    return converted
+
+
+def element_to_dict(elem_to_parse, element_path=None, recurse=True):
+    """
+    :return: an element losslessly as a dictionary
+
+    If recurse is True, the element's children are included, otherwise they are omitted.
+
+    The resulting Dictionary will have the following attributes:
+        - name: the name of the element tag
+        - text: the text contained by element
+        - tail: text immediately following the element
+        - attributes: a Dictionary containing element attributes
+        - children: a List of converted child elements
+    """
+
+    element = get_element(elem_to_parse, element_path)
+
+    if element is not None:
+        converted = {
+            _ELEM_NAME: element.tag,
+            _ELEM_TEXT: element.text,
+            _ELEM_TAIL: element.tail,
+            _ELEM_ATTRIBS: element.attrib,
+            _ELEM_CHILDREN: []
+        }
+
+        if recurse is True:
+            for child in element:
+                converted[_ELEM_CHILDREN].append(element_to_dict(child, recurse=recurse))
+
+        return converted
+
+    return {}
+
+
+def element_to_mapping(elem_to_parse, element_path=None, depth=None):
+    """
+    :return: a read-only ElementMapping with the same keys and values as element_to_dict would return,
+    but converting each element's children only when they are accessed, so that reading a few values
+    from a large element costs about the same as reading them from the element itself.
+
+    If depth is not None, children more than depth levels below the element are omitted, so a depth of 0
+    is the same as element_to_dict(elem_to_parse, element_path, recurse=False).
+    """
+
+    element = get_element(elem_to_parse, element_path)
+    return {} if element is None else ElementMapping(element, depth)
+
+
+class ElementMapping(Mapping):
+    """ A lazy, read-only view of an element as a dict of name, text, tail, attributes and children """
+
+    __slots__ = ('_element', '_depth')
+
+    _keys = (_ELEM_NAME, _ELEM_TEXT, _ELEM_TAIL, _ELEM_ATTRIBS, _ELEM_CHILDREN)
+    _props = {_ELEM_NAME: 'tag', _ELEM_TEXT: 'text', _ELEM_TAIL: 'tail', _ELEM_ATTRIBS: 'attrib'}
+
+    def __init__(self, element, depth=None):
+        self._element = element
+        self._depth = depth
+
+    def __getitem__(self, key):
+        if key in self._props:
+            return getattr(self._element, self._props[key])
+        elif key != _ELEM_CHILDREN:
+            raise KeyError(key)
+        elif self._depth is not None and self._depth < 1:
+            return []
+        else:
+            return _ElementChildren(self._element, None if self._depth is None else self._depth - 1)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._element.tag!r})'
+
+
+class _ElementChildren(Sequence):
+    """ A read-only sequence of an element's children, each viewed as an ElementMapping when accessed """
+
+    __slots__ = ('_element', '_depth')
+
+    def __init__(self, element, depth):
+        self._element = element
+        self._depth = depth
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [ElementMapping(child, self._depth) for child in self._element[idx]]
+        return ElementMapping(self._element[idx], self._depth)
+
+    def __len__(self):
+        return len(self._element)
+
+    def __eq__(self, other):
+        # Compares equal to the list of dicts in element_to_dict
+        return list(self) == list(other) if isinstance(other, Sequence) else NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def element_to_node(elem_to_parse, element_path=None, recurse=True):
+    """
+    :return: an element losslessly as an ElementNode, a more compact alternative to element_to_dict
+
+    If recurse is True, the element's children are included, otherwise they are omitted.
+
+    The resulting ElementNode will have the following attributes:
+        - name: the name of the element tag
+        - text: the text contained by element
+        - tail: text immediately following the element
+        - attributes: a Dictionary containing element attributes, or None if there are none
+        - children: a Tuple of converted child elements
+    """
+
+    element = get_element(elem_to_parse, element_path)
+
+    if element is None:
+        return None
+    elif recurse is not True:
+        return ElementNode(element.tag, element.text, element.tail, element.attrib or None, ())
+
+    stack = [(element, iter(element), [])]
+
+    while True:
+        parent, children, converted = stack[-1]
+        child = next(children, None)
+
+        if child is not None:
+            # Nodes are immutable, so children are converted before their parent
+            stack.append((child, iter(child), []))
+            continue
+
+        stack.pop()
+        node = ElementNode(parent.tag, parent.text, parent.tail, parent.attrib or None, tuple(converted))
+
+        if not stack:
+            return node
+
+        stack[-1][2].append(node)
+
+
+def _node_to_element(node):
+    """ Converts the node and its children to elements with an explicit stack """
+
+    def new_element(from_node):
+        converted = Element(from_node.name, from_node.attributes or {})
+        converted.text = from_node.text
+        converted.tail = from_node.tail
+        return converted
+
+    root = new_element(node)
+    stack = [(root, iter(node.children))]
+
+    while stack:
+        parent, children = stack[-1]
+        child = next(children, None)
+
+        if child is None:
+            stack.pop()
+        elif isinstance(child, ElementNode):
+            converted = new_element(child)
+            parent.append(converted)
+            stack.append((converted, iter(child.children)))
+        else:
+            parent.append(dict_to_element(child))
+
+    return root
+
+
+def element_to_object(elem_to_parse, element_path=None):
+    """
+    :return: the root key, and a dict with all the XML data, but without preserving structure, for instance:
+
+    <elem val="attribute"><val>nested text</val><val prop="attr">nested dict text</val>nested dict tail</elem>
+    {'elem': {
+        'val': [
+            u'nested text',
+            {'prop': u'attr', 'value': [u'nested dict text', u'nested dict tail']},
+            u'attribute'
+        ]
+    }}
+    """
+
+    if element_path is not None:
+        elem_to_parse = get_element(elem_to_parse, element_path)
+
+    element_tree = get_element_tree(elem_to_parse)
+    element_root = element_tree.getroot()
+    root_tag = u'' if element_root is None else element_root.tag
+
+    return root_tag, {root_tag: _element_to_object(element_root)}
+
+
+def iterparse_objects(file_or_path, *element_paths, include_namespaces=False):
+    """
+    Generates the root key and dict for each element at element_paths in the XML file, as element_to_object
+    would return them, converting each element as soon as it has been read and freeing it right after.
+    Without element paths, each child of the root element is converted.
+    :see: iterparse_paths(file_or_path, *element_paths, include_namespaces)
+    """
+
+    for element in iterparse_paths(file_or_path, *(element_paths or ('*',)), include_namespaces=include_namespaces):
+        yield element.tag, {element.tag: _element_to_object(element)}
+
+
+def _element_to_object(element):
+    """ Converts the element tree in post order with an explicit stack, so depth is not limited by recursion """
+
+    if not isinstance(element, ElementType):
+        return {}
+
+    stack = [(element, iter(element), {})]
+
+    while True:
+        parent, children, obj = stack[-1]
+        child = next(children, None)
+
+        if child is not None:
+            # Populate leaf elements first, as each child's object is needed by its parent
+            stack.append((child, iter(child), {}))
+            continue
+
+        stack.pop()
+        obj = _finish_element_object(parent, obj)
+
+        if not stack:
+            return obj
+
+        _accumulate_element_values(stack[-1][2], ((parent.tag, obj),))
+
+
+def _finish_element_object(element, obj):
+    """ Fills out an object populated with the element's children, and reduces it to text if nothing else """
+
+    attributes = ((k, v) for k, v in element.attrib.items() if v and v.strip())
+    _accumulate_element_values(obj, attributes, element.tag)
+
+    # Add as value a list containing text and tail if both are present, or just the text for one
+    text_values = ((text or u'').strip() for text in (element.text, element.tail))
+    text_values = [text for text in text_values if text]  # Filter on stripped values
+    text_values = (text_values[0] if len(text_values) == 1 else text_values) or u''
+
+    # Reduce obj to text only if no other keys are present
+    if not obj:
+        obj = text_values
+    elif text_values:
+        obj[_OBJ_VALUE] = text_values
+
+    return obj
+
+
+def _accumulate_element_values(obj, element_vals, tag=None):
+    """ Add or append non-None key/val pairs in element_vals under each key in obj """
+
+    for key, val in element_vals:
+        # Ensure XML tags don't override or get overridden by object properties
+        obj_key = '_'.join((tag, key)) if tag and key in _OBJ_PROPERTIES else key
+        obj_val = val.strip() if isinstance(val, str) else val
+
+        if obj_key not in obj:
+            obj[obj_key] = obj_val
+        elif isinstance(obj[obj_key], list):
+            obj[obj_key].append(obj_val)
+        else:
+            obj[obj_key] = [obj[obj_key]]
+            obj[obj_key].append(obj_val)
+
+
+def element_to_string(element, include_declaration=True, encoding=DEFAULT_ENCODING, method='xml'):
+    """ :return: the string value of the element or element tree """
+
+    element_as_string = element_to_bytes(element, include_declaration, encoding, method).decode(encoding=encoding)
+    if include_declaration:
+        return element_as_string
+    else:
+        return element_as_string.strip()
+
+
+def element_to_bytes(element, include_declaration=True, encoding=DEFAULT_ENCODING, method='xml'):
+    """
+    :return: the encoded value of the element or element tree, for writing without decoding it to a string
+    :see: iterencode_element(element, include_declaration, encoding, method, chunk_size)
+    """
+    return b''.join(iterencode_element(element, include_declaration, encoding, method))
+
+
+def iterencode_element(element, include_declaration=True, encoding=DEFAULT_ENCODING, method='xml',
+                       chunk_size=_DEFAULT_CHUNK_SIZE):
+    """
+    Serializes the element or element tree as it is walked, generating encoded chunks of about chunk_size bytes,
+    which join to the same value as element_to_string, without ever holding all of it in memory.
+    As with tostring, the XML declaration is only included for encodings other than UTF-8 and US-ASCII.
+    Serialization with methods other than xml is generated in one chunk.
+    """
+
+    if isinstance(element, ElementTree):
+        element = element.getroot()
+    elif not isinstance(element, ElementType):
+        element = get_element(element)
+
+    if element is None:
+        return iter(())
+
+    return _iterencode_element(element, None if include_declaration else False, encoding, method, chunk_size)
+
+
+def _iterencode_element(element, xml_declaration, encoding, method, chunk_size):
+    """ Generates the element encoded in chunks, with the XML declaration written as ElementTree.write does """
+
+    if method != 'xml':
+        yield tostring(element, encoding, method)
+        return
+
+    encoder = codecs.getincrementalencoder(encoding)('xmlcharrefreplace')
+
+    if xml_declaration or (xml_declaration is None and encoding.lower() not in ('utf-8', 'us-ascii')):
+        yield encoder.encode(f"<?xml version='1.0' encoding='{encoding}'?>\n")
+
+    pending = []
+    pending_size = 0
+
+    for value in _iter_serialized_xml(element):
+        pending.append(value)
+        pending_size += len(value)
+
+        if pending_size >= chunk_size:
+            yield encoder.encode(''.join(pending))
+            pending = []
+            pending_size = 0
+
+    yield encoder.encode(''.join(pending), final=True)
+
+
+def _iter_serialized_xml(element):
+    """ Generates the serialized parts of the element as ElementTree.write does, without recursion """
+
+    qnames, namespaces = _namespaces(element)
+    to_visit = [(None, iter((element,)))]  # Each element open, with an iterator of the children left to visit
+
+    while to_visit:
+        parent, children = to_visit[-1]
+        elem = next(children, None)
+
+        if elem is None:
+            to_visit.pop()
+
+            if parent is not None:
+                if qnames[parent.tag] is not None:
+                    yield f'</{qnames[parent.tag]}>'
+                if parent.tail:
+                    yield _escape_cdata(parent.tail)
+            continue
+
+        tag = elem.tag
+        text = elem.text
+
+        if tag is Comment:
+            yield f'<!--{text}-->'
+        elif tag is ProcessingInstruction:
+            yield f'<?{text}?>'
+        elif qnames[tag] is None:
+            if text:
+                yield _escape_cdata(text)
+
+            to_visit.append((elem, iter(elem)))
+            continue
+        else:
+            yield f'<{qnames[tag]}'
+
+            if namespaces and elem is element:
+                for uri, prefix in sorted(namespaces.items(), key=lambda ns: ns[1]):
+                    yield f' xmlns{":" + prefix if prefix else ""}="{_escape_attrib(uri)}"'
+
+            for key, val in (sorted(elem.items()) if _SORTED_ATTRIBUTES else elem.items()):
+                key = key.text if isinstance(key, QName) else key
+                val = qnames[val.text] if isinstance(val, QName) else _escape_attrib(val)
+                yield f' {qnames[key]}="{val}"'
+
+            if text or len(elem):
+                yield '>'
+                if text:
+                    yield _escape_cdata(text)
+
+                to_visit.append((elem, iter(elem)))
+                continue
+
+            yield ' />'
+
+        if elem.tail:
+            yield _escape_cdata(elem.tail)
+
+
+def string_to_element(element_as_string, include_namespaces=False):
+    """
+    :return: an element parsed from a string or bytes value, or the element as is if already parsed.
+    Bytes, bytearrays and memoryviews are parsed without decoding them, in the encoding they declare.
+    """
+
+    if element_as_string is None:
+        return None
+    elif isinstance(element_as_string, ElementTree):
+        return element_as_string.getroot()
+    elif isinstance(element_as_string, ElementType):
+        return element_as_string
+    elif hasattr(element_as_string, 'read'):
+        return string_to_element(element_as_string.read(), include_namespaces)
+    elif isinstance(element_as_string, _XML_BYTES_TYPES):
+        element_as_string = _lstrip_xml_bytes(element_as_string)
+    else:
+        element_as_string = _xml_content_to_string(element_as_string)
+
+    if not isinstance(element_as_string, (str, *_XML_BYTES_TYPES)):
+        # Let cElementTree handle the error
+        return fromstring(element_as_string)
+    elif _is_empty_xml(element_as_string):
+        # Same as ElementTree().getroot()
+        return None
+    elif _parse_cache is not None:
+        return _parse_cache.parse(element_as_string, include_namespaces)
+
+    return _string_to_element(element_as_string, include_namespaces)
+
+
+def _string_to_element(xml_string, include_namespaces):
+
+    if include_namespaces:
+        return fromstring(xml_string)
+
+    try:
+        # Namespaces are removed from the parsed tree rather than from the text
+        return _strip_element_namespaces(fromstring(xml_string))
+    except ParseError as ex:
+        if ex.code != _XML_UNBOUND_PREFIX:
+            raise
+
+        # Prefixes without declarations can only be stripped from the text
+        return fromstring(strip_namespaces(xml_string))
+
+
+def enable_parse_cache(max_entries=_DEFAULT_CACHE_ENTRIES, max_size=_DEFAULT_CACHE_SIZE):
+    """
+    Caches elements parsed from XML strings and bytes, so that passing the same content to several functions
+    parses it only once. The least recently used are discarded beyond max_entries, or max_size in total bytes
+    of XML content. Each call returns a copy of the cached element, so callers may change it freely.
+    Enabling the cache again replaces it with an empty one with the new limits.
+    :see: get_parse_cache_info()
+    """
+
+    global _parse_cache
+    _parse_cache = _ParseCache(max_entries, max_size)
+
+
+def disable_parse_cache():
+    """ Discards the parse cache, so that XML strings and bytes are parsed every time """
+
+    global _parse_cache
+    _parse_cache = None
+
+
+def clear_parse_cache():
+    """ Discards all the elements in the parse cache, and resets its statistics """
+
+    if _parse_cache is not None:
+        _parse_cache.clear()
+
+
+def get_parse_cache_info():
+    """ :return: a ParseCacheInfo with statistics and limits for the parse cache, or None if it is disabled """
+
+    return None if _parse_cache is None else _parse_cache.info()
+
+
+class _ParseCache(object):
+    """ A thread-safe LRU cache of parsed elements, by a hash of their content, its type, and if namespaces are kept """
+
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = self._hits = self._misses = 0
+
+    def info(self):
+        with self._lock:
+            return ParseCacheInfo(
+                self._hits, self._misses, len(self._entries), self._size, self.max_entries, self.max_size
+            )
+
+    def parse(self, xml_string, include_namespaces):
+        # Bytes are keyed apart from str, since only bytes are decoded as they declare
+        is_str = isinstance(xml_string, str)
+        content = xml_string.encode(DEFAULT_ENCODING) if is_str else xml_string
+        key = (hashlib.blake2b(content, digest_size=16).digest(), is_str, include_namespaces)
+
+        with self._lock:
+            cached = self._entries.get(key)
+
+            if cached is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+
+        if cached is not None:
+            return deepcopy(cached[0])
+
+        element = _string_to_element(xml_string, include_namespaces)
+        content_size = len(content)
+
+        if content_size <= self.max_size and self.max_entries > 0:
+            cached = deepcopy(element)
+
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = (cached, content_size)
+                    self._size += content_size
+
+                while len(self._entries) > self.max_entries or self._size > self.max_size:
+                    self._size -= self._entries.popitem(last=False)[1][1]
+
+        return element
+
+
+_parse_cache = None
+
+
+def _lstrip_xml_bytes(xml_bytes):
+    """ :return: bytes without leading whitespace, which can't precede a declaration, in a view if any is removed """
+
+    content_start = _XML_TOKENS[bytes]['whitespace'].match(xml_bytes).end()
+    return memoryview(xml_bytes)[content_start:] if content_start else xml_bytes
+
+
+def _is_empty_xml(xml_content):
+    """ :return: true if xml_content is blank or contains only an XML declaration, without copying it """
+
+    declaration = _XML_TOKENS[str if isinstance(xml_content, str) else bytes]['declaration'].match(xml_content)
+    return not xml_content or (declaration is not None and declaration.end() == len(xml_content))
+
+
+def _strip_element_namespaces(element):
+    """ Removes namespace URIs from the tags and attribute names of element and all its descendants """
+
+    for elem in element.iter():
+        _strip_namespace(elem)
+
+    return element
+
+
+def _strip_namespace(element):
+    """ Removes namespace URIs from the tag and attribute names of element, but not its descendants """
+
+    tag = element.tag
+
+    if tag[:1] == '{':
+        element.tag = tag[tag.find('}') + 1:]
+
+    attrib = element.attrib
+
+    if attrib and any(name[:1] == '{' for name in attrib):
+        element.attrib = {name[name.find('}') + 1:]: val for name, val in attrib.items()}
+
+
+def iter_elements(element_function, parent_to_parse, **kwargs):
+    """
+    Applies element_function to each of the sub-elements in parent_to_parse.
+    The passed in function must take at least one element, and an optional
+    list of kwargs which are relevant to each of the elements in the list:
+        def elem_func(each_elem, **kwargs)
+    """
+
+    parent = get_element(parent_to_parse)
+
+    if not hasattr(element_function, '__call__'):
+        return parent
+
+    for child in ([] if parent is None else parent):
+        element_function(child, **kwargs)
+
+    return parent
+
+
+def iterparse_elements(element_function, file_or_path, **kwargs):
+    """
+    Applies element_function to each of the sub-elements in the XML file.
+    The passed in function must take at least one element, and an optional
+    list of **kwarg which are relevant to each of the elements in the list:
+        def elem_func(each_elem, **kwargs)
+
+    Implements the recommended cElementTree iterparse pattern, which is
+    efficient for reading in a file, making changes and writing it again.
+    """
+
+    if not hasattr(element_function, '__call__'):
+        return
+
+    with _open_xml_file(file_or_path) as xml_file:
+        context = iter(iterparse(xml_file, events=('start', 'end')))
+        root = None  # Capture root for Memory management
+
+        # Start event loads child; by the End event it's ready for processing
+
+        for event, child in context:
+            if root is None:
+                root = child
+            if event == 'end':  # Ensures the element has been fully read
+                element_function(child, **kwargs)
+                root.clear()  # Descendants will not be accessed again
+
+
+def iterparse_paths(file_or_path, *element_paths, include_namespaces=False):
+    """
+    Generates each element at any of element_paths in the XML file, in document order, and the same elements
+    get_elements(file_or_path, element_path) would return for each path. Each is generated as soon as it has been
+    read in full, along with any other matches inside it, which are generated right after it.
+
+    Paths are relative to the root element, and support a subset of ElementPath syntax that can be matched
+    while streaming: tags, "*", "//" and attribute predicates, as in "records//record[@type='full']".
+
+    Only the elements being generated are kept in memory: each is detached from its parent when the next
+    one is requested, along with everything that precedes it, unless it is part of another that matched.
+    """
+
+    if file_or_path is None or not element_paths:
+        return
+
+    for element, _ in _iterparse_paths(file_or_path, element_paths, include_namespaces):
+        yield element
+
+
+def iterparse_handlers(element_handlers, file_or_path, include_namespaces=False, **kwargs):
+    """
+    Applies the functions in element_handlers, a dict of element paths to functions (or lists of them),
+    to the elements at each path, all in a single pass over the XML file. As with iterparse_elements,
+    each function must take at least one element, and an optional list of **kwargs:
+        def elem_func(each_elem, **kwargs)
+
+    Only elements at one of the paths are kept in memory, and only until their handlers are done.
+    :return: a dict with the number of elements handled for each path
+    :see: iterparse_paths(file_or_path, *element_paths, include_namespaces)
+    """
+
+    if file_or_path is None or not element_handlers:
+        return {}
+
+    handlers = {}
+    for element_path, functions in element_handlers.items():
+        functions = [functions] if hasattr(functions, '__call__') else (functions or [])
+        functions = [func for func in functions if hasattr(func, '__call__')]
+
+        if functions:
+            handlers[element_path] = functions
+
+    element_paths = list(handlers)
+    handled = dict.fromkeys(element_paths, 0)
+
+    if not element_paths:
+        return handled
+
+    for element, matched_paths in _iterparse_paths(file_or_path, element_paths, include_namespaces):
+        for path_idx in matched_paths:
+            element_path = element_paths[path_idx]
+
+            for element_function in handlers[element_path]:
+                element_function(element, **kwargs)
+
+            handled[element_path] += 1
+
+    return handled
+
+
+def _iterparse_paths(file_or_path, element_paths, include_namespaces):
+    """ Generates each matched element with the indices of the paths it matched, freeing all the others """
+
+    compiled_paths = [_compile_stream_path(path) for path in element_paths]
+
+    stack = []  # Open elements, each with their path states and what they matched
+    pending = []  # Matches inside the outermost open one, in document order until it has been read in full
+    matched = None
+
+    with _open_xml_file(file_or_path) as xml_file:
+        for event, element in iterparse(xml_file, events=('start', 'end')):
+
+            # Matches are generated an event late, after their tail has been read
+
+            if matched is not None:
+                matched_elements, parent, is_kept = matched
+                matched = None
+
+                for matched_element, matched_paths in matched_elements:
+                    yield matched_element, matched_paths
+
+                if not is_kept:
+                    parent.remove(matched_elements[0][0])
+
+            if event == 'start':
+                if not include_namespaces:
+                    _strip_namespace(element)
+
+                if not stack:
+                    path_states = tuple((idx, 0) for idx in range(len(compiled_paths)))
+                    stack.append((element, path_states, False, ()))
+                else:
+                    parent_states, parent_is_kept = stack[-1][1:3]
+                    path_states, matched_paths = _match_stream_paths(compiled_paths, parent_states, element)
+
+                    if matched_paths:
+                        pending.append((element, matched_paths))
+
+                    stack.append((element, path_states, parent_is_kept or bool(matched_paths), matched_paths))
+            else:
+                matched_paths = stack.pop()[-1]
+
+                if not stack:
+                    break
+
+                parent, _, parent_is_kept, _ = stack[-1]
+
+                if matched_paths:
+                    if pending[0][0] is element:
+                        # Nested matches are all read in full along with the outermost one
+                        matched = (pending, parent, parent_is_kept)
+                        pending = []
+                elif not parent_is_kept:
+                    parent.remove(element)  # Nothing under it matched or will match
+
+
+def _compile_stream_path(element_path):
+    """ :return: a tuple of (tag, attribute predicates, is_descendant) for each step in element_path """
+
+    if element_path.startswith('.//'):
+        path = element_path[1:]
+    elif element_path.startswith('./'):
+        path = element_path[2:]
+    else:
+        path = element_path
+    steps = []
+    pos = 0
+
+    while pos < len(path):
+        step = _STREAM_PATH_STEP_REGEX.match(path, pos)
+        if step is None:
+            raise SyntaxError(f'Unsupported streaming path: {element_path}')
+
+        delim, tag, predicates = step.groups()
+
+        if delim == XPATH_DELIM and pos == 0 or delim is None and pos > 0:
+            raise SyntaxError(f'Invalid streaming path: {element_path}')
+
+        predicates = tuple(
+            (name, None if not value else (double if single is None else single))
+            for name, value, double, single in (
+                predicate.groups() for predicate in _STREAM_PATH_PREDICATE_REGEX.finditer(predicates)
+            )
+        )
+
+        steps.append((None if tag == '*' else tag, predicates, delim == '//'))
+        pos = step.end()
+
+    if not steps or any(tag in ('.', '..') for tag, _, _ in steps):
+        raise SyntaxError(f'Invalid streaming path: {element_path}')
+
+    return tuple(steps)
+
+
+def _match_stream_paths(compiled_paths, parent_states, element):
+    """
+    Advances the parent's path states (path index, step index) by one level, to those of element.
+    :return: a tuple with the new path states, and the indices of the paths fully matched by element
+    """
+
+    tag, attrib = element.tag, element.attrib
+    path_states = set()
+    matched_paths = set()
+
+    for path_idx, step_idx in parent_states:
+        steps = compiled_paths[path_idx]
+        step_tag, predicates, is_descendant = steps[step_idx]
+
+        if is_descendant:
+            path_states.add((path_idx, step_idx))  # The step may still match further down
+
+        if step_tag is not None and step_tag != tag:
+            continue
+        elif predicates and not all(
+            name in attrib if value is None else attrib.get(name) == value for name, value in predicates
+        ):
+            continue
+        elif step_idx == len(steps) - 1:
+            matched_paths.add(path_idx)
+        else:
+            path_states.add((path_idx, step_idx + 1))
+
+    return tuple(path_states), tuple(sorted(matched_paths))
+
+
+def map_documents(element_function, files_or_paths, max_workers=None, chunk_size=1, max_pending=None,
+                  ordered=True, executor=None, **kwargs):
+    """
+    Applies element_function to the root element parsed from each of the XML files, in a pool of worker
+    processes, and generates a DocumentResult(source, result, error) for each file as it is done.
+    The function, its **kwargs and its result must all be picklable:
+        def elem_func(root_elem, **kwargs)
+
+    Errors are captured per file, so one bad file does not end the batch.
+    :param max_workers: the number of worker processes, which defaults to the number of CPUs
+    :param chunk_size: the number of files sent to a worker in each task
+    :param max_pending: the number of tasks in flight at once, by default twice the number of workers
+    :param ordered: if True, results are generated in the order of files_or_paths, otherwise as completed
+    :param executor: an existing concurrent.futures executor to use, which is left running afterwards
+    """
+
+    if not hasattr(element_function, '__call__') or not files_or_paths:
+        return
+
+    task_function = partial(_apply_to_document, element_function)
+
+    yield from _map_sources(
+        task_function, files_or_paths, kwargs, max_workers, chunk_size, max_pending, ordered, executor
+    )
+
+
+def iterparse_many(element_function, files_or_paths, element_paths, max_workers=None, chunk_size=1,
+                   max_pending=None, ordered=True, executor=None, **kwargs):
+    """
+    Applies element_function to each element at element_paths in each of the XML files, streaming each file
+    in a pool of worker processes, and generates a DocumentResult(source, result, error) for each file, with
+    a list of the function's results for each element as the result.
+    :see: iterparse_paths(file_or_path, *element_paths, include_namespaces)
+    :see: map_documents(element_function, files_or_paths, ...) for the remaining parameters
+    """
+
+    if not hasattr(element_function, '__call__') or not files_or_paths or not element_paths:
+        return
+
+    element_paths = (element_paths,) if isinstance(element_paths, str) else tuple(element_paths)
+    task_function = partial(_apply_to_document_paths, element_function, element_paths)
+
+    yield from _map_sources(
+        task_function, files_or_paths, kwargs, max_workers, chunk_size, max_pending, ordered, executor
+    )
+
+
+def iterparse_shards(element_function, file_or_path, shard_size=_DEFAULT_SHARD_SIZE, max_workers=None,
+                     max_pending=None, ordered=True, executor=None, include_namespaces=False, **kwargs):
+    """
+    Applies element_function to each child of the root element in a single large XML file, and generates
+    its results: the same as for each element in iterparse_paths(file_or_path, '*'), but in parallel.
+
+    The file is scanned for the byte offsets of each child, and split into shards of whole children of about
+    shard_size bytes. Each shard is parsed in a worker process, under a copy of the original root tag, so
+    that namespaces declared on it still apply. Scanning continues while the first shards are parsed.
+    The function, its **kwargs and its result must all be picklable:
+        def elem_func(each_elem, **kwargs)
+
+    Compressed files can not be split at byte offsets, so each of their children is parsed and passed to
+    element_function in turn, in this process.
+
+    :param ordered: if True, results are generated in document order, otherwise a shard at a time as completed
+    :see: map_documents(element_function, files_or_paths, ...) for the remaining parameters
+    """
+
+    if not hasattr(element_function, '__call__') or file_or_path is None:
+        return
+
+    file_path = getattr(file_or_path, 'name', file_or_path)
+
+    with open(file_path, 'rb') as xml_file:
+        is_compressed = _get_file_compression(xml_file) is not None
+
+    if is_compressed:
+        for element in iterparse_paths(file_path, '*', include_namespaces=include_namespaces):
+            yield element_function(element, **kwargs)
+        return
+    task_function = partial(_apply_to_shard, element_function, file_path, include_namespaces)
+    shards = _iter_record_shards(file_path, max(shard_size or 1, 1))
+
+    for result in _map_sources(task_function, shards, kwargs, max_workers, 1, max_pending, ordered, executor):
+        if result.error is not None:
+            raise result.error
+
+        yield from result.result
+
+
+def _apply_to_document(element_function, file_path, **kwargs):
+
+    if isinstance(file_path, (str, os.PathLike)):
+        return element_function(_parse_xml_path(file_path), **kwargs)
+
+    with _open_xml_file(file_path) as xml_file:
+        return element_function(get_element(xml_file), **kwargs)
+
+
+def _apply_to_document_paths(element_function, element_paths, file_path, **kwargs):
+    return [element_function(element, **kwargs) for element in iterparse_paths(file_path, *element_paths)]
+
+
+def _apply_to_shard(element_function, file_path, include_namespaces, shard, **kwargs):
+    """ Parses the records in a shard, preceded by everything in the file before the first record """
+
+    root_tag, header_end, shard_start, shard_end = shard
+    builder = TreeBuilder()
+    parser = XMLParser(target=builder)
+
+    with open(file_path, 'rb') as xml_file:
+        parser.feed(xml_file.read(header_end))
+        xml_file.seek(shard_start)
+
+        remaining = shard_end - shard_start
+        while remaining > 0:
+            chunk = xml_file.read(min(remaining, _DEFAULT_CHUNK_SIZE))
+            if not chunk:
+                break
+
+            parser.feed(chunk)
+            remaining -= len(chunk)
+
+    # Closing the root directly sets the tail of the last record without parsing the rest of the file
+    builder.end(root_tag)
+    root = builder.close()
+
+    results = []
+    for record in root:
+        if not include_namespaces:
+            _strip_element_namespaces(record)
+
+        results.append(element_function(record, **kwargs))
+
+    return results
+
+
+def _iter_record_shards(file_path, shard_size):
+    """
+    Scans the file for the byte offsets of each child of the root element, without building any elements.
+    :return: a generator of (root tag, first record offset, shard start, shard end) for each shard of records
+    """
+
+    parser = ParserCreate(namespace_separator='}')
+    root = {}
+    record_offsets = deque()
+    depth = 0
+
+    def start_element(name, attrs):
+        nonlocal depth
+
+        if depth == 1:
+            record_offsets.append(parser.CurrentByteIndex)
+        elif depth == 0:
+            root['tag'] = f'{{{name}' if '}' in name else name
+
+        depth += 1
+
+    def end_element(name):
+        nonlocal depth
+
+        depth -= 1
+        if depth == 0:
+            root['end'] = parser.CurrentByteIndex
+
+    def forbid_entity(name, is_parameter, value, base, sysid, pubid, notation_name):
+        raise EntitiesForbidden(name, value, base, sysid, pubid, notation_name)
+
+    def forbid_unparsed_entity(name, base, sysid, pubid, notation_name):
+        raise EntitiesForbidden(name, None, base, sysid, pubid, notation_name)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.EntityDeclHandler = forbid_entity
+    parser.UnparsedEntityDeclHandler = forbid_unparsed_entity
+
+    header_end = shard_start = None
+
+    with open(file_path, 'rb') as xml_file:
+        while True:
+            chunk = xml_file.read(_DEFAULT_CHUNK_SIZE)
+
+            try:
+                parser.Parse(chunk, not chunk)
+            except ExpatError as ex:
+                error = ParseError(str(ex))
+                error.code, error.position = ex.code, (ex.lineno, ex.offset)
+                raise error
+
+            while record_offsets:
+                record_offset = record_offsets.popleft()
+
+                if shard_start is None:
+                    header_end = shard_start = record_offset
+                elif record_offset - shard_start >= shard_size:
+                    yield root['tag'], header_end, shard_start, record_offset
+                    shard_start = record_offset
+
+            if not chunk:
+                break
+
+    if shard_start is not None:
+        yield root['tag'], header_end, shard_start, root['end']
+
+
+def _apply_to_sources(task_function, sources, kwargs):
+    """ Runs in worker processes: applies task_function to each source, capturing errors for each """
+
+    results = []
+
+    for source in sources:
+        try:
+            results.append(DocumentResult(source, task_function(source, **kwargs), None))
+        except Exception as ex:
+            results.append(DocumentResult(source, None, ex))
+
+    return results
+
+
+def _map_sources(task_function, sources, kwargs, max_workers, chunk_size, max_pending, ordered, executor):
+    """
+    Submits chunks of sources to the executor, keeping at most max_pending of them in flight,
+    and generates a DocumentResult for each source in order, or as each chunk completes.
+    """
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or max_workers * 2
+    chunk_size = max(chunk_size or 1, 1)
+
+    sources = iter(sources)
+    pool = executor or ProcessPoolExecutor(max_workers)
+    pending = deque() if ordered else {}
+
+    def submit_next():
+        """ :return: true if another chunk of sources was submitted, false if there are none left """
+
+        chunk = list(islice(sources, chunk_size))
 
-    if element_path and not element_exists(element, element_path):
-        element = insert_element(element, 0, element_path)
+        if chunk:
+            future = pool.submit(_apply_to_sources, task_function, chunk, kwargs)
 
-    if not isinstance(value, str):
-        value = u''
+            if ordered:
+                pending.append((future, chunk))
+            else:
+                pending[future] = chunk
 
-    setattr(element, prop_name, value)
+        return bool(chunk)
 
-    return element
+    def chunk_results(future, chunk):
+        """ :return: results for the chunk, or the same error for each source if the whole task failed """
 
+        error = future.exception()
+        return future.result() if error is None else [DocumentResult(source, None, error) for source in chunk]
 
-def set_elements_tail(parent_to_parse, element_path=None, tail_values=None):
-    """
-    Assigns an array of tail values to each of the elements parsed from the parent. The
-    tail values are assigned in the same order they are provided.
-    If there are less values then elements, the remaining elements are skipped; but if
-    there are more, new elements will be inserted for each with the remaining tail values.
-    """
+    try:
+        while len(pending) < max_pending and submit_next():
+            continue
 
-    if tail_values is None:
-        tail_values = []
+        while pending:
+            if ordered:
+                future, chunk = pending.popleft()
+                yield from chunk_results(future, chunk)
+                submit_next()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
 
-    return _set_elements_property(parent_to_parse, element_path, _ELEM_TAIL, tail_values)
+                for future in done:
+                    yield from chunk_results(future, pending.pop(future))
+                    submit_next()
+    finally:
+        for future in pending:
+            future.cancel()
 
+        if executor is None:
+            pool.shutdown()
 
-def set_elements_text(parent_to_parse, element_path=None, text_values=None):
+
+def strip_namespaces(file_or_xml):
     """
-    Assigns an array of text values to each of the elements parsed from the parent. The
-    text values are assigned in the same order they are provided.
-    If there are less values then elements, the remaining elements are skipped; but if
-    there are more, new elements will be inserted for each with the remaining text values.
+    Removes all namespaces from the XML file, string or bytes passed in, as a string or bytes respectively.
+    If file_or_xml is not a file, string or bytes, it is returned as is.
     """
 
-    if text_values is None:
-        text_values = []
+    xml_content = _xml_content_to_string(file_or_xml)
+    if not isinstance(xml_content, STRING_TYPES):
+        return xml_content
 
-    return _set_elements_property(parent_to_parse, element_path, _ELEM_TEXT, text_values)
+    return _strip_xml_namespaces(xml_content)[0]
 
 
-def _set_elements_property(parent_to_parse, element_path, prop_name, values):
+def _strip_xml_namespaces(xml_content, final=True):
     """
-    Assigns an array of string values to each of the elements parsed from the parent.
-    The values must be strings, and they are assigned in the same order they are provided.
-    The operation stops when values run out; extra values will be inserted as new elements.
-    :see: get_element(parent_to_parse, element_path)
+    Removes namespace declarations, and prefixes from tag and attribute names, in a single linear scan.
+    Comments, CDATA sections, processing instructions and doctypes are passed through untouched.
+    :param xml_content: str or bytes XML content, which determines the type of the stripped content
+    :param final: if False, scanning stops at incomplete markup at the end, so the rest can be rescanned
+    :return: a tuple with the stripped content, and the index up to which xml_content was scanned
     """
 
-    element = get_element(parent_to_parse)
+    tokens = _XML_TOKENS[str if isinstance(xml_content, str) else bytes]
+    colon, xmlns, xmlns_prefix = tokens['colon'], tokens['xmlns'], tokens['xmlns_prefix']
+    empty, lt, gt = tokens['empty'], tokens['lt'], tokens['gt']
 
-    if element is None or not values:
-        return []
+    content_len = len(xml_content)
 
-    if isinstance(values, str):
-        values = [values]
+    if final and colon not in xml_content and xmlns not in xml_content:
+        return xml_content, content_len
 
-    if not element_path:
-        return [_set_element_property(element, None, prop_name, values[0])]
+    tag_regex, attr_regex, special_regex = tokens['tag'], tokens['attr'], tokens['special']
+    special_markup = (tokens['bang'], tokens['question'])
+    open_bracket, close_bracket = tokens['brackets']
 
-    elements = get_elements(element, element_path)
-    affected = []
+    stripped = []
+    pos = colon_pos = xmlns_pos = special_pos = 0
 
-    for idx, val in enumerate(values):
-        if idx < len(elements):
-            next_elem = elements[idx]
-        else:
-            next_elem = insert_element(element, idx, element_path)
+    while pos < content_len:
 
-        affected.append(
-            _set_element_property(next_elem, None, prop_name, val)
-        )
+        # Copy everything up to the last tag before the next prefix or declaration as is
 
-    return affected
+        if colon_pos < pos:
+            colon_pos = xml_content.find(colon, pos)
+            colon_pos = content_len if colon_pos < 0 else colon_pos
+        if xmlns_pos < pos:
+            xmlns_pos = xml_content.find(xmlns, pos)
+            xmlns_pos = content_len if xmlns_pos < 0 else xmlns_pos
+        if special_pos < pos:
+            special_match = special_regex.search(xml_content, pos)
+            special_pos = content_len if special_match is None else special_match.start()
 
+        # Special markup may contain tags, so must be scanned in full
 
-def dict_to_element(element_as_dict):
-    """
-    Converts a Dictionary object to an element. The Dictionary can
-    include any of the following tags, only name is required:
-        - name (required): the name of the element tag
-        - text: the text contained by element
-        - tail: text immediately following the element
-        - attributes: a Dictionary containing element attributes
-        - children: a List of converted child elements
-    """
+        skip_end = min(colon_pos, xmlns_pos)
+        skip_end = special_pos if special_pos < skip_end else xml_content.rfind(lt, pos, skip_end)
 
-    if element_as_dict is None:
-        return None
-    elif isinstance(element_as_dict, ElementTree):
-        return element_as_dict.getroot()
-    elif isinstance(element_as_dict, ElementType):
-        return element_as_dict
-    elif not isinstance(element_as_dict, dict):
-        raise TypeError(f'Invalid element dict: {element_as_dict}')
+        if skip_end > pos:
+            stripped.append(xml_content[pos:skip_end])
+            pos = skip_end
 
-    if len(element_as_dict) == 0:
-        return None
+        markup_pos = xml_content.find(lt, pos)
 
-    try:
-        converted = Element(
-            element_as_dict[_ELEM_NAME],
-            element_as_dict.get(_ELEM_ATTRIBS, {})
-        )
+        if markup_pos < 0:
+            stripped.append(xml_content[pos:])
+            pos = content_len
+            break
+        elif markup_pos > pos:
+            stripped.append(xml_content[pos:markup_pos])
+            pos = markup_pos
 
-        converted.tail = element_as_dict.get(_ELEM_TAIL, u'')
-        converted.text = element_as_dict.get(_ELEM_TEXT, u'')
+        if xml_content[pos + 1:pos + 2] in special_markup:
 
-        for child in element_as_dict.get(_ELEM_CHILDREN, []):
-            converted.append(dict_to_element(child))
+            # Copy comments, CDATA, processing instructions and doctypes as they are
 
-    except KeyError:
-        raise SyntaxError(f'Invalid element dict: {element_as_dict}')
+            for section_start, section_end in tokens['sections']:
+                if xml_content.startswith(section_start, pos):
+                    markup_end = xml_content.find(section_end, pos + len(section_start))
+                    markup_end = markup_end if markup_end < 0 else markup_end + len(section_end)
+                    break
+            else:
+                markup_end = xml_content.find(gt, pos)
+                subset_pos = xml_content.find(open_bracket, pos, content_len if markup_end < 0 else markup_end)
 
-    return converted
+                if subset_pos >= 0:
+                    # Doctype internal subsets may themselves contain markup
+                    markup_end = xml_content.find(close_bracket, subset_pos)
+                    markup_end = markup_end if markup_end < 0 else xml_content.find(gt, markup_end)
+                if markup_end >= 0:
+                    markup_end += 1
 
+            if markup_end < 0:
+                if not final:
+                    break
 
-def element_to_dict(elem_to_parse, element_path=None, recurse=True):
-    """
-    :return: an element losslessly as a dictionary
+                stripped.append(xml_content[pos:])
+                pos = content_len
+            else:
+                stripped.append(xml_content[pos:markup_end])
+                pos = markup_end
 
-    If recurse is True, the element's children are included, otherwise they are omitted.
+            continue
 
-    The resulting Dictionary will have the following attributes:
-        - name: the name of the element tag
-        - text: the text contained by element
-        - tail: text immediately following the element
-        - attributes: a Dictionary containing element attributes
-        - children: a List of converted child elements
-    """
+        tag_match = tag_regex.match(xml_content, pos)
 
-    element = get_element(elem_to_parse, element_path)
+        if tag_match is None:
+            # Markup can not contain "<", so without another one the tag may be incomplete
+            if not final and xml_content.find(lt, pos + 1) < 0:
+                break
 
-    if element is not None:
-        converted = {
-            _ELEM_NAME: element.tag,
-            _ELEM_TEXT: element.text,
-            _ELEM_TAIL: element.tail,
-            _ELEM_ATTRIBS: element.attrib,
-            _ELEM_CHILDREN: []
-        }
+            # Otherwise it is malformed, and left for the parser to report
+            stripped.append(lt)
+            pos += 1
+            continue
 
-        if recurse is True:
-            for child in element:
-                converted[_ELEM_CHILDREN].append(element_to_dict(child, recurse=recurse))
+        tag = tag_match.group()
+        pos = tag_match.end()
 
-        return converted
+        if colon not in tag and xmlns not in tag:
+            stripped.append(tag)
+            continue
 
-    return {}
+        closing, tag_name, attributes, tag_end = tag_match.groups()
+        stripped_tag = [lt, closing, tag_name[tag_name.find(colon) + 1:]]
 
+        for attr_match in attr_regex.finditer(attributes):
+            space, attr_name, attr_value = attr_match.groups()
 
-def element_to_object(elem_to_parse, element_path=None):
-    """
-    :return: the root key, and a dict with all the XML data, but without preserving structure, for instance:
+            if attr_name != xmlns and not attr_name.startswith(xmlns_prefix):
+                stripped_tag.extend((space, attr_name[attr_name.find(colon) + 1:], attr_value))
 
-    <elem val="attribute"><val>nested text</val><val prop="attr">nested dict text</val>nested dict tail</elem>
-    {'elem': {
-        'val': [
-            u'nested text',
-            {'prop': u'attr', 'value': [u'nested dict text', u'nested dict tail']},
-            u'attribute'
-        ]
-    }}
-    """
+        stripped_tag.append(tag_end)
+        stripped.append(empty.join(stripped_tag))
 
-    if isinstance(elem_to_parse, str) or hasattr(elem_to_parse, 'read'):
-        # Always strip namespaces if not already parsed
-        elem_to_parse = strip_namespaces(elem_to_parse)
+    return empty.join(stripped), pos
 
-    if element_path is not None:
-        elem_to_parse = get_element(elem_to_parse, element_path)
 
-    element_tree = get_element_tree(elem_to_parse)
-    element_root = element_tree.getroot()
-    root_tag = u'' if element_root is None else element_root.tag
+def strip_xml_declaration(file_or_xml):
+    """
+    Removes XML declaration line from file, string or bytes passed in, as a string or bytes respectively.
+    If file_or_xml is not a file, string or bytes, it is returned as is.
+    """
 
-    return root_tag, {root_tag: _element_to_object(element_root)}
+    xml_content = _xml_content_to_string(file_or_xml)
+    if not isinstance(xml_content, STRING_TYPES):
+        return xml_content
 
+    tokens = _XML_TOKENS[str if isinstance(xml_content, str) else bytes]
+    return tokens['declaration'].sub(tokens['empty'], xml_content, 1)
 
-def _element_to_object(element):
 
-    obj = {}
-    if not isinstance(element, ElementType):
-        return obj
+def iterstrip_xml(file_or_path, include_namespaces=False, include_declaration=True, chunk_size=_DEFAULT_CHUNK_SIZE):
+    """
+    Generates the content of the XML file in chunks, with namespaces and optionally the XML declaration removed,
+    so that files too large for memory can be stripped. Only chunk_size is read at a time, though markup split
+    between chunks is held back until it is complete. Binary files and paths produce bytes, text files str.
+    :see: strip_namespaces(file_or_xml)
+    :see: strip_xml_declaration(file_or_xml)
+    """
 
-    # Populate leaf elements first to reduce cost of recursion stack
+    with _open_xml_file(file_or_path) as xml_file:
+        yield from _iterstrip_xml(xml_file, include_namespaces, include_declaration, chunk_size)
 
-    children = ((e.tag, _element_to_object(e)) for e in element)
-    _accumulate_element_values(obj, children)
 
-    # Now that all children have been populated, fill out the parent object
+def _iterstrip_xml(xml_file, include_namespaces, include_declaration, chunk_size):
 
-    attributes = ((k, v) for k, v in element.attrib.items() if v and v.strip())
-    _accumulate_element_values(obj, attributes, element.tag)
+    tokens = None
+    pending = None
 
-    # Add as value a list containing text and tail if both are present, or just the text for one
-    text_values = ((text or u'').strip() for text in (element.text, element.tail))
-    text_values = [text for text in text_values if text]  # Filter on stripped values
-    text_values = (text_values[0] if len(text_values) == 1 else text_values) or u''
+    while True:
+        chunk = xml_file.read(max(chunk_size, len(pending or ())))  # Grows to cover large markup
+        is_final = not chunk
 
-    # Reduce obj to text only if no other keys are present
-    if not obj:
-        obj = text_values
-    elif text_values:
-        obj[_OBJ_VALUE] = text_values
+        if pending is None:
+            tokens = _XML_TOKENS[str if isinstance(chunk, str) else bytes]
+            pending = tokens['empty']
 
-    return obj
+        xml_content = pending + chunk if pending else chunk
 
+        if not include_declaration:
+            leading = xml_content.lstrip()
 
-def _accumulate_element_values(obj, element_vals, tag=None):
-    """ Add or append non-None key/val pairs in element_vals under each key in obj """
+            if not is_final and (
+                len(leading) < len(tokens['declaration_start']) or (
+                    leading.startswith(tokens['declaration_start']) and tokens['declaration_end'] not in leading
+                )
+            ):
+                # Wait for the whole declaration to be read
+                pending = xml_content
+                continue
 
-    for key, val in element_vals:
-        # Ensure XML tags don't override or get overridden by object properties
-        obj_key = '_'.join((tag, key)) if tag and key in _OBJ_PROPERTIES else key
-        obj_val = val.strip() if isinstance(val, str) else val
+            declaration = tokens['declaration'].match(xml_content)
+            xml_content = xml_content if declaration is None else xml_content[declaration.end():]
+            include_declaration = True
 
-        if obj_key not in obj:
-            obj[obj_key] = obj_val
-        elif isinstance(obj[obj_key], list):
-            obj[obj_key].append(obj_val)
+        if include_namespaces:
+            stripped, scanned = xml_content, len(xml_content)
         else:
-            obj[obj_key] = [obj[obj_key]]
-            obj[obj_key].append(obj_val)
+            stripped, scanned = _strip_xml_namespaces(xml_content, is_final)
 
+        if stripped:
+            yield stripped
+        if is_final:
+            break
 
-def element_to_string(element, include_declaration=True, encoding=DEFAULT_ENCODING, method='xml'):
-    """ :return: the string value of the element or element tree """
+        pending = xml_content[scanned:]
 
-    if isinstance(element, ElementTree):
-        element = element.getroot()
-    elif not isinstance(element, ElementType):
-        element = get_element(element)
 
-    if element is None:
-        return u''
+def write_stripped_xml(file_or_path, out_file_or_path, include_namespaces=False, include_declaration=True,
+                       chunk_size=_DEFAULT_CHUNK_SIZE):
+    """
+    Writes the content of the XML file to out_file_or_path as it is read, with namespaces and optionally the
+    XML declaration removed. Content read from text files is encoded before it is written to a path.
+    :see: iterstrip_xml(file_or_path, include_namespaces, include_declaration, chunk_size)
+    """
 
-    element_as_string = tostring(element, encoding, method).decode(encoding=encoding)
-    if include_declaration:
-        return element_as_string
+    stripped = iterstrip_xml(file_or_path, include_namespaces, include_declaration, chunk_size)
+
+    if hasattr(out_file_or_path, 'write'):
+        for chunk in stripped:
+            out_file_or_path.write(chunk)
     else:
-        return strip_xml_declaration(element_as_string)
+        with open(out_file_or_path, 'wb') as out_file:
+            for chunk in stripped:
+                out_file.write(chunk.encode(DEFAULT_ENCODING) if isinstance(chunk, str) else chunk)
 
 
-def string_to_element(element_as_string, include_namespaces=False):
-    """ :return: an element parsed from a string value, or the element as is if already parsed """
+def _xml_content_to_string(file_or_xml):
+    """ :return: the stripped content of XML strings and files, with bytes left undecoded """
 
-    if element_as_string is None:
-        return None
-    elif isinstance(element_as_string, ElementTree):
-        return element_as_string.getroot()
-    elif isinstance(element_as_string, ElementType):
-        return element_as_string
-    else:
-        element_as_string = _xml_content_to_string(element_as_string)
+    if isinstance(file_or_xml, str):
+        return file_or_xml.strip()
+    elif isinstance(file_or_xml, _XML_BYTES_TYPES):
+        return bytes(file_or_xml).strip()
+    elif not hasattr(file_or_xml, 'read'):
+        return file_or_xml
 
-    if not isinstance(element_as_string, str):
-        # Let cElementTree handle the error
-        return fromstring(element_as_string)
-    elif not strip_xml_declaration(element_as_string):
-        # Same as ElementTree().getroot()
-        return None
-    elif include_namespaces:
-        return fromstring(element_as_string)
-    else:
-        return fromstring(strip_namespaces(element_as_string))
+    # Handles files with unicode or binary, but also StringIO
+    return _xml_content_to_string(file_or_xml.read())
 
 
-def iter_elements(element_function, parent_to_parse, **kwargs):
+def write_element(elem_to_parse, file_or_path, encoding=DEFAULT_ENCODING, compression=None, atomic=False,
+                  buffer_size=_DEFAULT_CHUNK_SIZE, skip_unchanged=False):
     """
-    Applies element_function to each of the sub-elements in parent_to_parse.
-    The passed in function must take at least one element, and an optional
-    list of kwargs which are relevant to each of the elements in the list:
-        def elem_func(each_elem, **kwargs)
+    Writes the contents of the parsed element to file_or_path, as it is serialized in chunks of buffer_size
+    :param compression: one of gzip, bz2 or xz, or None to compress paths ending in .gz, .bz2 or .xz
+    :param atomic: if True, a path is only replaced once its content has been completely written
+    :param skip_unchanged: if True, a path is not written if its decompressed content would be unchanged
+    :return: True if the element was written, or False if skipped as unchanged
+    :see: get_element(parent_to_parse, element_path)
     """
 
-    parent = get_element(parent_to_parse)
+    element = get_element_tree(elem_to_parse).getroot()
+    is_file = hasattr(file_or_path, 'write')
 
-    if not hasattr(element_function, '__call__'):
-        return parent
+    if compression is None and not is_file:
+        compression = _COMPRESSION_EXTENSIONS.get(os.path.splitext(file_or_path)[1].lower())
+    elif compression and compression not in _COMPRESSION_TYPES:
+        raise ValueError(f'Unsupported compression: {compression}')
 
-    for child in ([] if parent is None else parent):
-        element_function(child, **kwargs)
+    def encode():
+        # Written as it is serialized, with the XML declaration for every encoding
+        return _iterencode_element(element, True, encoding, 'xml', buffer_size)
 
-    return parent
+    if is_file:
+        _write_chunks(encode(), file_or_path, compression)
+        return True
 
+    if skip_unchanged and os.path.isfile(file_or_path):
+        try:
+            with open(file_or_path, 'rb') as existing:
+                existing_digest = _get_chunks_digest(_iter_file_chunks(existing, compression, buffer_size))
+        except (EOFError, OSError, lzma.LZMAError, zlib.error):
+            existing_digest = None  # Existing content that can not be decompressed is replaced
 
-def iterparse_elements(element_function, file_or_path, **kwargs):
-    """
-    Applies element_function to each of the sub-elements in the XML file.
-    The passed in function must take at least one element, and an optional
-    list of **kwarg which are relevant to each of the elements in the list:
-        def elem_func(each_elem, **kwargs)
+        if existing_digest == _get_chunks_digest(encode()):
+            return False
 
-    Implements the recommended cElementTree iterparse pattern, which is
-    efficient for reading in a file, making changes and writing it again.
-    """
+    if not atomic:
+        with open(file_or_path, 'wb', buffering=buffer_size) as out_file:
+            _write_chunks(encode(), out_file, compression)
+        return True
 
-    if not hasattr(element_function, '__call__'):
+    # Written beside the path, so that the rename can not cross devices, with the permissions of any it replaces
+
+    out_dir, out_name = os.path.split(os.path.abspath(file_or_path))
+    temp_path = os.path.join(out_dir, f'.{out_name}.{os.urandom(4).hex()}.tmp')
+
+    try:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        with open(os.open(temp_path, flags, 0o666), 'wb', buffering=buffer_size) as out_file:
+            if os.path.exists(file_or_path):
+                shutil.copymode(file_or_path, temp_path)
+
+            _write_chunks(encode(), out_file, compression)
+
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+        os.replace(temp_path, file_or_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return True
+
+
+def _write_chunks(chunks, out_file, compression):
+    """ Writes each of the chunks to the binary file, through a compressor if compression is provided """
+
+    if not compression:
+        for chunk in chunks:
+            out_file.write(chunk)
         return
 
-    file_path = getattr(file_or_path, 'name', file_or_path)
-    context = iter(iterparse(file_path, events=('start', 'end')))
-    root = None  # Capture root for Memory management
+    # Gzip output has no timestamp, so that unchanged content is compressed to the same bytes
+    if compression == 'gzip':
+        compressed = gzip.GzipFile(filename='', mode='wb', fileobj=out_file, mtime=0)
+    elif compression == 'bz2':
+        compressed = bz2.BZ2File(out_file, 'wb')
+    else:
+        compressed = lzma.LZMAFile(out_file, 'wb')
 
-    # Start event loads child; by the End event it's ready for processing
+    with compressed:
+        for chunk in chunks:
+            compressed.write(chunk)
 
-    for event, child in context:
-        if root is None:
-            root = child
-        if event == 'end':  # Ensures the element has been fully read
-            element_function(child, **kwargs)
-            root.clear()  # Descendants will not be accessed again
 
+def _iter_file_chunks(in_file, compression, chunk_size):
+    """ Generates chunks of the binary file's content, decompressed if compression is provided """
 
-def strip_namespaces(file_or_xml):
-    """
-    Removes all namespaces from the XML file or string passed in.
-    If file_or_xml is not a file or string, it is returned as is.
-    """
+    with ExitStack() as stack:
+        if compression:
+            in_file = _open_decompressed(in_file, compression, stack)
 
-    xml_content = _xml_content_to_string(file_or_xml)
-    if not isinstance(xml_content, str):
-        return xml_content
+        yield from iter(partial(in_file.read, chunk_size), b'')
 
-    # This pattern can have overlapping matches, necessitating the loop
-    while _NAMESPACES_FROM_DEC_REGEX.search(xml_content) is not None:
-        xml_content = _NAMESPACES_FROM_DEC_REGEX.sub(r'\1', xml_content)
 
-    # Remove namespaces at the tag level
-    xml_content = _NAMESPACES_FROM_TAG_REGEX.sub(r'\1', xml_content)
+def _get_chunks_digest(chunks):
+    """ :return: a fingerprint of the content of all the chunks """
 
-    # Remove namespaces at the attribute level
-    xml_content = _NAMESPACES_FROM_ATTR_REGEX.sub(r'\1\3', xml_content)
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        digest.update(chunk)
 
-    return xml_content
+    return digest.digest()
 
 
-def strip_xml_declaration(file_or_xml):
+def _document_method(element_function):
+    """ :return: a method applying element_function to the document's root, as its first argument """
+
+    @wraps(element_function)
+    def method(self, *args, **kwargs):
+        return element_function(self.root, *args, **kwargs)
+
+    return method
+
+
+class XMLDocument(object):
     """
-    Removes XML declaration line from file or string passed in.
-    If file_or_xml is not a file or string, it is returned as is.
+    A parsed XML document, with the functions in this module as methods applied to its root element:
+        document = XMLDocument('/path/to/file.xml')
+        document.get_element_text('idinfo/citation/citeinfo/title')
+
+    The document is parsed once, and keeps a map of each element's parent for get_parent and prune_empty,
+    which is only rebuilt once they find the document has changed.
+    If indexed is True, it also keeps an ElementIndex of its root, so that elements at simple paths are
+    found without searching, at the cost of memory for the path of every element.
     """
 
-    xml_content = _xml_content_to_string(file_or_xml)
-    if not isinstance(xml_content, str):
-        return xml_content
+    def __init__(self, parent_to_parse, indexed=False):
+        """
+        :param parent_to_parse: an element, tree, dict, node, file, path, or XML string or bytes
+        :param indexed: if True, elements are found through an ElementIndex of the document
+        """
 
-    return _XML_DECLARATION_REGEX.sub(r'', xml_content, 1)
+        if isinstance(parent_to_parse, str) and _FILE_LOCATION_REGEX.match(parent_to_parse):
+            self.root = get_remote_element(parent_to_parse)
+        else:
+            self.root = get_element(parent_to_parse)
 
+        self._index = ElementIndex(self.root) if indexed else None
+        self._parents = None
 
-def _xml_content_to_string(file_or_xml):
+    @classmethod
+    def from_url(cls, url, indexed=False):
+        """ :return: a document parsed from the content at the URL or file path """
+        return cls(get_remote_element(url), indexed)
 
-    if isinstance(file_or_xml, str):
-        return file_or_xml.strip()
-    elif isinstance(file_or_xml, bytes):
-        return file_or_xml.decode(encoding=DEFAULT_ENCODING).strip()
-    elif not hasattr(file_or_xml, 'read'):
-        return file_or_xml
+    @property
+    def tree(self):
+        return get_element_tree(self.root)
 
-    # Handles files with unicode or binary, but also StringIO
-    return _xml_content_to_string(file_or_xml.read())
+    def get_parent(self, element):
+        """ :return: the parent of element in the document, or None for the root or elements not in it """
 
+        if element is self.root:
+            return None
 
-def write_element(elem_to_parse, file_or_path, encoding=DEFAULT_ENCODING):
-    """
-    Writes the contents of the parsed element to file_or_path
-    :see: get_element(parent_to_parse, element_path)
-    """
+        parent = self._get_parents().get(element)
 
-    xml_header = f'<?xml version="1.0" encoding="{encoding}"?>'
+        if parent is None or not any(child is element for child in parent):
+            # Rebuilt only once the document has changed since the last time
+            parent = self._get_parents(rebuild=True).get(element)
+
+        return parent
 
-    get_element_tree(elem_to_parse).write(file_or_path, encoding, xml_header)
+    def _get_parents(self, rebuild=False):
+        """ :return: the map of each element in the document to its parent, built again if rebuild is True """
+
+        if rebuild or self._parents is None:
+            self._parents = _get_parents(self.root)
+        return self._parents
+
+    def prune_empty(self, element_paths=None):
+        """ :see: prune_empty(parent_to_parse, element_paths=None) """
+        return _prune_empty(self.root, element_paths, self._get_parents)
+
+    def iter_elements(self, element_function, **kwargs):
+        """ :see: iter_elements(element_function, parent_to_parse, **kwargs) """
+        return iter_elements(element_function, self.root, **kwargs)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({get_element_name(self.root)!r})'
+
+    clear_children = _document_method(clear_children)
+    clear_element = _document_method(clear_element)
+    copy_element = _document_method(copy_element)
+    copy_elements = _document_method(copy_elements)
+
+    element_exists = _document_method(element_exists)
+    elements_exist = _document_method(elements_exist)
+    element_is_empty = _document_method(element_is_empty)
+
+    get_element = _document_method(get_element)
+    get_elements = _document_method(get_elements)
+    query_many = _document_method(query_many)
+
+    insert_element = _document_method(insert_element)
+    remove_element = _document_method(remove_element)
+    remove_elements = _document_method(remove_elements)
+    remove_empty_element = _document_method(remove_empty_element)
+
+    get_element_name = _document_method(get_element_name)
+    get_element_attribute = _document_method(get_element_attribute)
+    get_element_attributes = _document_method(get_element_attributes)
+    get_elements_attributes = _document_method(get_elements_attributes)
+    set_element_attributes = _document_method(set_element_attributes)
+    remove_element_attributes = _document_method(remove_element_attributes)
+
+    get_element_tail = _document_method(get_element_tail)
+    get_elements_tail = _document_method(get_elements_tail)
+    get_element_text = _document_method(get_element_text)
+    get_elements_text = _document_method(get_elements_text)
+
+    iter_elements_attributes = _document_method(iter_elements_attributes)
+    iter_elements_tail = _document_method(iter_elements_tail)
+    iter_elements_text = _document_method(iter_elements_text)
+
+    set_element_tail = _document_method(set_element_tail)
+    set_elements_tail = _document_method(set_elements_tail)
+    set_element_text = _document_method(set_element_text)
+    set_elements_text = _document_method(set_elements_text)
+    apply_updates = _document_method(apply_updates)
+
+    element_to_dict = _document_method(element_to_dict)
+    element_to_mapping = _document_method(element_to_mapping)
+    element_to_node = _document_method(element_to_node)
+    element_to_object = _document_method(element_to_object)
+    element_to_string = _document_method(element_to_string)
+    element_to_bytes = _document_method(element_to_bytes)
+    iterencode_element = _document_method(iterencode_element)
+
+    write_element = _document_method(write_element)
@@ -1,24 +1,43 @@
+import bz2
+import gzip
 import io
+import lzma
 import mock
 import os
+import pathlib
+import random
+import sys
 import unittest
+import weakref
+import zipfile
 
-from ..elements import Element, ElementTree, ElementType
-from ..elements import iselement, fromstring
+from concurrent.futures import ThreadPoolExecutor
 
-from ..elements import create_element_tree, clear_children, clear_element, copy_element
+from ..elements import Comment, Element, ElementIndex, ElementTree, ElementType, ProcessingInstruction, XMLDocument
+from ..elements import iselement, fromstring, tostring, ParseError
+
+from ..elements import create_element_tree, clear_children, clear_element, copy_element, copy_elements
 from ..elements import get_element_tree, get_element, get_remote_element, get_elements
-from ..elements import element_exists, elements_exist, element_is_empty
-from ..elements import insert_element, remove_element, remove_elements, remove_empty_element
+from ..elements import clear_path_cache, get_path_cache_info, set_path_cache_size
+from ..elements import element_exists, elements_exist, element_is_empty, query_many
+from ..elements import insert_element, remove_element, remove_elements, remove_empty_element, prune_empty
 from ..elements import get_element_name, get_element_attribute, get_element_attributes
 from ..elements import get_elements_attributes, set_element_attributes, remove_element_attributes
+from ..elements import iter_elements_attributes, iter_elements_tail, iter_elements_text
 from ..elements import get_element_tail, get_elements_tail, get_element_text, get_elements_text
-from ..elements import set_element_tail, set_elements_tail, set_element_text, set_elements_text
-from ..elements import dict_to_element, element_to_dict, element_to_object
-from ..elements import element_to_string, string_to_element, strip_namespaces, strip_xml_declaration
-from ..elements import iter_elements, iterparse_elements, write_element
+from ..elements import set_element_tail, set_elements_tail, set_element_text, set_elements_text, apply_updates
+from ..elements import dict_to_element, element_to_dict, element_to_mapping, element_to_node, element_to_object
+from ..elements import ElementMapping, ElementNode
+from ..elements import element_to_bytes, element_to_string, iterencode_element
+from ..elements import string_to_element, strip_namespaces, strip_xml_declaration
+from ..elements import clear_parse_cache, disable_parse_cache, enable_parse_cache, get_parse_cache_info
+from ..elements import iter_elements, iterparse_elements, iterparse_handlers, iterparse_objects, iterparse_paths
+from ..elements import iterstrip_xml
+from ..elements import iterparse_many, iterparse_shards, map_documents, write_element, write_stripped_xml
+from ..elements import _get_parents, _strip_xml_namespaces
 
 from ..strings import DEFAULT_ENCODING
+from ..__main__ import main
 
 
 ELEM_NAME = 'tag'
@@ -61,11 +80,12 @@ class XMLTestCase(unittest.TestCase):
 
         self.elem_data_bin = self.elem_data_str.encode(DEFAULT_ENCODING)
         self.elem_data_dict = element_to_dict(self.elem_data_str)
+        self.elem_data_node = element_to_node(self.elem_data_str)
         self.elem_data_reader = io.StringIO(self.elem_data_str)
 
         self.elem_data_inputs = (
             fromstring(self.elem_data_str), ElementTree(fromstring(self.elem_data_str)),
-            self.elem_data_bin, self.elem_data_str, self.elem_data_dict, self.elem_data_reader
+            self.elem_data_bin, self.elem_data_str, self.elem_data_dict, self.elem_data_node, self.elem_data_reader
         )
         self.elem_empty_inputs = (None, _EMPTY_XML_1, _EMPTY_XML_2, b'', '', io.StringIO(''), ElementTree())
 
@@ -180,6 +200,34 @@ class XMLTestCase(unittest.TestCase):
                 self.assert_elements_are_equal(child, those_elems[idx], next_name)
 
 
+def get_text_values(element, element_path=None):
+    """ A module level function for tests run in worker processes, which must be able to import it """
+    return get_elements_text(element, element_path) if element_path else get_element_text(element)
+
+
+def remove_element_sequentially(element, element_path, clear_empty=False):
+    """ The original remove_element, which removes the elements at each parent in turn, to test bulk removal by """
+
+    removed = []
+
+    if element.find(element_path) is not None:
+        if '/' not in element_path:
+            for subelem in element.findall(element_path):
+                removed.append(subelem)
+                element.remove(subelem)
+        else:
+            parent_segment, _, last_segment = element_path.rpartition('/')
+
+            for parent in element.findall(parent_segment):
+                rem = remove_element_sequentially(parent, last_segment)
+                removed.extend(rem if isinstance(rem, list) else [rem])
+
+            if clear_empty:
+                removed.extend(remove_empty_element(element, parent_segment))
+
+    return removed[0] if len(removed) == 1 else (removed or None)
+
+
 class XMLTests(XMLTestCase):
 
     def test_create_element_tree(self):
@@ -259,6 +307,63 @@ class XMLTests(XMLTestCase):
             copy_element, self.elem_xpath, to_element='<a />', path_to_copy=self.elem_xpath
         )
 
+    def test_copy_element_attributes(self):
+        """ Tests copy_element gives the copy and each of its children their own attributes """
+
+        from_element = get_element('<a x="1"><b y="2"><c z="3"/></b></a>')
+        copied = copy_element(from_element)
+
+        self.assertEqual(element_to_string(copied), element_to_string(from_element))
+
+        for from_elem, copied_elem in zip(from_element.iter(), copied.iter()):
+            self.assertIsNot(copied_elem, from_elem)
+            self.assertIsNot(copied_elem.attrib, from_elem.attrib)
+
+        copied.find('b/c').set('z', '4')
+        self.assertEqual(from_element.find('b/c').get('z'), '3')
+
+    def test_copy_elements(self):
+        """ Tests copy_elements copies subtrees at many paths, inserting missing destination elements """
+
+        self.assertIsNone(copy_elements(None, '<a/>', ['b']))
+        self.assertEqual(element_to_string(copy_elements('<a><b/></a>')), element_to_string(get_element('<a/>')))
+
+        from_xml = '<a><b x="1"><c>c1</c></b><b x="2"><c>c2</c><d/></b><e>eee</e></a>'
+        from_element = get_element(from_xml)
+
+        # Ensure each element at the source path replaces the content of one at the destination path
+        to_element = get_element('<z><y><b>old<f/></b></y></z>')
+        copied = copy_elements(from_element, to_element, [('b', 'y/b'), ('e', 'y/w/@e'), 'e', ('x', 'y/x'), ('', 'v')])
+
+        self.assertIs(copied, to_element)
+        self.assertEqual(
+            element_to_string(copied, include_declaration=False),
+            (
+                '<z><v><b x="1"><c>c1</c></b><b x="2"><c>c2</c><d /></b><e>eee</e></v><e>eee</e>'
+                '<y><w e="eee" /><b x="1"><c>c1</c></b><b x="2"><c>c2</c><d /></b></y></z>'
+            )
+        )
+
+        # Ensure copies share nothing with their sources
+        for elem in copied.iter():
+            for from_elem in from_element.iter():
+                self.assertIsNot(elem, from_elem)
+                self.assertIsNot(elem.attrib, from_elem.attrib)
+
+        self.assertEqual(element_to_string(from_element), element_to_string(get_element(from_xml)))
+
+        # Ensure a new element is created without a destination, and pairs may be given as a dict
+        copied = copy_elements(from_xml, paths_to_copy={'b/c': 'c', 'b': 'g/h'})
+        self.assertEqual(
+            element_to_string(copied, include_declaration=False),
+            '<a><g><h x="1"><c>c1</c></h><h x="2"><c>c2</c><d /></h></g><c>c1</c><c>c2</c></a>'
+        )
+
+        # Ensure deep subtrees are copied without recursion
+        deep_xml = '<a><b>' + '<c>' * 2000 + '</c>' * 2000 + '</b></a>'
+        copied = copy_elements(deep_xml, None, ['b'])
+        self.assertEqual(sum(1 for _ in copied.iter('c')), 2000)
+
     def test_get_element_tree(self):
         """ Tests get_element_tree with None, and for equality with different params """
 
@@ -285,6 +390,40 @@ class XMLTests(XMLTestCase):
             with self.assertRaises(TypeError):
                 get_element(bad_xml)
 
+    def test_get_element_path(self):
+        """ Tests get_element and get_element_tree parse path objects as the content of the files would be parsed """
+
+        for file_path in (self.elem_ascii_file_path, self.elem_data_file_path, self.namespace_file_path):
+            with open(file_path, 'rb') as data:
+                base_elem = get_element(data.read())
+
+            self.assert_elements_are_equal(get_element(pathlib.Path(file_path)), base_elem)
+            self.assert_elements_are_equal(get_element_tree(pathlib.Path(file_path)).getroot(), base_elem)
+            self.assert_elements_are_equal(get_remote_element(os.path.abspath(file_path)), base_elem)
+            self.assert_elements_are_equal(XMLDocument(pathlib.Path(file_path)).root, base_elem)
+
+        self.assertEqual(get_element_text(pathlib.Path(self.elem_data_file_path), 'c/j'), '♩♪♫♬')
+
+        # Ensure content the parser can not be fed in chunks is parsed as a string would be
+        file_path = pathlib.Path(self.test_file_path)
+
+        for content in (b'', b'  \n', b'<?xml version="1.0" encoding="UTF-8"?>\n', b'\n<?xml version="1.0"?><a/>'):
+            file_path.write_bytes(content)
+            self.assertEqual(
+                element_to_string(get_element(file_path)), element_to_string(get_element(content)), repr(content)
+            )
+
+        file_path.write_bytes(b'<a xmlns:x="urn:x"><x:b x:c="c"/><y:d/></a>')
+        self.assertEqual(element_to_string(get_element(file_path)), '<a><b c="c" /><d /></a>')
+
+        file_path.write_bytes(gzip.compress(b'<a><b/></a>'))
+        self.assertEqual(element_to_string(get_element(file_path)), '<a><b /></a>')
+
+        for bad_content in (b'<a>', b'<a></b>', b'NOT XML'):
+            file_path.write_bytes(bad_content)
+            with self.assertRaises(SyntaxError):
+                get_element(file_path)
+
     def test_get_element_xpath(self):
         """ Tests get_element at an XPATH location with different element data """
         self.assert_element_function(get_element, self.elem_xpath, element_path=self.elem_xpath)
@@ -338,6 +477,110 @@ class XMLTests(XMLTestCase):
             get_remote_element(remote_url, 'body'), 'Remote element returns None for "body"'
         )
 
+    @mock.patch('parserutils.elements.urlopen')
+    def test_compressed_inputs(self, mock_urlopen):
+        """ Tests compressed files and paths are decompressed as they are parsed, by their content or extension """
+
+        base_elem = fromstring(self.elem_data_str)
+
+        with open(self.elem_data_file_path, 'rb') as data:
+            xml_content = data.read()
+
+        compressed = {
+            '.gz': gzip.compress(xml_content),
+            '.bz2': bz2.compress(xml_content),
+            '.xz': lzma.compress(xml_content),
+            '.zip': io.BytesIO(),
+        }
+        with zipfile.ZipFile(compressed['.zip'], 'w') as archive:
+            archive.writestr('data/', b'')
+            archive.writestr('data/elem_data.xml', xml_content)
+        compressed['.zip'] = compressed['.zip'].getvalue()
+
+        expected_tags = []
+        iterparse_elements(lambda elem: expected_tags.append(elem.tag), self.elem_data_file_path)
+
+        for extension, content in compressed.items():
+            for file_path in (self.test_file_path + extension, self.test_file_path):
+                self.addCleanup(lambda path: os.path.exists(path) and os.remove(path), file_path)
+
+                with open(file_path, 'wb') as test:
+                    test.write(content)
+
+                self.assert_elements_are_equal(get_remote_element(file_path), base_elem)
+                self.assert_elements_are_equal(XMLDocument(file_path).root, base_elem)
+
+                with open(file_path, 'rb') as test:
+                    self.assert_elements_are_equal(get_element(test), base_elem)
+
+                self.assertEqual(
+                    [elem.tag for elem in iterparse_paths(file_path, 'c/*')],
+                    [elem.tag for elem in base_elem.iterfind('c/*')]
+                )
+                self.assertEqual(b''.join(iterstrip_xml(file_path)), b''.join(iterstrip_xml(self.elem_data_file_path)))
+
+                parsed_tags = []
+                iterparse_elements(lambda elem: parsed_tags.append(elem.tag), file_path)
+                self.assertEqual(parsed_tags, expected_tags)
+
+            self.assert_elements_are_equal(get_element(io.BytesIO(content)), base_elem)
+
+            mock_urlopen.return_value = io.BufferedReader(io.BytesIO(content))
+            self.assert_elements_are_equal(get_remote_element('https://example.com/data.xml'), base_elem)
+
+        # Ensure uncompressed content is parsed as it is, whatever its extension
+        file_path = self.test_file_path + '.gz'
+        with open(file_path, 'wb') as test:
+            test.write(xml_content)
+
+        self.assert_elements_are_equal(get_remote_element(file_path), base_elem)
+
+        # Ensure file objects passed in are left open
+        with open(file_path, 'rb') as test:
+            get_element(test)
+            self.assertFalse(test.closed)
+
+    def test_get_elements_path_cache(self):
+        """ Tests elements are found the same way as ElementPath, with each path compiled once while cached """
+
+        self.addCleanup(set_path_cache_size)
+
+        base_elem = fromstring(self.elem_data_str)
+        element_paths = (
+            'b', 'c/d', './c/d', 'c/', 'c/*', './/i', 'c//h/i', 'c/d[2]', 'c/d[last()]', "c[d='dd']/d",
+            'c/*[@t5]', "c/*[@t5='ttttt']", 'c[d]', 'c/g/h/..', 'c/x', '{urn:x}c', '.', 'c/.'
+        )
+
+        set_path_cache_size(len(element_paths))
+
+        for _ in range(3):
+            for element_path in element_paths:
+                expected = base_elem.findall(element_path)
+
+                self.assertEqual(get_elements(base_elem, element_path), expected, f'Failed for {element_path}')
+                self.assertIs(get_element(base_elem, element_path), expected[0] if expected else None)
+
+        # Single tags are found without compiling a path, and paths ending in / are compiled as /*
+        info = get_path_cache_info()
+        compiled = [element_path for element_path in element_paths if element_path != 'b']
+        distinct = len({'c/*' if element_path == 'c/' else element_path for element_path in compiled})
+
+        self.assertEqual((info.misses, info.currsize, info.maxsize), (distinct, distinct, len(element_paths)))
+        self.assertEqual(info.hits, len(compiled) * 6 - distinct)
+
+        # The least recently used paths are discarded one at a time
+        set_path_cache_size(2)
+        for element_path in ('c/d', 'c/e', 'c/d', 'c/f', 'c/d', 'c/e'):
+            get_elements(base_elem, element_path)
+        self.assertEqual(get_path_cache_info()[:2], (2, 4))
+
+        clear_path_cache()
+        self.assertEqual(get_path_cache_info()[:2], (0, 0))
+
+        for invalid in ('/c', 'c/d[0]', 'c/d[x=]'):
+            with self.assertRaises(SyntaxError):
+                get_elements(base_elem, invalid)
+
     def test_get_elements(self):
         """ Tests get_elements for single and multiple XPATHs parsed from different data sources """
 
@@ -423,6 +666,113 @@ class XMLTests(XMLTestCase):
                 element_to_dict(get_element(base_elem, elem.tag))
             )
 
+    def test_element_to_mapping(self):
+        """ Tests element to mapping conversion gives the same values as element to dictionary conversion """
+
+        self.assertEqual(element_to_mapping(None), {}, 'None check failed for element_to_mapping')
+
+        base_elem = get_element(self.elem_data_str)
+
+        for data in self.elem_data_inputs:
+            test_mapping = element_to_mapping(data)
+
+            self.assertIsInstance(test_mapping, ElementMapping)
+            self.assertEqual(test_mapping, self.elem_data_dict)
+            self.assertEqual(set(test_mapping), set(self.elem_data_dict))
+            self.assert_elements_are_equal(base_elem, dict_to_element(test_mapping))
+            self.assert_elements_are_equal(base_elem, get_element(test_mapping))
+
+        # Test conversion with element path and depth for each sub-element
+        for elem in base_elem:
+            test_mapping = element_to_mapping(base_elem, elem.tag)
+
+            self.assertEqual(test_mapping, element_to_dict(base_elem, elem.tag))
+            self.assertEqual(element_to_mapping(elem, depth=0), element_to_dict(elem, recurse=False))
+            self.assertEqual(test_mapping['name'], elem.tag)
+            self.assertEqual(test_mapping['text'], elem.text)
+            self.assertEqual(test_mapping['tail'], elem.tail)
+            self.assertIs(test_mapping['attributes'], elem.attrib)
+
+        test_mapping = element_to_mapping(base_elem, depth=1)
+        self.assertEqual(len(test_mapping['children']), len(base_elem))
+
+        for child, elem in zip(test_mapping['children'], base_elem):
+            self.assertEqual(child, element_to_dict(elem, recurse=False))
+            self.assertEqual(child['children'], [])
+
+        # Test children are converted as they are accessed, and the mapping is read only
+        test_mapping = element_to_mapping(base_elem)
+        test_children = test_mapping['children']
+
+        self.assertEqual(len(test_children), len(base_elem))
+        self.assertEqual(test_children[-1], element_to_dict(base_elem[-1]))
+        self.assertEqual(test_children[1:3], [element_to_dict(elem) for elem in base_elem[1:3]])
+        self.assertEqual(list(reversed(test_children)), element_to_dict(base_elem)['children'][::-1])
+
+        with self.assertRaises(IndexError):
+            test_children[len(base_elem)]
+        with self.assertRaises(TypeError):
+            test_mapping['name'] = 'changed'
+        with self.assertRaises(TypeError):
+            test_children[0] = 'changed'
+        with self.assertRaises(KeyError):
+            test_mapping['missing']
+
+    def test_element_to_node(self):
+        """ Tests element to node conversion on elements converted from different data sources """
+
+        self.assertIsNone(element_to_node(None), 'None check failed for element_to_node')
+
+        base_node = element_to_node(self.elem_data_str)
+        base_elem = get_element(self.elem_data_str)
+
+        for data in self.elem_data_inputs:
+            test_node = element_to_node(data)
+
+            # Test conversion to and from for each data input
+            self.assertEqual(
+                base_node, test_node, 'Converted node equality check failed for {0}'.format(type(data).__name__)
+            )
+            self.assert_elements_are_equal(base_elem, dict_to_element(test_node))
+            self.assert_elements_are_equal(base_elem, get_element(test_node))
+            self.assertEqual(element_to_dict(test_node), self.elem_data_dict)
+            self.assertEqual(element_to_object(test_node), element_to_object(base_elem))
+            self.assertEqual(element_to_string(test_node), element_to_string(base_elem))
+
+        # Test conversion with element path, and without children, for each sub-element
+        for elem in base_elem:
+            test_child = element_to_node(base_elem, elem.tag)
+
+            self.assertIsInstance(test_child, ElementNode)
+            self.assertEqual(test_child, element_to_node(get_element(base_elem, elem.tag)))
+            self.assert_elements_are_equal(elem, dict_to_element(test_child))
+
+            shallow = element_to_node(elem, recurse=False)
+            self.assertEqual(shallow, test_child._replace(children=()))
+            self.assertEqual(element_to_dict(shallow), element_to_dict(elem, recurse=False))
+
+        # Test nodes and dicts may be nested in each other
+        mixed = base_node._replace(children=tuple(
+            element_to_dict(child) if idx % 2 else child for idx, child in enumerate(base_node.children)
+        ))
+        self.assert_elements_are_equal(base_elem, dict_to_element(mixed))
+
+        mixed = dict(self.elem_data_dict, children=list(base_node.children))
+        self.assert_elements_are_equal(base_elem, dict_to_element(mixed))
+
+        # Test conversion of trees nested deeper than the recursion limit
+        depth = sys.getrecursionlimit() * 2
+        deep_elem = get_element(u'<a>' * depth + u'</a>' * depth)
+        deep_node = element_to_node(deep_elem)
+
+        node_depth = 0
+        while deep_node is not None:
+            deep_node = deep_node.children[0] if deep_node.children else None
+            node_depth += 1
+
+        self.assertEqual(node_depth, depth)
+        self.assertEqual(sum(1 for _ in dict_to_element(element_to_node(deep_elem)).iter()), depth)
+
     def test_element_to_object(self):
         """ Tests element to object conversion on elements converted from different data sources """
 
@@ -445,6 +795,42 @@ class XMLTests(XMLTestCase):
                 element_to_object(get_element(base_elem, elem.tag))
             )
 
+    def test_element_to_object_depth(self):
+        """ Tests element to object conversion of documents nested deeper than the recursion limit """
+
+        depth = sys.getrecursionlimit() * 2
+        deep_str = u'<a x="1">' * depth + u'text' + u'</a>tail' * (depth - 1) + u'</a>'
+
+        root_key, deep_obj = element_to_object(deep_str)
+        deep_obj = deep_obj[root_key]
+
+        self.assertEqual(root_key, 'a')
+        self.assertEqual(deep_obj['x'], '1')
+        self.assertNotIn('value', deep_obj)
+
+        for _ in range(depth - 2):
+            deep_obj = deep_obj['a']
+            self.assertEqual((deep_obj['x'], deep_obj['value']), ('1', 'tail'))
+
+        self.assertEqual(deep_obj['a'], {'x': '1', 'value': ['text', 'tail']})
+
+    def test_iterparse_objects(self):
+        """ Tests iterparse_objects converts each element at the paths as element_to_object would """
+
+        self.assertEqual(list(iterparse_objects(None)), [])
+
+        for file_path in (self.elem_data_file_path, self.namespace_file_path):
+            base_elem = get_remote_element(file_path)
+
+            self.assertEqual(
+                list(iterparse_objects(file_path)),
+                [element_to_object(elem) for elem in base_elem]
+            )
+            self.assertEqual(
+                list(iterparse_objects(file_path, 'c/d', 'c/g')),
+                [element_to_object(elem) for elem in base_elem.iterfind('c/*') if elem.tag in ('d', 'g')]
+            )
+
     def test_element_to_string(self):
         """ Tests element conversion from different data sources to XML, with and without a declaration line """
 
@@ -483,6 +869,54 @@ class XMLTests(XMLTestCase):
                 f'Without declaration check failed for element_to_string for {data_type}'
             )
 
+    def test_element_to_bytes(self):
+        """
+        Tests element_to_bytes matches tostring for each encoding and method, with and without a declaration,
+        including the order of attributes, which tostring sorts before Python 3.8
+        """
+
+        self.assertEqual(element_to_bytes(None), b'')
+        self.assertEqual(list(iterencode_element(None)), [])
+
+        xml = (
+            '<root xmlns="urn:d" xmlns:p="urn:p" z="z" b="b"><p:x p:a="1&amp;&quot;">t<y>é—😀</y>u<z/>v<!-- c -->'
+            '<?pi x?></p:x></root>'
+        )
+        for include_namespaces in (False, True):
+            element = string_to_element(xml, include_namespaces)
+
+            for encoding in (DEFAULT_ENCODING, 'utf-16', 'us-ascii', 'latin-1'):
+                for method in ('xml', 'html', 'text'):
+                    expected = tostring(element, encoding, method)
+
+                    self.assertEqual(element_to_bytes(element, True, encoding, method), expected)
+                    self.assertEqual(
+                        element_to_string(element, True, encoding, method), expected.decode(encoding)
+                    )
+                    self.assertEqual(
+                        element_to_bytes(element, False, encoding, method).decode(encoding),
+                        strip_xml_declaration(expected.decode(encoding))
+                    )
+
+    def test_iterencode_element(self):
+        """ Tests iterencode_element generates chunks of about chunk_size, and serializes deep trees """
+
+        element = get_element(self.elem_data_str)
+        expected = element_to_bytes(element)
+
+        for chunk_size in (1, 16, 256, 1024 * 1024):
+            chunks = list(iterencode_element(element, chunk_size=chunk_size))
+
+            self.assertEqual(b''.join(chunks), expected)
+            self.assertTrue(all(len(chunk) >= chunk_size for chunk in chunks[:-1]))
+
+        # Ensure a byte order mark is written once, before the first chunk
+        chunks = list(iterencode_element(element, encoding='utf-16', chunk_size=16))
+        self.assertEqual(b''.join(chunks), tostring(element, 'utf-16'))
+
+        deep_xml = '<a>' + '<b>' * 2000 + 'c' + '</b>' * 2000 + '</a>'
+        self.assertEqual(element_to_string(deep_xml), deep_xml)
+
     def test_string_to_element(self):
         """ Tests element conversion from different data sources to XML, with and without a declaration line """
 
@@ -536,6 +970,99 @@ class XMLTests(XMLTestCase):
             with self.assertRaises(AssertionError):
                 self.assert_elements_are_equal(unstripped, stripped)
 
+    def test_string_to_element_namespaces(self):
+        """ Tests namespaces are stripped from parsed elements the same way they are stripped from text """
+
+        namespaced = (
+            u'<a:r xmlns:a="urn:a" xmlns="urn:x" xml:lang="en" a:b="bbb"><c>ccc</c><a:d a:e="eee"/></a:r>',
+            u'<a:r xml:lang="en" a:b="bbb"><c>ccc</c><a:d a:e="eee"/></a:r>'  # Undeclared prefixes
+        )
+        for xml in namespaced:
+            self.assert_elements_are_equal(string_to_element(xml), fromstring(strip_namespaces(xml)))
+            self.assertEqual(
+                element_to_object(xml),
+                ('r', {'r': {'c': 'ccc', 'd': {'e': 'eee'}, 'lang': 'en', 'b': 'bbb'}})
+            )
+
+        # Errors other than undeclared prefixes are still raised
+        with self.assertRaises(SyntaxError):
+            string_to_element(u'<a:r xmlns:a="urn:a"><a:b></a:r>')
+
+    def test_string_to_element_encoding(self):
+        """ Tests bytes are parsed and stripped without decoding them, in the encoding they declare """
+
+        declared = u'\n <?xml version="1.0" encoding="ISO-8859-1"?>\n<a:r xmlns:a="urn:a" a:b="é">café</a:r>'
+        latin_bytes = declared.encode('ISO-8859-1')
+
+        for xml in (latin_bytes, bytearray(latin_bytes), memoryview(latin_bytes), io.BytesIO(latin_bytes)):
+            element = string_to_element(xml)
+            self.assertEqual((element.tag, element.attrib, element.text), ('r', {'b': u'é'}, u'café'))
+
+        self.assertEqual(get_element(memoryview(latin_bytes)).text, u'café')
+        self.assertEqual(get_element(u'<a>café</a>'.encode('UTF-16')).text, u'café')
+
+        # Stripped bytes are left in the encoding they declare
+        stripped = u'<?xml version="1.0" encoding="ISO-8859-1"?>\n<r b="é">café</r>'
+        self.assertEqual(strip_namespaces(latin_bytes), stripped.encode('ISO-8859-1'))
+
+        stripped = u'<a:r xmlns:a="urn:a" a:b="é">café</a:r>'
+        self.assertEqual(strip_xml_declaration(memoryview(latin_bytes)), stripped.encode('ISO-8859-1'))
+
+    def test_string_to_element_cache(self):
+        """ Tests parsed elements are cached when enabled, and cached elements can not be changed by callers """
+
+        self.addCleanup(disable_parse_cache)
+        self.assertIsNone(get_parse_cache_info())
+
+        enable_parse_cache()
+        base_elem = fromstring(self.elem_data_str)
+
+        for _ in range(3):
+            self.assert_elements_are_equal(base_elem, get_element(self.elem_data_str))
+        self.assertEqual(get_element_text(self.elem_data_str, 'b'), 'bbb')
+
+        # Bytes are cached apart from strings, since only bytes are decoded as they declare
+        self.assert_elements_are_equal(base_elem, get_element(self.elem_data_bin))
+
+        info = get_parse_cache_info()
+        self.assertEqual((info.hits, info.misses, info.entries), (3, 2, 2))
+        self.assertEqual(info.size, len(self.elem_data_bin.strip()) + len(self.elem_data_bin.lstrip()))
+
+        # Changes to returned elements do not affect the cached element
+        remove_element(get_element(self.elem_data_str), 'b')
+        set_element_text(get_element(self.elem_data_str), element_text='changed')
+        self.assert_elements_are_equal(base_elem, get_element(self.elem_data_str))
+
+        # Namespaces are cached separately when they are kept
+        namespaced = self.namespace_str.decode(DEFAULT_ENCODING)
+        self.assert_elements_are_equal(string_to_element(namespaced), fromstring(strip_namespaces(namespaced)))
+        self.assert_elements_are_equal(string_to_element(namespaced, True), fromstring(namespaced))
+        self.assert_elements_are_equal(string_to_element(namespaced, True), fromstring(namespaced))
+        self.assertEqual(get_parse_cache_info().entries, 4)
+
+        # The least recently used are discarded beyond the limits
+        enable_parse_cache(max_entries=2)
+        for xml in ('<a/>', '<b/>', '<a/>', '<c/>', '<a/>', '<b/>'):
+            get_element(xml)
+        self.assertEqual(get_parse_cache_info()[:3], (2, 4, 2))
+
+        enable_parse_cache(max_size=len('<a>aaa</a>') * 2)
+        for xml in ('<a>aaa</a>', '<b>bbb</b>', '<c>ccc</c>', '<a>aaa</a>', '<abcdefghijklmnopqrstuvwxyz/>'):
+            get_element(xml)
+        self.assertEqual(get_parse_cache_info()[:4], (0, 5, 2, len('<a>aaa</a>') * 2))
+
+        clear_parse_cache()
+        self.assertEqual(get_parse_cache_info()[:4], (0, 0, 0, 0))
+
+        # Errors are raised and not cached
+        with self.assertRaises(SyntaxError):
+            get_element('<a><b></a>')
+        self.assertEqual(get_parse_cache_info()[:3], (0, 1, 0))
+
+        disable_parse_cache()
+        self.assertIsNone(get_parse_cache_info())
+        clear_parse_cache()
+
     def test_iter_elements(self):
         """ Tests iter_elements with a custom function on elements from different data sourcs """
 
@@ -591,11 +1118,238 @@ class XMLTests(XMLTestCase):
 
         self.assert_elements_are_equal(base_elem.find(self.elem_xpath), existing_elem)
 
+    def test_iterparse_paths(self):
+        """ Tests iterparse_paths generates the same elements as get_elements, for each path and data source """
+
+        self.assertEqual(list(iterparse_paths(None, 'c')), [], 'None check failed for iterparse_paths')
+        self.assertEqual(list(iterparse_paths(self.elem_data_file_path)), [], 'Empty check failed for iterparse_paths')
+
+        base_elem = fromstring(self.elem_data_str)
+        element_paths = (
+            'c', 'c/d', './c/g/h', 'c/g/h/i', '*/d', './/i', 'c//i', 'c/e[@t5]', "c/e[@t5='ttttt']", 'c/e[@t5="t"]'
+        )
+        for element_path in element_paths:
+            targeted = base_elem.findall(element_path)
+
+            for data in (self.elem_data_file_path, io.BytesIO(self.elem_data_bin), io.StringIO(self.elem_data_str)):
+                parsed = list(iterparse_paths(data, element_path))
+
+                self.assertEqual(len(parsed), len(targeted), f'Wrong number of elements parsed for {element_path}')
+                for idx, elem in enumerate(parsed):
+                    self.assert_elements_are_equal(elem, targeted[idx], element_path)
+
+        # Test multiple paths, including nested ones, are generated in document order
+        parsed = iterparse_paths(self.namespace_file_path, 'c/g', 'c/d', 'c/g/h/i')
+        self.assertEqual([elem.tag for elem in parsed], ['d', 'd', 'd', 'g', 'i', 'i', 'i', 'i'])
+
+        nested_xml = '<r><b>1<b>2<b>3</b></b></b><c><b>4</b></c><b>5</b></r>'
+        for element_path in ('.//b', 'b'):
+            parsed = iterparse_paths(io.StringIO(nested_xml), element_path)
+            targeted = get_elements(nested_xml, element_path)
+            self.assertEqual([elem.text for elem in parsed], [elem.text for elem in targeted])
+
+        parsed = iterparse_paths(io.StringIO(nested_xml), 'c/b', 'b', './/b')
+        self.assertEqual([elem.text for elem in parsed], ['1', '2', '3', '4', '5'])
+
+        parsed = iterparse_paths(self.namespace_file_path, 'c/e', include_namespaces=True)
+        self.assertEqual(list(parsed), [])
+        parsed = iterparse_paths(self.namespace_file_path, '{http://www.w3schools.com}c/*', include_namespaces=True)
+        self.assertEqual(len(list(parsed)), 7)
+
+        for element_path in ('/c', 'c/', 'c[1]', 'c[d]', '../c', 'c/./d'):
+            with self.assertRaises(SyntaxError):
+                list(iterparse_paths(self.elem_data_file_path, element_path))
+
+    def test_iterparse_handlers(self):
+        """ Tests iterparse_handlers applies each handler to the same elements as get_elements, in one pass """
+
+        self.assertEqual(iterparse_handlers(None, self.elem_data_file_path), {}, 'None check failed')
+        self.assertEqual(iterparse_handlers({'c': print}, None), {}, 'None check failed')
+        self.assertEqual(iterparse_handlers({'c': None}, self.elem_data_file_path), {}, 'Empty check failed')
+
+        base_elem = fromstring(self.elem_data_str)
+        element_paths = ('c', 'c/d', 'c/g/h/i', 'c/e[@t5]')
+
+        for data in (self.elem_data_file_path, io.BytesIO(self.elem_data_bin), io.StringIO(self.elem_data_str)):
+            handled = {element_path: [] for element_path in element_paths}
+            tags = []
+
+            def handle_element(elem, handled_elements):
+                handled_elements.append(element_to_string(elem))
+
+            element_handlers = {
+                element_path: lambda elem, path=element_path: handle_element(elem, handled[path])
+                for element_path in element_paths
+            }
+            element_handlers['c/d'] = [element_handlers['c/d'], lambda elem: tags.append(elem.tag)]
+            element_handlers['c/j'] = lambda elem: None
+
+            counts = iterparse_handlers(element_handlers, data)
+
+            self.assertEqual(counts, {'c': 1, 'c/d': 3, 'c/g/h/i': 4, 'c/e[@t5]': 1, 'c/j': 1})
+            self.assertEqual(tags, ['d', 'd', 'd'])
+
+            for element_path in element_paths:
+                self.assertEqual(
+                    handled[element_path],
+                    [element_to_string(elem) for elem in base_elem.findall(element_path)],
+                    f'Handled elements do not match for {element_path}'
+                )
+
+        # Test keyword arguments are passed on to each handler
+        def set_attributes(elem, **attrib_kwargs):
+            elem.attrib.update(attrib_kwargs)
+            self.assertEqual(elem.attrib['x'], 'xxx')
+
+        self.assertEqual(iterparse_handlers({'c/d': set_attributes}, self.elem_data_file_path, x='xxx'), {'c/d': 3})
+
+    def test_map_documents(self):
+        """ Tests map_documents applies a function to each file in worker processes, in and out of order """
+
+        self.assertEqual(list(map_documents(None, [self.elem_data_file_path])), [], 'None check failed')
+        self.assertEqual(list(map_documents(get_text_values, None)), [], 'None check failed')
+
+        file_paths = [self.elem_data_file_path, self.elem_ascii_file_path, self.namespace_file_path] * 3
+        file_paths.insert(4, os.path.join(self.data_dir, 'missing.xml'))
+
+        expected = [get_elements_text(get_remote_element(path), 'c/d') for path in file_paths if os.path.exists(path)]
+
+        for chunk_size in (1, 2, 4):
+            results = list(map_documents(get_text_values, file_paths, 2, chunk_size, element_path='c/d'))
+
+            self.assertEqual([result.source for result in results], file_paths)
+            self.assertEqual([result.result for result in results if result.error is None], expected)
+
+            self.assertIsInstance(results[4].error, IOError)
+            self.assertIsNone(results[4].result)
+
+            unordered = map_documents(get_text_values, file_paths, 2, chunk_size, ordered=False, element_path='c/d')
+            unordered = sorted(unordered, key=lambda result: file_paths.index(result.source) + (result.error is None))
+
+            self.assertEqual({result.source for result in unordered}, set(file_paths))
+            self.assertEqual(sum(1 for result in unordered if result.error), 1)
+
+    def test_map_documents_pending(self):
+        """ Tests map_documents only consumes as many files as can be in flight at once """
+
+        consumed = []
+
+        def file_paths():
+            for idx in range(20):
+                consumed.append(idx)
+                yield self.elem_data_file_path
+
+        with ThreadPoolExecutor(1) as executor:
+            results = map_documents(get_text_values, file_paths(), chunk_size=2, max_pending=2, executor=executor)
+
+            self.assertEqual(next(results).result, get_element_text(self.elem_data_str))
+            self.assertLessEqual(len(consumed), 6)
+
+            self.assertEqual(len(list(results)), 19)
+            self.assertEqual(len(consumed), 20)
+
+    def test_iterparse_many(self):
+        """ Tests iterparse_many applies a function to each element at the paths in each file, in worker processes """
+
+        self.assertEqual(list(iterparse_many(get_text_values, [self.elem_data_file_path], None)), [])
+
+        file_paths = [self.elem_data_file_path, self.namespace_file_path, self.elem_ascii_file_path]
+
+        for element_paths in ('c/d', ['c/d', 'c/g/h']):
+            element_paths = [element_paths] if isinstance(element_paths, str) else element_paths
+
+            expected = [
+                [get_element_text(elem) for elem in iterparse_paths(file_path, *element_paths)]
+                for file_path in file_paths
+            ]
+            results = list(iterparse_many(get_text_values, file_paths, element_paths, max_workers=2))
+
+            self.assertEqual([result.source for result in results], file_paths)
+            self.assertEqual([result.result for result in results], expected)
+            self.assertEqual([result.error for result in results], [None] * len(file_paths))
+
+        results = list(iterparse_many(get_text_values, [self.elem_data_file_path], 'c[1]', max_workers=1))
+        self.assertIsInstance(results[0].error, SyntaxError)
+
+    def test_iterparse_shards(self):
+        """ Tests iterparse_shards gives the same results as parsing each child of the root in sequence """
+
+        self.assertEqual(list(iterparse_shards(None, self.elem_data_file_path)), [])
+        self.assertEqual(list(iterparse_shards(element_to_dict, None)), [])
+
+        records = u''.join(
+            f'\n  <ns:record id="{idx}"><ns:value ns:type="int">{idx}</ns:value><!-- <ns:record/> --></ns:record>'
+            f'{"<![CDATA[<ns:record>]]>" if idx % 7 else ""}'
+            for idx in range(200)
+        )
+        with open(self.test_file_path, 'w', encoding=DEFAULT_ENCODING) as test:
+            test.write(f'<?xml version="1.0"?>\n<ns:records xmlns:ns="urn:records">text{records}\n</ns:records>\n')
+
+        for include_namespaces in (False, True):
+            expected = [
+                element_to_dict(record)
+                for record in iterparse_paths(self.test_file_path, '*', include_namespaces=include_namespaces)
+            ]
+            self.assertEqual(len(expected), 200)
+
+            for shard_size in (1, 500, 10 ** 6):
+                results = list(iterparse_shards(
+                    element_to_dict, self.test_file_path, shard_size, max_workers=2,
+                    include_namespaces=include_namespaces
+                ))
+                self.assertEqual(results, expected)
+
+            with ThreadPoolExecutor(2) as executor:
+                results = list(iterparse_shards(
+                    element_to_dict, self.test_file_path, 500, ordered=False, executor=executor,
+                    include_namespaces=include_namespaces
+                ))
+            self.assertEqual(sorted(results, key=str), sorted(expected, key=str))
+
+        for file_path in (self.elem_data_file_path, self.namespace_file_path):
+            expected = [get_element_text(record) for record in iterparse_paths(file_path, '*')]
+            self.assertEqual(list(iterparse_shards(get_text_values, file_path, 64, max_workers=2)), expected)
+
+        # Compressed files are parsed in sequence, since they can not be split at byte offsets
+        with open(self.test_file_path, 'rb') as test:
+            content = test.read()
+
+        for compression, compress in (('gz', gzip.compress), ('bz2', bz2.compress), ('xz', lzma.compress)):
+            compressed_path = f'{self.test_file_path}.{compression}'
+            self.addCleanup(os.remove, compressed_path)
+
+            with open(compressed_path, 'wb') as compressed:
+                compressed.write(compress(content))
+
+            results = list(iterparse_shards(element_to_dict, compressed_path, 500, max_workers=2))
+            self.assertEqual(results, [element_to_dict(record) for record in iterparse_paths(self.test_file_path, '*')])
+
+        with open(self.test_file_path, 'w') as test:
+            test.write('<records/>')
+        self.assertEqual(list(iterparse_shards(element_to_dict, self.test_file_path, max_workers=1)), [])
+
+        with open(self.test_file_path, 'w') as test:
+            test.write('<records><record>1</record><record>2</records>')
+        with self.assertRaises(ParseError):
+            list(iterparse_shards(element_to_dict, self.test_file_path, max_workers=1))
+
+    def test_iterparse_paths_memory(self):
+        """ Tests iterparse_paths does not keep elements that have already been generated """
+
+        records = u''.join(f'<record id="{idx}"><value>{idx}</value></record>' for idx in range(1000))
+        generated = []
+
+        for record in iterparse_paths(io.StringIO(f'<records>{records}</records>'), 'record'):
+            generated.append(weakref.ref(record))
+            self.assertLessEqual(sum(1 for ref in generated if ref() is not None), 2)
+
+        self.assertEqual(len(generated), 1000)
+
     def test_strip_namespaces(self):
         """ Tests namespace stripping by comparing equivalent XML from different data sources """
 
         self.assertEqual(strip_namespaces(None), None, 'None check failed for strip_namespaces')
-        self.assertEqual(strip_namespaces(b''), u'', 'Bin check failed for strip_namespaces')
+        self.assertEqual(strip_namespaces(b''), b'', 'Bin check failed for strip_namespaces')
         self.assertEqual(strip_namespaces(''), u'', 'Str check failed for strip_namespaces')
         self.assertEqual(strip_namespaces(io.StringIO('')), u'', 'IO check failed for strip_namespaces')
         self.assertEqual(strip_namespaces([]), [], 'List check failed for strip_namespaces')
@@ -625,11 +1379,116 @@ class XMLTests(XMLTestCase):
         for data in self.elem_data_inputs:
             self.assert_elements_are_equal(get_element(data), stripped)
 
+    def test_strip_namespaces_markup(self):
+        """ Tests namespace stripping leaves non-tag markup, and namespace-like text, untouched """
+
+        declarations = ' '.join(f'xmlns:ns{i}="urn:ns{i}"' for i in range(100))
+        self.assertEqual(
+            strip_namespaces(f'<ns0:a {declarations} xmlns="urn:a" ns1:b="1"><ns1:c ns2:d = \'x>y\'/></ns0:a>'),
+            u'<a b="1"><c d = \'x>y\'/></a>'
+        )
+
+        untouched = (
+            u'<!-- <a:b xmlns:a="urn:a" /> -->',
+            u'<![CDATA[<a:b c:d="e" />]]>',
+            u'<?a:b c:d="e"?>',
+            u'<!DOCTYPE a [<!ENTITY b "<c:d/>">]>',
+            u'a:b c:d="e"'
+        )
+        for markup in untouched:
+            self.assertEqual(strip_namespaces(f'<a>{markup}</a>'), f'<a>{markup}</a>')
+            self.assertEqual(strip_namespaces(f'<a>{markup}</a>'.encode()), f'<a>{markup}</a>'.encode())
+
+        # Malformed markup is left as is for the parser to report
+        self.assertEqual(strip_namespaces(u'<a:b c:d="e <f:g/>'), u'<a:b c:d="e <g/>')
+        self.assertEqual(strip_namespaces(u'<a:b><!-- c:d'), u'<b><!-- c:d')
+
+    def test_strip_namespaces_linear(self):
+        """ Tests namespace stripping scans each character of the content a bounded number of times """
+
+        class ScannedContent(str):
+            """ Counts the characters searched by find and rfind """
+
+            scanned = 0
+
+            def find(self, sub, start=0, end=None):
+                found = super(ScannedContent, self).find(sub, start, end)
+                self.scanned += (len(self) if found < 0 else found) - start
+                return found
+
+            def rfind(self, sub, start=0, end=None):
+                end = len(self) if end is None else end
+                found = super(ScannedContent, self).rfind(sub, start, end)
+                self.scanned += end - (start if found < 0 else found)
+                return found
+
+        for count in (100, 1000, 5000):
+            special_heavy = (
+                '<a>' + '<?p?>' * count + '<x:b xmlns:x="u"/></a>',
+                '<a>' + '<!-- c -->' * count + '<x:b xmlns:x="u"/></a>',
+                '<a>' + '<?p?>' * count + 'z' * count + 'x:y</a>',
+                '<a>' + '<c/>' * count + '<!-- c --><x:b xmlns:x="u"/></a>',
+            )
+            for xml in special_heavy:
+                content = ScannedContent(xml)
+                self.assertEqual(_strip_xml_namespaces(content)[0], xml.replace('x:b xmlns:x="u"', 'b'))
+                self.assertLessEqual(content.scanned, len(content) * 4, f'Content rescanned for {count} markups')
+
+    def test_iterstrip_xml(self):
+        """ Tests streamed namespace and declaration stripping against the same done in memory, by chunk size """
+
+        with open(self.namespace_file_path, 'rb') as data:
+            namespaced = (_EMPTY_XML_1 + u'<!-- <a:b/> --><![CDATA[<c:d/>]]>').encode() + data.read()
+
+        for chunk_size in (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, len(namespaced)):
+            # Streamed content is not trimmed of whitespace like content in memory
+
+            with_dec = b''.join(iterstrip_xml(io.BytesIO(namespaced), chunk_size=chunk_size))
+            self.assertEqual(with_dec.strip(), strip_namespaces(namespaced))
+
+            wout_dec = b''.join(iterstrip_xml(io.BytesIO(namespaced), include_declaration=False, chunk_size=chunk_size))
+            self.assertEqual(wout_dec.strip(), strip_xml_declaration(strip_namespaces(namespaced)))
+
+            kept = b''.join(iterstrip_xml(io.BytesIO(namespaced), include_namespaces=True, chunk_size=chunk_size))
+            self.assertEqual(kept, namespaced)
+
+        # Ensure text files produce text, and paths produce bytes
+        as_text = io.StringIO(namespaced.decode())
+        self.assertEqual(u''.join(iterstrip_xml(as_text, chunk_size=7)).strip(), strip_namespaces(as_text.getvalue()))
+        self.assertEqual(
+            b''.join(iterstrip_xml(self.namespace_file_path, chunk_size=7)).strip(),
+            strip_namespaces(self.namespace_str)
+        )
+        self.assertEqual(b''.join(iterstrip_xml(io.BytesIO(b''))), b'')
+
+    def test_write_stripped_xml(self):
+        """ Tests streamed stripping to a file path, file object and from the command line """
+
+        stripped = fromstring(strip_namespaces(self.namespace_str))
+
+        write_stripped_xml(self.namespace_file_path, self.test_file_path, chunk_size=16)
+        self.assert_elements_are_equal(get_remote_element(self.test_file_path), stripped)
+
+        with open(self.test_file_path, 'wb') as test:
+            write_stripped_xml(io.BytesIO(self.namespace_str), test, include_declaration=False)
+        self.assert_elements_are_equal(get_remote_element(self.test_file_path), stripped)
+
+        # Text content is encoded before it is written to a path
+        write_stripped_xml(io.StringIO(self.namespace_str.decode()), self.test_file_path)
+        self.assert_elements_are_equal(get_remote_element(self.test_file_path), stripped)
+
+        main(['strip', self.namespace_file_path, self.test_file_path, '--strip-declaration', '--chunk-size', '8'])
+        self.assert_elements_are_equal(get_remote_element(self.test_file_path), stripped)
+
+        main(['strip', self.namespace_file_path, self.test_file_path, '--keep-namespaces'])
+        with open(self.test_file_path, 'rb') as test:
+            self.assertEqual(test.read(), self.namespace_str)
+
     def test_strip_xml_declaration(self):
         """ Tests namespace stripping by comparing equivalent XML from different data sources """
 
         self.assertEqual(strip_xml_declaration(None), None, 'None check failed for strip_xml_declaration')
-        self.assertEqual(strip_xml_declaration(b''), u'', 'Bin check failed for strip_xml_declaration')
+        self.assertEqual(strip_xml_declaration(b''), b'', 'Bin check failed for strip_xml_declaration')
         self.assertEqual(strip_xml_declaration(''), u'', 'Str check failed for strip_xml_declaration')
         self.assertEqual(strip_xml_declaration(io.StringIO('')), u'', 'IO check failed for strip_xml_declaration')
         self.assertEqual(strip_xml_declaration([]), [], 'List check failed for strip_xml_declaration')
@@ -639,7 +1498,14 @@ class XMLTests(XMLTestCase):
         test_binary = test_unicode.encode(DEFAULT_ENCODING)
 
         self.assertEqual(strip_xml_declaration(test_unicode), target, 'Unicode check failed for strip_xml_declaration')
-        self.assertEqual(strip_xml_declaration(test_binary), target, 'Binary check failed for strip_xml_declaration')
+        self.assertEqual(
+            strip_xml_declaration(test_binary), target.encode(DEFAULT_ENCODING),
+            'Binary check failed for strip_xml_declaration'
+        )
+
+        # Ensure later processing instructions are not mistaken for the end of the declaration
+        target = u'<root><?pi instruction?></root>'
+        self.assertEqual(strip_xml_declaration(_EMPTY_XML_1 + target), target, 'PI check failed')
 
     def test_write_element_to_path(self):
         """ Tests writing an element to a file path, reading it in, and testing the content for equality """
@@ -669,6 +1535,97 @@ class XMLTests(XMLTestCase):
                 self.assert_elements_are_equal(get_element(test), fromstring(self.elem_data_str))
 
 
+    def test_write_element_compressed(self):
+        """ Tests writing an element compressed by the extension of the path, or by the compression argument """
+
+        base_elem = fromstring(self.elem_data_str)
+        openers = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+        for extension, compression in (('.gz', 'gzip'), ('.bz2', 'bz2'), ('.xz', 'xz')):
+            file_path = self.test_file_path + extension
+            self.addCleanup(lambda path: os.path.exists(path) and os.remove(path), file_path)
+
+            self.assertTrue(write_element(self.elem_data_str, file_path))
+            with openers[compression](file_path, 'rb') as test:
+                self.assert_elements_are_equal(get_element(test.read()), base_elem)
+
+            self.assertTrue(write_element(self.elem_data_str, self.test_file_path, compression=compression))
+            with openers[compression](self.test_file_path, 'rb') as test:
+                self.assert_elements_are_equal(get_element(test.read()), base_elem)
+
+            out_file = io.BytesIO()
+            write_element(self.elem_data_str, out_file, compression=compression)
+            with openers[compression](io.BytesIO(out_file.getvalue()), 'rb') as test:
+                self.assert_elements_are_equal(get_element(test.read()), base_elem)
+
+        with self.assertRaises(ValueError):
+            write_element(self.elem_data_str, self.test_file_path, compression='zip')
+
+    def test_write_element_atomic(self):
+        """ Tests writing an element atomically replaces the file, and leaves it alone if writing fails """
+
+        write_element('<a>old</a>', self.test_file_path)
+        self.assertTrue(write_element('<a>new</a>', self.test_file_path, atomic=True, buffer_size=4))
+
+        with open(self.test_file_path, 'rb') as test:
+            self.assertEqual(get_element_text(test), 'new')
+
+        # The permissions of the file replaced are kept
+        os.chmod(self.test_file_path, 0o600)
+        self.assertTrue(write_element('<a>new</a>', self.test_file_path, atomic=True))
+        self.assertEqual(os.stat(self.test_file_path).st_mode & 0o777, 0o600)
+
+        with mock.patch('parserutils.elements._iter_serialized_xml', side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                write_element('<a>newer</a>', self.test_file_path, atomic=True)
+
+        with open(self.test_file_path, 'rb') as test:
+            self.assertEqual(get_element_text(test), 'new')
+
+        self.assertEqual(
+            [name for name in os.listdir(self.data_dir) if name.startswith('.test_data.xml')], [],
+            'Temporary files were left behind'
+        )
+
+    def test_write_element_unchanged(self):
+        """ Tests writing an element with skip_unchanged only writes files with different content """
+
+        for file_path in (self.test_file_path, self.test_file_path + '.gz'):
+            self.addCleanup(lambda path: os.path.exists(path) and os.remove(path), file_path)
+
+            self.assertTrue(write_element(self.elem_data_str, file_path, skip_unchanged=True))
+            with open(file_path, 'rb') as test:
+                written = test.read()
+
+            self.assertFalse(write_element(self.elem_data_str, file_path, skip_unchanged=True))
+            self.assertFalse(write_element(self.elem_data_str, file_path, atomic=True, skip_unchanged=True))
+            self.assertTrue(write_element(self.elem_data_str, file_path))
+
+            with open(file_path, 'rb') as test:
+                self.assertEqual(test.read(), written, 'Content written twice is not the same')
+
+            self.assertTrue(write_element('<a>changed</a>', file_path, skip_unchanged=True))
+            with open(file_path, 'wb') as test:
+                test.write(b'not xml')
+            self.assertTrue(write_element('<a>changed</a>', file_path, skip_unchanged=True))
+
+        # Archives with a valid header but a corrupt body are replaced as well
+        corrupt_archives = {
+            '.gz': b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03garbage',
+            '.bz2': b'BZh91AY&SYgarbage',
+            '.xz': b'\xfd7zXZ\x00garbage',
+        }
+        for extension, corrupt_archive in corrupt_archives.items():
+            file_path = self.test_file_path + extension
+            self.addCleanup(lambda path: os.path.exists(path) and os.remove(path), file_path)
+
+            with open(file_path, 'wb') as test:
+                test.write(corrupt_archive)
+
+            self.assertTrue(write_element(self.elem_data_str, file_path, skip_unchanged=True))
+            self.assertFalse(write_element(self.elem_data_str, file_path, skip_unchanged=True))
+
+
 class XMLPropertyTests(XMLTestCase):
 
     def assert_element_values_equal(self, prop, value1, value2):
@@ -902,6 +1859,35 @@ class XMLPropertyTests(XMLTestCase):
             self.elem_xpath, default_target=[], element_path=self.elem_xpath
         )
 
+    def test_iter_elements_properties(self):
+        """ Tests the iter_elements functions generate the values of the get_elements functions, up to a limit """
+
+        xml = '<a><b x="1">one</b>t1<b> </b><b x="">three</b>t3<b x="4">four</b><c>cc</c></a>'
+
+        for iter_func, get_func, kwargs in (
+            (iter_elements_text, get_elements_text, {}),
+            (iter_elements_tail, get_elements_tail, {}),
+            (iter_elements_attributes, get_elements_attributes, {}),
+            (iter_elements_attributes, get_elements_attributes, {'attrib_name': 'x'}),
+        ):
+            self.assertEqual(list(iter_func(None, 'b', **kwargs)), [])
+
+            for element_path in (None, 'b', 'b[@x]', 'x'):
+                expected = get_func(xml, element_path, **kwargs)
+                self.assertEqual(list(iter_func(xml, element_path, **kwargs)), expected)
+
+                for limit in (0, 1, 2, 10):
+                    self.assertEqual(list(iter_func(xml, element_path, limit=limit, **kwargs)), expected[:limit])
+
+        self.assertEqual(list(iter_elements_text(xml, 'b')), ['one', 'three', 'four'])
+        self.assertEqual(list(iter_elements_attributes(xml, 'b', 'x', limit=2)), ['1', ''])
+
+        # Ensure values are generated rather than collected in a list
+        texts = iter_elements_text(xml, 'b')
+
+        self.assertNotIsInstance(texts, list)
+        self.assertEqual(next(texts), 'one')
+
     def test_get_elements_tail_xpath(self):
         """
         Tests get_elements_tail with an XPATH with null and empty elements; also
@@ -1035,6 +2021,82 @@ class XMLPropertyTests(XMLTestCase):
             ELEM_TAIL, set_elements_tail, default=[], target=target, element_path=elem_xpath, tail_values=target
         )
 
+    def test_apply_updates(self):
+        """ Tests apply_updates assigns text, tail and attributes at many paths, inserting missing elements once """
+
+        self.assertEqual(apply_updates(None, {'a': 'x'}), {})
+        self.assertEqual(apply_updates('<a/>', {}), {})
+
+        element = get_element('<a><b><c>ccc</c></b><b/></a>')
+        updated = apply_updates(element, {
+            'b/c': 'x',
+            'b/d': ['1', '2', {ELEM_TEXT: '3', ELEM_TAIL: 't', 'attributes': {'k': 'v'}}],
+            'b/d/@n': ['p', 'q'],
+            'b/d/e': None,
+            'f/g/h': 'h',
+            'f/g/@z': 'z',
+            '@r': 'r',
+            './/c': {ELEM_TAIL: 'c'},
+            'b/c[@q]': 'not inserted',
+            '': 'ignored',
+        })
+        self.assertEqual(
+            element_to_string(element, include_declaration=False),
+            (
+                '<a r="r"><f><g z="z"><h>h</h></g></f>'
+                '<b><d n="p">1<e /></d><d n="q">2</d><d k="v">3</d>t<c>x</c>c</b><b /></a>'
+            )
+        )
+        self.assertEqual({path: [elem.tag for elem in elems] for path, elems in updated.items()}, {
+            'b/c': ['c'], 'b/d': ['d', 'd', 'd'], 'b/d/@n': ['d', 'd'], 'b/d/e': ['e'], 'f/g/h': ['h'],
+            'f/g/@z': ['g'], '@r': ['a'], './/c': ['c'], 'b/c[@q]': [], '': []
+        })
+
+        # Ensure values are assigned in turn to each element, with extra elements inserted as set_elements_text does
+        for data in self.elem_data_inputs:
+            element = get_element(element_to_string(get_element(data)))
+            expected = get_element(element_to_string(element))
+            elem_xpath = self.elem_xpath
+
+            apply_updates(element, [(elem_xpath, ['x', 'y', 'z']), (elem_xpath, [{ELEM_TAIL: 't'}])])
+            set_elements_text(expected, elem_xpath, ['x', 'y', 'z'])
+            set_elements_tail(expected, elem_xpath, ['t'])
+
+            self.assertEqual(element_to_string(element), element_to_string(expected))
+            self.assertEqual(sorted(get_elements_text(element, elem_xpath)), ['x', 'y', 'z'])
+
+    def test_apply_updates_repeated(self):
+        """ Tests apply_updates updates the same elements as set_elements_text, below repeated siblings """
+
+        trees = (
+            '<r><a/><a><b>old</b></a></r>',
+            '<r><a><b>1</b><b>2</b></a><a><b>3</b></a><c/><a/></r>',
+            '<r><a><b><c/></b></a><a><b><c>c</c><c/></b><b/></a></r>',
+            '<r/>',
+        )
+        update_lists = (
+            [('a/b', 'new')],
+            [('a/b', ['x', 'y', 'z', 'w']), ('a', ['p', 'q'])],
+            [('a/b/c', ['1', '2', '3', '4', '5']), ('a/b', ['x']), ('a/b/c', ['6'])],
+            [('a', ['1', '2', '3']), ('a/b', ['4', '5']), ('c/d', ['6', '7'])],
+        )
+
+        for xml in trees:
+            for updates in update_lists:
+                element = get_element(xml)
+                expected = get_element(xml)
+
+                apply_updates(element, updates)
+                for element_path, values in updates:
+                    set_elements_text(expected, element_path, values)
+
+                self.assertEqual(element_to_string(element), element_to_string(expected), (xml, updates))
+
+        # Ensure existing elements below later siblings are updated, rather than inserted below the first
+        element = get_element(trees[0])
+        self.assertEqual([elem.text for elem in apply_updates(element, {'a/b': 'new'})['a/b']], ['new'])
+        self.assertEqual(element_to_string(element, include_declaration=False), '<r><a /><a><b>new</b></a></r>')
+
 
 class XMLCheckTests(XMLTestCase):
 
@@ -1103,6 +2165,75 @@ class XMLCheckTests(XMLTestCase):
         """ Tests elements_exist at only some of several XPATH locations with different element data """
         self.assert_elements_exist('test_elements_exist_not_all_xpaths', ('a', 'b', 'c'), True, False)
 
+    def test_elements_exist_all_nested_xpaths(self):
+        """ Tests elements_exist at all of several nested XPATH locations, including some it can not split """
+
+        base_elem = get_element(self.elem_data_str)
+
+        self.assertTrue(elements_exist(base_elem, ('c/d', 'c/g/h/i', './/i', 'c/e/..', 'c//h[2]/i'), True))
+        self.assertFalse(elements_exist(base_elem, ('c/d', 'c/g/h/i', 'c/g/i'), True))
+        self.assertFalse(elements_exist(base_elem, ('c/d', 'c/g/h/i', 'c/d/..[@x]'), True))
+
+    def test_query_many(self):
+        """ Tests query_many gives the same values as querying each element path separately """
+
+        self.assertEqual(query_many(None, {'a': 'a'}), {'a': []})
+        self.assertEqual(query_many(self.elem_data_str, None), {})
+
+        element_paths = {
+            'root_text': '',
+            'root_tail': ('', 'tail'),
+            'root_attr': '@t1',
+            'b': 'b',
+            'c_text': 'c',
+            'c_tail': ('c', 'tail'),
+            'c_attrs': ('./c', 'attributes'),
+            'c_attr': ('c', '@t4'),
+            'd': 'c/d',
+            'e_tail': ('c/e', 'tail'),
+            'e_attr': 'c/e/@t5',
+            'h': ('c/g/h', 'element'),
+            'i': ('c/g/h/i', 'element'),
+            'i_desc': ('.//i', 'element'),
+            'i_desc_mid': ('c//h/i', 'element'),
+            'h_pos': ('c/g/h[2]', 'element'),
+            'h_last': ('c/g/*[last()]', 'element'),
+            'd_text': "c[d='dd']/d",
+            'e_pred': ('c/*[@t5="ttttt"]', 'element'),
+            'j': 'c/./j',
+            'parent': ('c/g/..', 'element'),
+            'missing': 'c/x/y',
+        }
+
+        for data in (self.elem_data_str, self.namespace_str, self.elem_ascii_str):
+            base_elem = get_element(data)
+            results = query_many(base_elem, element_paths)
+
+            self.assertEqual(set(results), set(element_paths))
+
+            self.assertEqual(results['root_text'], get_elements_text(base_elem))
+            self.assertEqual(results['root_tail'], get_elements_tail(base_elem))
+            self.assertEqual(results['root_attr'], get_elements_attributes(base_elem, attrib_name='t1'))
+            self.assertEqual(results['b'], get_elements_text(base_elem, 'b'))
+            self.assertEqual(results['c_text'], get_elements_text(base_elem, 'c'))
+            self.assertEqual(results['c_tail'], get_elements_tail(base_elem, 'c'))
+            self.assertEqual(results['c_attrs'], get_elements_attributes(base_elem, 'c'))
+            self.assertEqual(results['c_attr'], get_elements_attributes(base_elem, 'c', 't4'))
+            self.assertEqual(results['d'], get_elements_text(base_elem, 'c/d'))
+            self.assertEqual(results['e_tail'], get_elements_tail(base_elem, 'c/e'))
+            self.assertEqual(results['e_attr'], get_elements_attributes(base_elem, 'c/e', 't5'))
+            self.assertEqual(results['d_text'], get_elements_text(base_elem, "c[d='dd']/d"))
+            self.assertEqual(results['j'], get_elements_text(base_elem, 'c/j'))
+            self.assertEqual(results['missing'], [])
+
+            for key in ('h', 'i', 'i_desc', 'i_desc_mid', 'h_pos', 'h_last', 'e_pred', 'parent'):
+                element_path = element_paths[key][0]
+                self.assertEqual(results[key], base_elem.findall(element_path), f'Query failed for {element_path}')
+
+        for invalid in ('/c', ('c', 'x'), ('c', '@')):
+            with self.assertRaises((SyntaxError, ValueError)):
+                query_many(self.elem_data_str, {'invalid': invalid})
+
     def test_element_is_empty(self):
         """ Tests element_is_empty with empty and non-empty values, and different data sources """
 
@@ -1289,6 +2420,79 @@ class XMLInsertRemoveTests(XMLTestCase):
         elem_xpaths = ('c/d', 'c/e', 'c/f', 'c/g/h/i')
         self.assert_elements_removed('test_remove_elements_multiple_clear', elem_xpaths, clear_empty=True)
 
+    def test_remove_elements_bulk(self):
+        """ Tests remove_elements removes the same elements in the same order as the original remove_element """
+
+        xml = (
+            '<a><b><c id="1"><d/><d x="y"/></c><c id="2"><d/><e>e</e></c></b>'
+            '<b><c id="3"><d/></c><f/></b><g><h><i/></h><h>h</h></g><g/></a>'
+        )
+        path_lists = (
+            ('b/c/d', 'b/c', 'g/h/i'),
+            ('b/c/d', 'b/c[@id="2"]', 'b/c/e', 'b/*/d[@x]'),
+            ('b', 'b/c/d', 'g/h', 'x/y', 'g'),
+            ('b/c/d[1]', 'b/c/d', 'b/c/*', 'g/h/i', 'g/h[1]'),
+            ('b/c/d', 'b/f', 'g/h/i', 'g/h', 'b/c'),
+        )
+
+        # Random trees and paths, mostly of empty elements so that parents are emptied as their children are removed
+
+        rand = random.Random(1505)
+        tags = ('b', 'c', 'd')
+
+        def random_xml(depth):
+            if depth == 0 or rand.random() < 0.2:
+                return rand.choice(('', '', 'x', '<e/>'))
+            children = rand.choices(tags, k=rand.randint(1, 3))
+            return ''.join(f'<{tag}>{random_xml(depth - 1)}</{tag}>' for tag in children)
+
+        def random_path():
+            steps = rand.choices(tags + ('*', 'c[@x]'), weights=(3, 3, 3, 1, 1), k=rand.randint(1, 4))
+            return '/'.join(steps)
+
+        random_cases = [
+            (f'<a>{random_xml(4)}</a>', [random_path() for _ in range(rand.randint(1, 4))]) for _ in range(300)
+        ]
+
+        for case_xml, elem_xpaths in [(xml, paths) for paths in path_lists] + random_cases:
+            for clear_empty in (False, True):
+                bulk = get_element(case_xml)
+                bulk_positions = {elem: idx for idx, elem in enumerate(bulk.iter())}
+                bulk_removed = remove_elements(bulk, elem_xpaths, clear_empty)
+
+                each = get_element(case_xml)
+                each_positions = {elem: idx for idx, elem in enumerate(each.iter())}
+                each_removed = []
+                for xpath in elem_xpaths:
+                    rem = remove_element_sequentially(each, xpath, clear_empty)
+                    each_removed.extend(rem if isinstance(rem, list) else [rem])
+
+                # Removed elements are compared by their position in the original document
+
+                self.assertEqual(element_to_string(bulk), element_to_string(each), (case_xml, elem_xpaths))
+                self.assertEqual(
+                    [None if rem is None else bulk_positions[rem] for rem in bulk_removed],
+                    [None if rem is None else each_positions[rem] for rem in each_removed],
+                    (case_xml, elem_xpaths, clear_empty)
+                )
+
+                # Single paths are removed in bulk by remove_element too
+
+                if len(elem_xpaths) == 1:
+                    single = get_element(case_xml)
+                    single_positions = {elem: idx for idx, elem in enumerate(single.iter())}
+                    single_removed = remove_element(single, elem_xpaths[0], clear_empty)
+                    single_removed = single_removed if isinstance(single_removed, list) else [single_removed]
+
+                    self.assertEqual(
+                        [None if rem is None else single_positions[rem] for rem in single_removed],
+                        [None if rem is None else each_positions[rem] for rem in each_removed]
+                    )
+
+        # Ensure elements below an element removed by an earlier path are not removed again
+        removed = remove_elements(xml, ('b/c', 'b/c/d'))
+        self.assertEqual([rem if rem is None else rem.tag for rem in removed], ['c', 'c', 'c', None])
+
     def test_remove_empty_element(self):
 
         # Ensure nothing is done when there are no children
@@ -1355,3 +2559,257 @@ class XMLInsertRemoveTests(XMLTestCase):
         nested_child = remove_empty_element(parent_to_parse='<a><b><c/><d/><d/><d/></b></a>', element_path='b/d')
         self.assertEqual(len(nested_child), 3)
         self.assertEqual(u''.join(d.tag for d in nested_child), 'd' * 3)
+
+    def test_prune_empty(self):
+        """ Tests prune_empty removes every empty element in one pass, or only those at and below each path """
+
+        self.assertEqual(prune_empty(None), [])
+        self.assertEqual(prune_empty('<a/>'), [])
+        self.assertEqual(prune_empty('<a><b x="xxx"/><c>ccc</c><d/>ddd</a>'), [])
+
+        # Ensure whitespace is ignored, and elements emptied by pruning are also removed
+        element = get_element('<a><b> <c/> <d><e>\n</e></d></b><f><g/>ggg</f><h x=""/></a>')
+        removed = prune_empty(element)
+
+        self.assertEqual([elem.tag for elem in removed], ['e', 'c', 'd', 'b'])
+        self.assertEqual(element_to_string(element, include_declaration=False), '<a><f><g />ggg</f><h x="" /></a>')
+        self.assertTrue(all(element_is_empty(elem) for elem in removed))
+
+        # Ensure the same elements are removed as by remove_empty_element, without removing the root
+        xml = '<a><b><c><d/></c></b></a>'
+        self.assertEqual([elem.tag for elem in prune_empty(xml)], ['d', 'c', 'b'])
+        self.assertEqual({elem.tag for elem in remove_empty_element(xml, 'b/c/d')}, {'b', 'c', 'd'})
+
+        # Ensure only elements at and below the paths are pruned
+        element = get_element('<a><b><c/><d><e/></d></b><b>bbb</b><f><g/></f><h/></a>')
+        removed = prune_empty(element, 'b')
+
+        self.assertEqual([elem.tag for elem in removed], ['e', 'c', 'd', 'b'])
+        self.assertEqual(
+            element_to_string(element, include_declaration=False), '<a><b>bbb</b><f><g /></f><h /></a>'
+        )
+
+        element = get_element('<a><b><c/><d><e/></d></b><f><g/></f><h/></a>')
+        removed = prune_empty(element, ['b/d', 'b', 'x', '', 'f/g', '.'])
+
+        self.assertEqual([elem.tag for elem in removed], ['e', 'd', 'c', 'b', 'g', 'f', 'h'])
+        self.assertEqual(element_to_string(element, include_declaration=False), '<a />')
+
+        # Ensure deep documents are pruned without recursion
+        element = get_element('<a>' + '<b>' * 2000 + '</b>' * 2000 + '</a>')
+        self.assertEqual(len(prune_empty(element)), 2000)
+        self.assertEqual(len(element), 0)
+
+    def assert_index_is_current(self, index, element_paths):
+        """ Ensures the index finds the same elements as ElementPath for each of the element paths """
+
+        for element_path in element_paths:
+            expected = index.root.findall(element_path)
+
+            self.assertEqual(index.get_elements(element_path), expected, f'Index is stale for {element_path}')
+            self.assertIs(index.get_element(element_path), expected[0] if expected else None)
+
+    def test_element_index(self):
+        """ Tests an element index finds elements at each path as they are inserted, removed and copied """
+
+        index = ElementIndex(None)
+        self.assertIsNone(index.get_element('a'))
+        self.assertEqual(index.get_elements('a'), [])
+
+        base_elem = fromstring(self.elem_data_str)
+        index = ElementIndex(base_elem)
+        element_paths = (
+            'b', 'c', 'c/d', './c/d', 'c/e', 'c/g', 'c/g/h', 'c/g/h/i', 'c/x', 'c/x/y', 'c/x/y/z', 'x', 'x/y',
+            '*', 'c/*', './/i', 'c/d[2]', 'c/g/h/..'
+        )
+
+        self.assertIs(index.get_element(), base_elem)
+        self.assertEqual(index.get_elements(''), [])
+        self.assert_index_is_current(index, element_paths)
+
+        insert_element(base_elem, 0, 'c/x/y/z', 'zzz')
+        insert_element(base_elem, 1, 'c/d', 'dd')
+        insert_element(get_element(base_elem, 'c/g'), 0, 'h/i')
+        self.assert_index_is_current(index, element_paths)
+
+        set_elements_text(base_elem, 'x/y', ['y1', 'y2'])
+        self.assert_index_is_current(index, element_paths)
+
+        remove_element(base_elem, 'c/d')
+        remove_element(get_element(base_elem, 'c/g'), 'h/i', clear_empty=True)
+        self.assert_index_is_current(index, element_paths)
+
+        remove_empty_element(base_elem, 'c/e')
+        remove_empty_element(base_elem, 'c/x/y/z')
+        self.assert_index_is_current(index, element_paths)
+
+        copy_element(fromstring('<x><y><z/></y></x>'), get_element(base_elem, 'c/f'))
+        copy_element(fromstring('<a><b><d/></b></a>'), base_elem, 'c/g/h')
+        self.assert_index_is_current(index, element_paths)
+
+        clear_children(base_elem, 'c/g')
+        clear_element(base_elem, 'c/x')
+        self.assert_index_is_current(index, element_paths)
+
+        # Changes made by other means are found once they are reported, since get_elements uses the index
+
+        indexed = index.get_elements('c/x')
+        get_element(base_elem, 'c').append(Element('x'))
+
+        self.assertEqual(index.get_elements('c/x'), indexed)
+        self.assertEqual(get_elements(base_elem, 'c/x'), indexed)
+        self.assertEqual(len(get_elements(base_elem, 'c/x[1]/../x')), len(indexed) + 1)
+
+        index.invalidate(get_element(base_elem, 'c'))
+        self.assert_index_is_current(index, element_paths)
+
+        base_elem.remove(get_element(base_elem, 'c'))
+        index.invalidate()
+        self.assert_index_is_current(index, element_paths)
+
+        # Once the index is no longer referenced, it is no longer used
+
+        index_ref = weakref.ref(index)
+        del index
+
+        self.assertIsNone(index_ref())
+        self.assertEqual(get_element(base_elem, 'b').tag, 'b')
+
+    def test_element_index_comments(self):
+        """ Tests comments and processing instructions are left out of an element index as they are changed """
+
+        base_elem = fromstring(self.elem_data_str)
+        get_element(base_elem, 'c').insert(0, Comment('comment'))
+        base_elem.append(ProcessingInstruction('pi', 'instruction'))
+
+        index = ElementIndex(base_elem)
+        element_paths = ('b', 'c', 'c/d', 'c/g/h', '*', 'c/*')
+        self.assert_index_is_current(index, element_paths)
+
+        insert_element(base_elem, 0, 'c/d', 'dd')
+        get_element(base_elem, 'c/g').append(Comment('inserted'))
+        index.invalidate(get_element(base_elem, 'c/g'))
+        self.assert_index_is_current(index, element_paths)
+
+        document = XMLDocument(base_elem, indexed=True)
+        self.assertEqual(document.get_elements_text('c/d'), get_elements_text(base_elem, 'c/d'))
+
+    def test_xml_document(self):
+        """ Tests a document gives the same results as the functions it applies to its root element """
+
+        base_elem = fromstring(self.elem_data_str)
+        data_inputs = self.elem_data_inputs + (self.elem_data_file_path,)
+
+        for data in data_inputs:
+            document = XMLDocument(data, indexed=True)
+            self.assert_elements_are_equal(document.root, base_elem)
+
+        self.assert_elements_are_equal(XMLDocument.from_url(self.elem_data_file_path).root, base_elem)
+        self.assertIsNone(XMLDocument(None).root)
+        self.assertEqual(repr(document), "XMLDocument('a')")
+        self.assertIsInstance(document.tree, ElementTree)
+
+        # Document methods apply the functions of the same name to the root
+
+        self.assertEqual(document.get_elements_text('c/d'), get_elements_text(base_elem, 'c/d'))
+        self.assertEqual(document.get_element_text('b'), get_element_text(base_elem, 'b'))
+        self.assertEqual(document.get_elements_attributes('c', 't4'), get_elements_attributes(base_elem, 'c', 't4'))
+        self.assertEqual(document.element_to_object(), element_to_object(base_elem))
+        self.assertEqual(document.element_to_dict('c'), element_to_dict(base_elem, 'c'))
+        self.assertEqual(document.query_many({'d': 'c/d'}), {'d': get_elements_text(base_elem, 'c/d')})
+        self.assertTrue(document.elements_exist(['b', 'c/g/h/i'], all_exist=True))
+        self.assertIs(document.get_element('c/d'), document.get_elements('c/d')[0])
+        self.assertEqual(document.get_element_text.__doc__, get_element_text.__doc__)
+
+        # Text, tails and attributes at simple paths are found in the document's index
+
+        with mock.patch.object(ElementIndex, 'get_elements', autospec=True, wraps=ElementIndex.get_elements) as indexed:
+            self.assertEqual(document.get_elements_text('c/d'), get_elements_text(base_elem, 'c/d'))
+            self.assertEqual(document.get_elements_tail('c/e'), get_elements_tail(base_elem, 'c/e'))
+            self.assertEqual(document.get_elements_attributes('c'), get_elements_attributes(base_elem, 'c'))
+            self.assertEqual(list(document.iter_elements_text('c/d', limit=1)), ['dd'])
+
+            self.assertEqual([call[0][1] for call in indexed.call_args_list], ['c/d', 'c/e', 'c', 'c/d'])
+
+        visited = []
+        document.iter_elements(lambda elem, **kwargs: visited.append((elem.tag, kwargs)), x='xxx')
+        self.assertEqual(visited, [(child.tag, {'x': 'xxx'}) for child in base_elem])
+
+        # Changes through the document are seen by it, and by its index of paths and parents
+
+        g_elem = document.get_element('c/g')
+        inserted = document.insert_element(0, 'c/g/h/i', 'iii')
+
+        self.assertIs(document.get_parent(g_elem), document.get_element('c'))
+        self.assertIs(document.get_parent(document.get_element('c/g/h')), g_elem)
+        self.assertIsNone(document.get_parent(document.root))
+        self.assertIsNone(document.get_parent(Element('x')))
+        self.assertIn(inserted, document.get_elements('c/g/h/i'))
+        self.assertEqual(document.get_elements('c/g/h/i'), document.root.findall('c/g/h/i'))
+
+        removed = document.remove_element('c/g/h')
+        self.assertEqual(len(removed), 2)
+        self.assertEqual(document.get_elements('c/g/h/i'), [])
+        self.assertIsNone(document.get_parent(removed[0]))
+
+        document.set_elements_text('c/x', ['x1', 'x2'])
+        self.assertEqual(document.get_elements_text('c/x'), ['x1', 'x2'])
+        self.assertIs(document.get_parent(document.get_element('c/x')), document.get_element('c'))
+
+        document.write_element(self.test_file_path)
+        self.assert_elements_are_equal(XMLDocument(self.test_file_path).root, document.root)
+
+    def test_xml_document_parents(self):
+        """ Tests the map of parents kept by a document is reused, and only rebuilt once it is out of date """
+
+        get_parents = mock.patch('parserutils.elements._get_parents', wraps=_get_parents)
+
+        with get_parents as built:
+            document = XMLDocument('<a><b><c/></b><b>x</b><d><e/></d></a>')
+
+            self.assertIs(document.get_parent(document.get_element('d/e')), document.get_element('d'))
+            self.assertEqual([elem.tag for elem in document.prune_empty('b')], ['c', 'b'])
+            self.assertIs(document.get_parent(document.get_element('d')), document.root)
+            self.assertEqual(built.call_count, 1)
+
+            # Elements moved or added other than through the document are found in a rebuilt map
+
+            moved = document.get_element('d/e')
+            document.get_element('d').remove(moved)
+            document.root.append(moved)
+            document.root.append(Element('f'))
+
+            self.assertEqual([elem.tag for elem in document.prune_empty(['e', 'd', 'f'])], ['e', 'd', 'f'])
+            self.assertEqual(element_to_string(document.root), '<a><b>x</b></a>')
+            self.assertEqual(built.call_count, 2)
+
+            self.assertEqual(prune_empty(document.root, 'b'), [])
+            self.assertEqual(built.call_count, 3)
+
+    def test_xml_document_index(self):
+        """ Tests documents are only indexed on request, and changes only invalidate the index including them """
+
+        get_indexed = mock.patch.object(ElementIndex, 'get_elements', autospec=True, wraps=ElementIndex.get_elements)
+        invalidate = mock.patch.object(ElementIndex, 'invalidate', autospec=True, wraps=ElementIndex.invalidate)
+
+        with get_indexed as indexed:
+            document = XMLDocument(self.elem_data_str)
+            self.assertEqual(document.get_elements_text('c/d'), ['dd', 'ddd'])
+            self.assertEqual(indexed.call_count, 0)
+
+            document = XMLDocument.from_url(self.elem_data_file_path, indexed=True)
+            self.assertEqual(document.get_elements_text('c/d'), ['dd', 'ddd'])
+            self.assertEqual(indexed.call_count, 1)
+
+        others = [XMLDocument(self.elem_data_str, indexed=True) for _ in range(3)]
+        with invalidate as invalidated:
+            document.insert_element(0, 'c/g/h/i', 'iii')
+            document.remove_element('c/d')
+            other_elem = others[0].get_element('c/g')
+            insert_element(other_elem, 0, 'h')
+
+        self.assertEqual(
+            [call[0][0].root for call in invalidated.call_args_list], [document.root] * 2 + [others[0].root]
+        )
+        self.assertEqual(document.get_elements_text('c/g/h/i'), ['iii'])
+        self.assertEqual(len(others[0].get_elements('c/g/h')), 3)